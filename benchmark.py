@@ -0,0 +1,707 @@
+"""
+Benchmarks for the Student Course Management System.
+
+Run ``python benchmark.py --help`` for the available benchmarks. ``core``
+times the everyday Registry operations on synthetic data of any size.
+``--json`` writes the results to a file, and ``--compare`` checks them
+against such a file and exits non-zero on a regression:
+
+    python benchmark.py core --students 1000 10000 100000 --repeat 3 --json baseline.json
+    python benchmark.py core --students 1000 10000 100000 --repeat 3 --compare baseline.json
+"""
+import argparse
+import contextlib
+import csv
+import io
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Tuple
+
+import export
+import importer
+import sharding
+from columnar import GradeColumns
+from enrollment import IdSet
+from events import CourseEnrollmentCounts, InstructorDashboard, YearEnrollmentCounts
+from journal import Journal
+from query import F
+from registry import Registry
+from reports import ReportCache, ReportEngine
+from utils import trusted_data
+
+
+@dataclass
+class Synthetic:
+    """A deterministic registry plan; positions in the lists stand in for ids until it is replayed."""
+    instructors: List[Tuple[str, str]]  # (name, email)
+    courses: List[Tuple[str, str, int, int]]  # (title, description, instructor index, year)
+    students: List[Dict]  # create_student arguments
+    enrollments: List[Tuple[int, int, float]]  # (student index, course index, grade)
+
+
+def synthetic(students: int, courses: int, per_student: int = 4, seed: int = 0) -> Synthetic:
+    rng = random.Random(seed)
+    instructors = max(1, courses // 4)
+    return Synthetic(
+        instructors=[(f"Instructor {_letters(i)}", f"instructor{i}@example.com") for i in range(instructors)],
+        courses=[(f"Course {i}", f"Synthetic course {i}", rng.randrange(instructors), rng.randint(1, 5))
+                 for i in range(courses)],
+        students=[{"name": f"Student {_letters(i)}", "email": f"student{i}@example.com", "age": rng.randint(17, 30),
+                   "year": rng.randint(1, 5), "student_type": rng.choice(("undergraduate", "graduate"))}
+                  for i in range(students)],
+        enrollments=[(i, c, round(rng.uniform(0, 100), 1))
+                     for i in range(students) for c in rng.sample(range(courses), min(per_student, courses))],
+    )
+
+
+def populate(registry: Registry, students: int, courses: int, per_student: int = 4, seed: int = 0) -> Registry:
+    """Fill ``registry`` with deterministic synthetic data and grade every enrollment."""
+    data = synthetic(students, courses, per_student, seed)
+    instructor_ids = [registry.create_instructor(name, email).id for name, email in data.instructors]
+    course_ids = [registry.create_course(title, description, instructor_ids[i], year=year).id
+                  for title, description, i, year in data.courses]
+    student_ids = [registry.create_student(**record).id for record in data.students]
+    for s, c, grade in data.enrollments:
+        course_id = course_ids[c]
+        registry.enroll_student_in_course(student_ids[s], course_id)
+        registry.set_grade(registry.get_course(course_id).instructor_id, course_id, student_ids[s], grade)
+    return registry
+
+
+def _letters(n: int) -> str:
+    # names may only contain letters and spaces
+    out = ""
+    while True:
+        n, r = divmod(n, 26)
+        out = chr(65 + r) + out
+        if not n:
+            return out
+
+
+def _time(fn: Callable, repeat: int = 3) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def dict_walk_by_student(registry: Registry) -> Dict[int, Dict[str, float]]:
+    """The pre-columnar way: walk every course and every grades dict."""
+    totals: Dict[int, list] = {}
+    for course in registry.list_courses().values():
+        for student_id, grade in course.grades.items():
+            acc = totals.setdefault(student_id, [0, 0.0])
+            acc[0] += 1
+            acc[1] += grade
+    return {sid: {"count": n, "mean": total / n} for sid, (n, total) in totals.items()}
+
+
+def dict_walk_by_year(registry: Registry) -> Dict[int, Dict[str, float]]:
+    totals: Dict[int, list] = {}
+    for course in registry.list_courses().values():
+        for grade in course.grades.values():
+            acc = totals.setdefault(course.year, [0, 0.0])
+            acc[0] += 1
+            acc[1] += grade
+    return {year: {"count": n, "mean": total / n} for year, (n, total) in totals.items()}
+
+
+def bench_columnar(students: int, courses: int) -> Dict[str, float]:
+    registry = populate(Registry(), students, courses)
+    build = _time(lambda: GradeColumns.from_courses(registry.list_courses().values()))
+    columns = registry.enable_columnar_grades()
+    rng = random.Random(0)
+    cells = list(zip(columns.course_ids, columns.student_ids))
+    regrades = [(course_id, student_id, round(rng.uniform(0, 100), 1))
+                for course_id, student_id in rng.sample(cells, max(1, len(cells) // 100))]
+
+    def regrade_then_aggregate() -> None:
+        for course_id, student_id, grade in regrades:
+            columns.set(course_id, student_id, grade)
+        registry.grade_aggregates("student")
+    return {
+        "columnar_build": build,
+        "dict_walk_by_student": _time(lambda: dict_walk_by_student(registry)),
+        "columnar_by_student": _time(lambda: registry.grade_aggregates("student")),
+        "columnar_by_student_regraded": _time(regrade_then_aggregate),
+        "dict_walk_by_year": _time(lambda: dict_walk_by_year(registry)),
+        "columnar_by_year": _time(lambda: registry.grade_aggregates("year")),
+    }
+
+
+def _cold_start(load: Callable[[Registry], None], email: str) -> float:
+    """Seconds from an empty process-level Registry to the first answered query."""
+    start = time.perf_counter()
+    registry = Registry()
+    with contextlib.redirect_stdout(io.StringIO()):
+        load(registry)
+    assert registry.find_students_by_email(email) is not None
+    return time.perf_counter() - start
+
+
+def bench_startup(students: int, courses: int) -> Dict[str, float]:
+    registry = populate(Registry(), students, courses)
+    email = f"student{students // 2}@example.com"
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = {ext: os.path.join(tmp, "data" + ext) for ext in (".json", ".ndjson", ".snap")}
+        for file_path in paths.values():
+            registry.save_to_file(file_path)
+        del registry
+        loads = {
+            "json_load_first_query": lambda r: r.load_from_file(paths[".json"]),
+            "json_lazy": lambda r: r.load_from_file(paths[".json"], lazy=True),
+            "ndjson_lazy": lambda r: r.load_from_file(paths[".ndjson"], lazy=True),
+            "snapshot_validated": lambda r: r.load_snapshot(paths[".snap"], trusted=False),
+            "snapshot_trusted": lambda r: r.load_snapshot(paths[".snap"], trusted=True),
+        }
+        return {name: _time(lambda: _cold_start(load, email), repeat=1) for name, load in loads.items()}
+
+
+def bench_import(students: int, courses: int) -> Dict[str, float]:
+    rng = random.Random(0)
+    rows = [{"name": f"Student {_letters(i)}", "email": f"student{i}@example.com", "age": str(rng.randint(17, 30)),
+             "year": str(rng.randint(1, 5)), "student_type": rng.choice(("undergraduate", "graduate"))}
+            for i in range(students)]
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = os.path.join(tmp, "students.csv")
+        with open(csv_path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=importer.FIELDS)
+            writer.writeheader()
+            writer.writerows(rows)
+
+        def registry(journaled: bool) -> Registry:
+            registry = Registry()
+            if journaled:
+                # the command line journals every change with an fsync per entry
+                journal_path = os.path.join(tmp, "import.journal")
+                if os.path.exists(journal_path):
+                    os.remove(journal_path)
+                registry.attach_journal(Journal(journal_path, fsync_every=1))
+            return registry
+
+        def one_by_one(journaled: bool = False) -> None:
+            target = registry(journaled)
+            for _, row in importer.read_rows(csv_path):
+                record, _ = importer.clean_row(row)
+                target.create_student(**record)
+
+        return {
+            "create_student_loop": _time(one_by_one, repeat=1),
+            "bulk_import": _time(lambda: importer.import_file(registry(False), csv_path), repeat=1),
+            "bulk_import_4_workers": _time(lambda: importer.import_file(registry(False), csv_path, workers=4), repeat=1),
+            "create_student_loop_journaled": _time(lambda: one_by_one(True), repeat=1),
+            "bulk_import_journaled": _time(lambda: importer.import_file(registry(True), csv_path), repeat=1),
+        }
+
+
+def _mixed_ops(registry: Registry, ops: int, seed: int) -> None:
+    rng = random.Random(seed)
+    students, courses = list(registry._students), list(registry._courses)
+    for _ in range(ops):
+        student_id, course_id = rng.choice(students), rng.choice(courses)
+        op = rng.random()
+        try:
+            if op < 0.6:
+                registry.get_student(student_id)
+                registry.course_roster(course_id)
+            elif op < 0.8:
+                registry.enroll_student_in_course(student_id, course_id)
+            elif op < 0.9:
+                registry.unenroll_student_from_course(student_id, course_id)
+            else:
+                course = registry.get_course(course_id)
+                registry.set_grade(course.instructor_id, course_id, student_id, rng.randint(0, 100))
+        except ValueError:
+            pass
+
+
+def bench_concurrency(students: int, courses: int, ops: int = 200000) -> Dict[str, float]:
+    """Ops/second of a 60% read mix; with the GIL, more threads add safety, not speed."""
+    results = {}
+    for threads in (0, 1, 2, 4, 8):
+        registry = populate(Registry(thread_safe=bool(threads)), students, courses)
+        workers = [threading.Thread(target=_mixed_ops, args=(registry, ops // max(threads, 1), n))
+                   for n in range(max(threads, 1))]
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - start
+        for course in registry.list_courses().values():
+            assert all(course.id in registry.get_student(sid).enrollments for sid in course.roster)
+        results[f"{threads}_threads_ops_per_s" if threads else "unlocked_ops_per_s"] = ops / elapsed
+    return results
+
+
+def bench_export(students: int, courses: int) -> Dict[str, float]:
+    """Rows/second of a full export per format, an incremental export after grading 1% of courses, and peak memory."""
+    registry = populate(Registry(), students, courses)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in ("grades.csv", "grades.csv.gz", "grades.ndjson.gz"):
+            start = time.perf_counter()
+            result = export.export(registry, os.path.join(tmp, name))
+            label = name.split(".", 1)[1].replace(".", "_")
+            results[f"export_{label}_rows_per_s"] = result.rows / (time.perf_counter() - start)
+        for course in list(registry.list_courses().values())[:max(1, courses // 100)]:
+            student_id = next(iter(course.roster), None)
+            if student_id is not None:
+                registry.set_grade(course.instructor_id, course.id, student_id, 50.0)
+        path = os.path.join(tmp, "changed.ndjson.gz")
+        results["export_incremental"] = _time(lambda: export.export(registry, path, since=result.watermark), repeat=1)
+        tracemalloc.start()
+        export.export(registry, os.path.join(tmp, "grades.csv.gz"))
+        results["export_peak_bytes"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return results
+
+
+def bench_reports(students: int, courses: int) -> Dict[str, float]:
+    registry = populate(Registry(), students, courses)
+    # a warm cache, then a grading session touching 1% of the courses
+    cached = ReportEngine(registry, cache=ReportCache(capacity=courses))
+    cached.render_all()
+    for course in list(registry.list_courses().values())[::100]:
+        sid = next(iter(course.roster), None)
+        if sid is not None:
+            registry.set_grade(course.instructor_id, course.id, sid, 50.0)
+    with tempfile.TemporaryDirectory() as tmp:
+
+        def print_per_line() -> None:
+            # what the menu used to do: print every line, one lookup per roster entry
+            for course in registry.list_courses().values():
+                with open(os.path.join(tmp, f"course_{course.id}.txt"), "w") as f, contextlib.redirect_stdout(f):
+                    print(f"Report for course name: {course.title} with id {course.id}")
+                    for sid in course.roster:
+                        student = registry.get_student(sid)
+                        grade = course.grades.get(sid)
+                        grade_str = f"{grade:.1f}" if grade is not None else "Marks not available at moment"
+                        print(f"{student.id}:{student.name}:{grade_str}")
+                    print(f"class average: {course.get_average_grade():.2f}")
+
+        return {
+            "print_per_line": _time(print_per_line),
+            "engine_render_all": _time(lambda: ReportEngine(registry).render_all()),
+            "engine_write_all": _time(lambda: ReportEngine(registry).write_all(tmp)),
+            "engine_write_file": _time(lambda: ReportEngine(registry).write_file(os.path.join(tmp, "reports.txt"))),
+            "engine_write_all_4_workers": _time(lambda: ReportEngine(registry, workers=4, min_parallel=0).write_all(tmp)),
+            "cached_1pct_changed": _time(lambda: cached.render_all(), repeat=1),
+        }
+
+def bench_metrics(students: int, courses: int, ops: int = 200000) -> Dict[str, float]:
+    """Ops/second of the concurrency mix without instrumentation, then with it."""
+    registry = populate(Registry(), students, courses)
+    results = {}
+    for label in ("off", "on"):
+        if label == "on":
+            registry.enable_metrics()
+        start = time.perf_counter()
+        _mixed_ops(registry, ops, seed=0)
+        results[f"metrics_{label}_ops_per_s"] = ops / (time.perf_counter() - start)
+    return results
+
+
+def bench_events(students: int, courses: int, ops: int = 200000) -> Dict[str, float]:
+    """Ops/second of the concurrency mix without events, then feeding three views; view reads vs a full recompute."""
+    registry = populate(Registry(), students, courses)
+    results = {"events_off_ops_per_s": ops / _time(lambda: _mixed_ops(registry, ops, seed=0), repeat=1)}
+    views = [registry.add_view(view) for view in (CourseEnrollmentCounts(), YearEnrollmentCounts(), InstructorDashboard())]
+    results["events_views_ops_per_s"] = ops / _time(lambda: _mixed_ops(registry, ops, seed=1), repeat=1)
+    instructors = list(registry._intructors)
+    results["view_read"] = _time(lambda: (dict(views[0].counts), dict(views[1].counts),
+                                          [views[2].summary(i) for i in instructors]))
+    results["view_recompute"] = _time(lambda: [view.rebuild(registry) for view in views])
+    return results
+
+
+def _percentiles(fn: Callable[[str], object], queries: List[str]) -> Tuple[float, float]:
+    times = []
+    for query in queries:
+        start = time.perf_counter()
+        fn(query)
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return times[len(times) // 2], times[min(len(times) - 1, len(times) * 99 // 100)]
+
+
+def bench_search(students: int, courses: int, queries: int = 2000) -> Dict[str, float]:
+    """Index build time, then p50/p99 latency of typeahead prefixes, two-word AND queries and typos."""
+    data = synthetic(students, courses, per_student=0)
+    registry = Registry()
+    for name, email in data.instructors:
+        registry.create_instructor(name, email)
+    for record in data.students:
+        registry.create_student(**record)
+    results = {"build_index": _time(lambda: (setattr(registry, "_search", None), registry.enable_search()), repeat=1)}
+    rng = random.Random(2)
+    words = [data.students[rng.randrange(students)]["name"].split()[1].lower() for _ in range(queries)]
+    prefixes = [word[:rng.randint(2, 5)] for word in words]
+    typos = [word[:1] + word[2:] + "x" if len(word) > 2 else word + "xy" for word in words]
+    cases = {
+        "typeahead": (prefixes, lambda q: registry.search(q)),
+        "and_query": (["student " + prefix for prefix in prefixes], lambda q: registry.search(q)),
+        "fuzzy": (typos, lambda q: registry.search(q, prefix=False)),
+    }
+    for label, (inputs, fn) in cases.items():
+        p50, p99 = _percentiles(fn, inputs)
+        results[f"{label}_p50"], results[f"{label}_p99"] = p50, p99
+    return results
+
+
+def bench_query(students: int, courses: int, queries: int = 200) -> Dict[str, float]:
+    """Latency of selective queries answered from an index, and of the same filters forced to scan."""
+    registry = populate(Registry(), students, courses)
+    rng = random.Random(3)
+    course_ids = [course.id for course in rng.choices(list(registry.list_courses().values()), k=queries)]
+    emails = [f"student{rng.randrange(students)}@example.com" for _ in range(queries)]
+    cases = {
+        "email": lambda i: registry.query("students", F("email") == emails[i]),
+        "grades_by_course": lambda i: registry.query(
+            "grades", (F("course_id") == course_ids[i]) & (F("student_type") == "graduate"), order_by="-grade", limit=20),
+        "members_by_year": lambda i: registry.query(
+            "students", F("courses").contains(course_ids[i]) & (F("year") == 2), order_by="name", limit=20),
+        # the same filter the index answers, hidden from the planner inside an OR
+        "scan_email": lambda i: registry.query("students", (F("email") == emails[i]) | (F("id") == 0)),
+    }
+    results = {}
+    for name, fn in cases.items():
+        rounds = 5 if name.startswith("scan") else queries
+        results[f"{name}_per_query"] = _time(lambda: [fn(i) for i in range(rounds)], repeat=1) / rounds
+    page, pages = registry.query("students", F("year") == 3, order_by="name", limit=50), 1
+    start = time.perf_counter()
+    while page.next_cursor is not None and pages < 20:
+        page = registry.query("students", F("year") == 3, order_by="name", limit=50, cursor=page.next_cursor)
+        pages += 1
+    results["year_page_per_query"] = (time.perf_counter() - start) / max(1, pages - 1)
+    return results
+
+
+def bench_transactions(students: int, courses: int, batch: int = 500) -> Dict[str, float]:
+    """Enroll-and-grade batches of ``batch`` students: one call at a time vs inside a transaction, then a rollback."""
+    results: Dict[str, float] = {}
+
+    def batches(registry: Registry) -> List[Tuple[int, int, List[int]]]:
+        # (instructor, course, students) per course, students not yet enrolled in it
+        student_ids = [registry.create_student(**record).id for record in synthetic(students, 0).students]
+        instructor = registry.create_instructor("Instructor A", "instructor@example.com").id
+        rng = random.Random(4)
+        return [(instructor, registry.create_course(f"Course {i}", "Synthetic", instructor, year=1).id,
+                 rng.sample(student_ids, min(batch, len(student_ids)))) for i in range(max(1, courses // 20))]
+
+    def per_call(registry: Registry, work) -> None:
+        for instructor, course_id, student_ids in work:
+            for sid in student_ids:
+                registry.enroll_student_in_course(sid, course_id)
+                registry.set_grade(instructor, course_id, sid, 75.0)
+
+    def transactional(registry: Registry, work) -> None:
+        for instructor, course_id, student_ids in work:
+            with registry.transaction():
+                registry.enroll_many(course_id, student_ids)
+                for sid in student_ids:
+                    registry.set_grade(instructor, course_id, sid, 75.0)
+
+    for journaled in (True, False):
+        for label, fn in (("per_call", per_call), ("transaction", transactional)):
+            with tempfile.TemporaryDirectory() as tmp:
+                registry = Registry()
+                if journaled:
+                    registry.attach_journal(Journal(os.path.join(tmp, "data.journal")), os.path.join(tmp, "data.json"))
+                work = batches(registry)
+                start = time.perf_counter()
+                fn(registry, work)
+                ops = 2 * sum(len(student_ids) for _, _, student_ids in work)
+                results[f"{label}{'_journaled' if journaled else ''}_per_s"] = ops / (time.perf_counter() - start)
+                if journaled:
+                    registry.detach_journal().close()
+    registry = Registry()
+    instructor, course_id, student_ids = batches(registry)[0]
+
+    def rolled_back() -> None:
+        try:
+            with registry.transaction():
+                transactional(registry, [(instructor, course_id, student_ids)])
+                raise RuntimeError("roll back")
+        except RuntimeError:
+            pass
+
+    # applying the batch and undoing it
+    results["rollback_batch"] = _time(rolled_back, repeat=3)
+    return results
+
+
+def _merge_packed(packed: List[Dict]) -> Registry:
+    registry = Registry()
+    with registry._bulk_load(), trusted_data():
+        sharding._add_shards(registry, [sharding._unpacked(shard) for shard in packed])
+    return registry
+
+
+def bench_sharding(students: int, courses: int, shards: int = 8) -> Dict[str, float]:
+    """
+    Full sharded save and load, serial and with one process per CPU, then a
+    save after changing a few students. A parallel load also has its two
+    parts timed on their own: load_slowest_shard is the slowest worker's
+    share and load_merge this process's. With a CPU per shard a parallel load
+    takes about their sum (plus starting the pool), against load_serial.
+    """
+    registry = populate(Registry(), students, courses)
+    workers = os.cpu_count() or 1
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp, contextlib.redirect_stdout(io.StringIO()):
+        results["save_json"] = _time(lambda: registry.save_to_file(os.path.join(tmp, "data.json")), repeat=1)
+        for label, count in (("serial", 0), (f"{workers}_workers", workers)):
+            # a new directory, so every shard is written
+            path = os.path.join(tmp, f"{label}.shards")
+            results[f"save_{label}"] = _time(lambda: registry.save_sharded(path, shards, workers=count), repeat=1)
+            results[f"load_{label}"] = _time(lambda: Registry().load_sharded(path, workers=count), repeat=1)
+        directory = os.path.join(tmp, "serial.shards")
+        packed, slowest = [], 0.0
+        for name in sharding.read_manifest(directory)["files"].values():
+            start = time.perf_counter()
+            packed.append(sharding._packed_shard(os.path.join(directory, name)))
+            slowest = max(slowest, time.perf_counter() - start)
+        results["load_slowest_shard"] = slowest
+        results["load_merge"] = _time(lambda: _merge_packed(packed), repeat=1)
+        rng = random.Random(5)
+        for student_id in rng.sample(list(registry.list_students()), 3):
+            registry.update_student(student_id, age=25)
+        results["save_3_changed"] = _time(lambda: registry.save_sharded(path, shards, workers=workers), repeat=1)
+    return results
+
+
+@dataclass
+class DictStudent:
+    """A student in the layout before slots and packed arrays: a per-object __dict__, a dict-backed id set."""
+    id: int
+    name: str
+    email: str
+    age: int
+    year: int
+    enrollments: IdSet = field(default_factory=IdSet)
+    student_type: str = "student"
+
+
+def _layout_bytes(text: str, make_student: Callable[[int, Dict], object], courses: int,
+                  per_student: int) -> Tuple[float, float]:
+    """Traced bytes per student entity and per enrollment (the student's side plus the roster's)."""
+    rng = random.Random(1)
+    rosters = [IdSet() for _ in range(courses)]
+    tracemalloc.start()
+    try:
+        base = tracemalloc.get_traced_memory()[0]
+        records = json.loads(text)
+        students = [make_student(i, record) for i, record in enumerate(records)]
+        del records
+        after_students = tracemalloc.get_traced_memory()[0]
+        plan = [rng.sample(range(courses), min(per_student, courses)) for _ in students]
+        before_enroll = tracemalloc.get_traced_memory()[0]
+        for student, course_ids in zip(students, plan):
+            for course_id in course_ids:
+                student.enrollments.add(course_id)
+                rosters[course_id].add(student.id)
+        after_enroll = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return (after_students - base) / len(students), (after_enroll - before_enroll) / sum(map(len, plan))
+
+
+def bench_memory(students: int, courses: int, per_student: int = 4) -> Dict[str, float]:
+    """
+    Traced bytes per student (entity plus index entries) and per enrollment
+    (both directions) in a Registry, then per entity and enrollment alone in
+    the layout before the compact one (DictStudent) and in the current one.
+    """
+    rng = random.Random(0)
+    text = json.dumps([
+        {"name": f"Student {_letters(i)}", "email": f"student{i}@example.com", "age": rng.randint(17, 30),
+         "year": rng.randint(1, 5), "student_type": rng.choice(("undergraduate", "graduate"))}
+        for i in range(students)])
+    registry = Registry()
+    instructor = registry.create_instructor("Instructor A", "instructor@example.com")
+    course_ids = [registry.create_course(f"Course {i}", "Synthetic", instructor.id, year=1).id for i in range(courses)]
+    rosters: Dict[int, list] = {course_id: [] for course_id in course_ids}
+    tracemalloc.start()
+    try:
+        base = tracemalloc.get_traced_memory()[0]
+        # records as they come out of a file; what the students keep of them is counted, the rest is freed
+        records = json.loads(text)
+        created, _ = registry.create_students(records, validated=True)
+        del records
+        after_students = tracemalloc.get_traced_memory()[0]
+        for student in created:
+            for course_id in rng.sample(course_ids, min(per_student, courses)):
+                rosters[course_id].append(student.id)
+        before_enroll = tracemalloc.get_traced_memory()[0]
+        for course_id, student_ids in rosters.items():
+            registry.enroll_many(course_id, student_ids)
+        after_enroll = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    enrollments = sum(len(ids) for ids in rosters.values())
+    del registry, created
+    before_student, before_enrollment = _layout_bytes(
+        text, lambda i, record: DictStudent(id=i, **record), courses, per_student)
+    with trusted_data():
+        after_student, after_enrollment = _layout_bytes(
+            text, lambda i, record: Registry._build_entity("students", dict(record, id=i)), courses, per_student)
+    return {
+        "per_student_bytes": (after_students - base) / students,
+        "per_enrollment_bytes": (after_enroll - before_enroll) / enrollments,
+        "dict_layout_student_bytes": before_student,
+        "compact_student_bytes": after_student,
+        "dict_layout_enrollment_bytes": before_enrollment,
+        "compact_enrollment_bytes": after_enrollment,
+    }
+
+
+def bench_core(students: int, courses: int, lookups: int = 100000) -> Dict[str, float]:
+    """Ops/second of each Registry operation while building a registry, then seconds for the bulk ones."""
+    data = synthetic(students, courses)
+    registry = Registry()
+    results: Dict[str, float] = {}
+
+    def rate(name: str, calls: int, fn: Callable[[], None]) -> None:
+        start = time.perf_counter()
+        fn()
+        results[f"{name}_per_s"] = calls / (time.perf_counter() - start)
+
+    instructor_ids: List[int] = []
+    course_ids: List[int] = []
+    student_ids: List[int] = []
+    rate("create_instructor", len(data.instructors), lambda: instructor_ids.extend(
+        registry.create_instructor(name, email).id for name, email in data.instructors))
+    rate("create_course", len(data.courses), lambda: course_ids.extend(
+        registry.create_course(title, description, instructor_ids[i], year=year).id
+        for title, description, i, year in data.courses))
+    rate("create_student", len(data.students), lambda: student_ids.extend(
+        registry.create_student(**record).id for record in data.students))
+
+    def enroll() -> None:
+        for s, c, _ in data.enrollments:
+            registry.enroll_student_in_course(student_ids[s], course_ids[c])
+
+    def grade() -> None:
+        owners = {course_id: registry.get_course(course_id).instructor_id for course_id in course_ids}
+        for s, c, value in data.enrollments:
+            registry.set_grade(owners[course_ids[c]], course_ids[c], student_ids[s], value)
+
+    rate("enroll_student_in_course", len(data.enrollments), enroll)
+    rate("set_grade", len(data.enrollments), grade)
+    rng = random.Random(1)
+    emails = [data.students[rng.randrange(students)]["email"].upper() for _ in range(lookups)]
+    rate("find_students_by_email", lookups, lambda: [registry.find_students_by_email(e) for e in emails])
+    all_courses = list(registry.list_courses().values())
+    # the first call builds each course's running statistics from its grades
+    results["grade_stats_first_use"] = _time(lambda: [course.get_average_grade() for course in all_courses], repeat=1)
+    rounds = max(1, lookups // max(1, courses))
+    rate("get_average_grade", rounds * len(all_courses),
+         lambda: [course.get_average_grade() for _ in range(rounds) for course in all_courses])
+    results["report_render_all"] = _time(lambda: ReportEngine(registry).render_all(), repeat=1)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "data.json")
+        results["save_to_file"] = _time(lambda: registry.save_to_file(path), repeat=1)
+        with contextlib.redirect_stdout(io.StringIO()):
+            results["load_from_file"] = _time(lambda: Registry().load_from_file(path), repeat=1)
+    return results
+
+
+BENCHMARKS = {
+    "columnar": bench_columnar,
+    "concurrency": bench_concurrency,
+    "core": bench_core,
+    "events": bench_events,
+    "export": bench_export,
+    "import": bench_import,
+    "memory": bench_memory,
+    "metrics": bench_metrics,
+    "query": bench_query,
+    "reports": bench_reports,
+    "search": bench_search,
+    "sharding": bench_sharding,
+    "startup": bench_startup,
+    "transactions": bench_transactions,
+}
+
+
+def _format(name: str, value: float) -> str:
+    if name.endswith("_per_s"):
+        return f"{value:10.0f}"
+    if name.endswith("_bytes"):
+        return f"{value:10.1f} B"
+    return f"{value * 1000:10.2f} ms"
+
+
+def _best(runs: List[Dict[str, float]]) -> Dict[str, float]:
+    """Best value of each metric over repeated runs: the highest rate, the lowest time or size."""
+    pick = {name: max if name.endswith("_per_s") else min for name in runs[0]}
+    return {name: pick[name](run[name] for run in runs) for name in runs[0]}
+
+
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]],
+            threshold: float) -> List[Tuple[str, str, float]]:
+    """
+    ``(run, metric, change)`` for every metric that got worse than the
+    baseline by more than ``threshold`` (0.2 = 20%). Rates (``_per_s``) are
+    worse when lower; times and byte counts when higher.
+    """
+    regressions = []
+    for run, metrics in results.items():
+        for name, value in metrics.items():
+            old = baseline.get(run, {}).get(name)
+            if not old:
+                continue
+            change = (old - value) / old if name.endswith("_per_s") else (value - old) / old
+            if change > threshold:
+                regressions.append((run, name, change))
+    return regressions
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS))
+    parser.add_argument("--students", type=int, nargs="+", default=[20000],
+                        help="one or more registry sizes, e.g. --students 1000 10000 100000 1000000")
+    parser.add_argument("--courses", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=1, help="run each size this many times and keep the best values")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--compare", help="results file (from --json) to check these results against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown before --compare fails (0.2 = 20%%)")
+    args = parser.parse_args(argv)
+    results: Dict[str, Dict[str, float]] = {}  # "<students>x<courses>" -> metrics
+    for students in args.students:
+        print(f"== {args.benchmark}: {students} students, {args.courses} courses")
+        run = results[f"{students}x{args.courses}"] = _best(
+            [BENCHMARKS[args.benchmark](students, args.courses) for _ in range(max(1, args.repeat))])
+        for name, value in run.items():
+            print(f"{name:<28} {_format(name, value)}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"benchmark": args.benchmark, "python": platform.python_version(),
+                       "machine": platform.machine(), "results": results}, f, indent=2)
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("benchmark") != args.benchmark:
+            raise SystemExit(f"{args.compare} holds {baseline.get('benchmark')!r} results, not {args.benchmark!r}")
+        regressions = compare(results, baseline["results"], args.threshold)
+        for run, name, change in regressions:
+            print(f"REGRESSION {run} {name}: {change:+.0%} worse than {args.compare}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions beyond {args.threshold:.0%} against {args.compare}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+from array import array
+from typing import Dict, Iterable, Mapping, Optional, Set, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional; the pure Python path gives the same results
+    np = None
+
+
+class GradeColumns:
+    """
+    Columnar copy of every grade in the registry: parallel ``course_id``,
+    ``student_id`` and ``grade`` arrays (8 bytes per cell) plus a row lookup
+    so an overwrite is an in-place store and a removal is a swap with the
+    last row.
+
+    Group-by aggregations run over the packed columns. With numpy installed
+    they are vectorized over zero-copy views of the arrays. Without it, the
+    rows of every course and every student are also kept per group, with
+    cached ``[count, sum, min, max]`` totals; a change only marks its course
+    and student stale, and a query recomputes just the stale groups.
+    """
+
+    def __init__(self):
+        self.course_ids = array("q")
+        self.student_ids = array("q")
+        self.grades = array("d")
+        self._rows: Dict[Tuple[int, int], int] = {}
+        self._courses = _Groups()
+        self._students = _Groups()
+
+    @classmethod
+    def from_courses(cls, courses: Iterable) -> "GradeColumns":
+        columns = cls()
+        for course in courses:
+            for student_id, grade in course.grades.items():
+                columns.set(course.id, student_id, grade)
+        if np is None:
+            # computed with the build, so the first query is as cheap as later ones
+            columns._courses.current(columns.course_ids, columns.grades)
+            columns._students.current(columns.student_ids, columns.grades)
+        return columns
+
+    def __len__(self) -> int:
+        return len(self.grades)
+
+    def set(self, course_id: int, student_id: int, grade: float) -> None:
+        row = self._rows.get((course_id, student_id))
+        if row is None:
+            row = self._rows[(course_id, student_id)] = len(self.grades)
+            self.course_ids.append(course_id)
+            self.student_ids.append(student_id)
+            self.grades.append(grade)
+            self._courses.add(course_id, row)
+            self._students.add(student_id, row)
+        else:
+            self.grades[row] = grade
+            self._courses.stale.add(course_id)
+            self._students.stale.add(student_id)
+
+    def remove(self, course_id: int, student_id: int) -> None:
+        row = self._rows.pop((course_id, student_id), None)
+        if row is None:
+            return
+        self._courses.drop(course_id, row)
+        self._students.drop(student_id, row)
+        last = len(self.grades) - 1
+        if row != last:
+            moved_course, moved_student = self.course_ids[last], self.student_ids[last]
+            self.course_ids[row] = moved_course
+            self.student_ids[row] = moved_student
+            self.grades[row] = self.grades[last]
+            self._rows[(moved_course, moved_student)] = row
+            self._courses.move(moved_course, last, row)
+            self._students.move(moved_student, last, row)
+        self.course_ids.pop()
+        self.student_ids.pop()
+        self.grades.pop()
+
+    def clear(self) -> None:
+        self.__init__()
+
+    def by_course(self) -> Dict[int, Dict[str, float]]:
+        return self._aggregate(self.course_ids)
+
+    def by_student(self) -> Dict[int, Dict[str, float]]:
+        return self._aggregate(self.student_ids)
+
+    def by_course_attribute(self, course_attribute: Mapping[int, Optional[int]]) -> Dict[int, Dict[str, float]]:
+        """
+        Group by a per-course attribute such as the instructor id or the course
+        year. Courses whose attribute is None are left out.
+        """
+        return self._aggregate(self.course_ids, course_attribute)
+
+    def _aggregate(self, keys: array, mapping: Optional[Mapping[int, Optional[int]]] = None) -> Dict[int, Dict[str, float]]:
+        if not self.grades:
+            return {}
+        if np is not None:
+            return self._aggregate_numpy(keys, mapping)
+        totals = (self._students if keys is self.student_ids else self._courses).current(keys, self.grades)
+        if mapping is None:
+            return {key: _group(*group) for key, group in totals.items()}
+        # merge the per-course totals per attribute value
+        merged: Dict[int, list] = {}
+        for course_id, (count, total, low, high) in totals.items():
+            key = mapping.get(course_id)
+            if key is None:
+                continue
+            acc = merged.get(key)
+            if acc is None:
+                merged[key] = [count, total, low, high]
+            else:
+                acc[0] += count
+                acc[1] += total
+                if low < acc[2]:
+                    acc[2] = low
+                if high > acc[3]:
+                    acc[3] = high
+        return {key: _group(*group) for key, group in merged.items()}
+
+    def _aggregate_numpy(self, keys: array, mapping: Optional[Mapping[int, Optional[int]]]) -> Dict[int, Dict[str, float]]:
+        key_col = np.frombuffer(keys, dtype=np.int64)
+        grades = np.frombuffer(self.grades, dtype=np.float64)
+        if mapping is not None:
+            # look-up table indexed by course id; -1 marks "no attribute"
+            lut = np.full(int(key_col.max()) + 1, -1, dtype=np.int64)
+            for course_id, value in mapping.items():
+                if value is not None and course_id < len(lut):
+                    lut[course_id] = value
+            key_col = lut[key_col]
+            keep = key_col >= 0
+            key_col, grades = key_col[keep], grades[keep]
+            if not len(key_col):
+                return {}
+        groups, inverse = np.unique(key_col, return_inverse=True)
+        counts = np.bincount(inverse, minlength=len(groups))
+        sums = np.bincount(inverse, weights=grades, minlength=len(groups))
+        lows = np.full(len(groups), np.inf)
+        highs = np.full(len(groups), -np.inf)
+        np.minimum.at(lows, inverse, grades)
+        np.maximum.at(highs, inverse, grades)
+        return {
+            int(key): _group(int(count), float(total), float(low), float(high))
+            for key, count, total, low, high in zip(groups, counts, sums, lows, highs)
+        }
+
+
+class _Groups:
+    """The rows of each key of one column, with cached ``[count, sum, min, max]`` per key."""
+
+    __slots__ = ("rows", "totals", "stale")
+
+    def __init__(self):
+        self.rows: Dict[int, array] = {}
+        self.totals: Dict[int, list] = {}
+        self.stale: Set[int] = set()
+
+    def add(self, key: int, row: int) -> None:
+        rows = self.rows.get(key)
+        if rows is None:
+            rows = self.rows[key] = array("q")
+        rows.append(row)
+        self.stale.add(key)
+
+    def drop(self, key: int, row: int) -> None:
+        rows = self.rows[key]
+        rows.remove(row)
+        if not rows:
+            del self.rows[key]
+        self.stale.add(key)
+
+    def move(self, key: int, old: int, new: int) -> None:
+        # the grade moves with its row, so the totals stay valid
+        rows = self.rows[key]
+        rows[rows.index(old)] = new
+
+    def current(self, keys: array, grades: array) -> Dict[int, list]:
+        if len(self.stale) > len(self.rows) // 2:
+            self.totals = _totals(keys, grades)
+            self.stale.clear()
+        for key in self.stale:
+            rows = self.rows.get(key)
+            if rows is None:
+                self.totals.pop(key, None)
+            else:
+                values = [grades[row] for row in rows]
+                self.totals[key] = [len(values), sum(values), min(values), max(values)]
+        self.stale.clear()
+        return self.totals
+
+
+def _totals(keys: array, grades: array) -> Dict[int, list]:
+    """``[count, sum, min, max]`` per key in one pass over the columns."""
+    totals: Dict[int, list] = {}
+    for key, grade in zip(keys, grades):
+        acc = totals.get(key)
+        if acc is None:
+            totals[key] = [1, grade, grade, grade]
+        else:
+            acc[0] += 1
+            acc[1] += grade
+            if grade < acc[2]:
+                acc[2] = grade
+            if grade > acc[3]:
+                acc[3] = grade
+    return totals
+
+
+def _group(count: int, total: float, low: float, high: float) -> Dict[str, float]:
+    return {"count": count, "mean": total / count, "min": low, "max": high}
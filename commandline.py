@@ -1,10 +1,193 @@
-from  registry import Registry
+import argparse
+import json
+import sys
+import time
+from typing import IO, Iterable, Optional, Tuple
+import operations
+from  registry import Registry, journal_file
+from journal import Journal
+from importer import import_file
 from utils import validate_email, valid_age, valid_year
-from reports import CourseReport
+from reports import ReportCache, ReportEngine
+from export import export
 
-def main():
+# reports the menu already rendered, reused until their course changes
+report_cache = ReportCache()
+
+# batch command names for the registry operations they run (see operations.OPERATIONS for the rest)
+BATCH_ALIASES = {
+    "register": "create_student",
+    "register_instructor": "create_instructor",
+    "enroll": "enroll_student_in_course",
+    "unenroll": "unenroll_student_from_course",
+    "grade": "set_grade",
+}
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Student Course Management System (interactive without a command)")
+    commands = parser.add_subparsers(dest="command")
+    importing = commands.add_parser("import", help="bulk import students from a .csv or .ndjson file")
+    importing.add_argument("file", help="CSV with a name,email,age,year[,student_type] header, or one JSON object per line")
+    importing.add_argument("--workers", type=int, default=0, help="validate in this many processes (default: in-process)")
+    importing.add_argument("--batch-size", type=int, default=5000)
+    importing.add_argument("--errors", help="write the per-row error report to this CSV file")
+    reporting = commands.add_parser("reports", help="write course reports, one file per course")
+    reporting.add_argument("path", help="directory to write course_<id>.txt files into, or the file with --one-file")
+    reporting.add_argument("--one-file", action="store_true", help="write every report into the single file PATH")
+    reporting.add_argument("--instructor", type=int, help="only this instructor's courses (default: every course)")
+    reporting.add_argument("--workers", type=int, default=0, help="render in this many processes (default: in-process)")
+    exporting = commands.add_parser("export", help="write every enrollment and grade as rows for analytics")
+    exporting.add_argument("path", help="a .csv, .ndjson or .jsonl file, gzip-compressed if it ends in .gz")
+    exporting.add_argument("--chunk-rows", type=int, default=10000, help="rows encoded and written at a time")
+    exporting.add_argument("--since", help="only the courses changed after this watermark, printed by the last export")
+    batch = commands.add_parser("batch", help="run JSON commands, one per line, without the menus")
+    batch.add_argument("file", nargs="?", default="-", help='commands like {"op": "enroll", "args": {...}} (default: stdin)')
+    batch.add_argument("--output", default="-", help="write one JSON result per command here (default: stdout)")
+    batch.add_argument("--autosave-every", type=int, default=0, help="also save after this many commands (0: only by time)")
+    batch.add_argument("--autosave-seconds", type=float, default=60.0, help="save when this many seconds passed (0 disables)")
+    return parser.parse_args(argv)
+
+def import_students(registry: Registry, args: argparse.Namespace):
+    report = import_file(registry, args.file, batch_size=args.batch_size, workers=args.workers)
+    print(f"Imported {len(report.created)} of {report.rows} rows from {args.file}.")
+    if report.errors:
+        if args.errors:
+            report.write_errors(args.errors)
+            print(f"{len(report.errors)} rows rejected, see {args.errors}.")
+        else:
+            for line_no, error in report.errors:
+                print(f"line {line_no}: {error}")
+
+def write_reports(registry: Registry, args: argparse.Namespace):
+    engine = ReportEngine(registry, workers=args.workers)
+    course_ids = None
+    if args.instructor is not None:
+        instructor = registry.get_instructor(args.instructor)
+        if instructor is None:
+            print(f"Instructor with ID {args.instructor} does not exist.")
+            return
+        course_ids = list(instructor.courses)
+    if args.one_file:
+        count = engine.write_file(args.path, course_ids)
+    else:
+        count = len(engine.write_all(args.path, course_ids))
+    print(f"Wrote {count} course reports to {args.path}.")
+
+def export_rows(registry: Registry, args: argparse.Namespace):
+    result = export(registry, args.path, since=args.since, chunk_rows=args.chunk_rows)
+    kind = "rows" if result.full else "changed rows"
+    print(f"Exported {result.rows} {kind} of {len(result.courses)} courses to {args.path}.")
+    if result.watermark:
+        print(f"Watermark: {result.watermark}")
+
+def save(registry: Registry):
+    # with a journal, saving is folding it into a fresh snapshot
+    if registry._journal is not None:
+        registry.compact_journal()
+    else:
+        registry.save_to_file(registry._snapshot_path)
+
+def run_command(registry: Registry, request: dict) -> dict:
+    op = BATCH_ALIASES.get(request.get("op"), request.get("op"))
+    args = request.get("args") or {}
+    if op == "save":
+        save(registry)
+        return {"id": request.get("id"), "ok": True, "result": registry._snapshot_path}
+    if op == "report":
+        engine = ReportEngine(registry, cache=report_cache)
+        try:
+            if "course_id" in args:
+                result = engine.render(args["course_id"])
+            elif "instructor_id" in args:
+                result = engine.render_instructor(args["instructor_id"])
+            else:
+                result = engine.render_all()
+        except ValueError as e:
+            return {"id": request.get("id"), "ok": False, "error": str(e)}
+        return {"id": request.get("id"), "ok": True, "result": result}
+    return operations.handle(registry, dict(request, op=op))
+
+def run_commands(registry: Registry, lines: Iterable[str], out: IO[str], autosave_every: int = 0,
+                 autosave_seconds: Optional[float] = None) -> Tuple[int, int]:
+    """
+    Run one JSON command per line and write one JSON result per line to
+    ``out``; a failed command is reported and the batch goes on. A command
+    without an ``id`` gets its line number. Returns (commands, failures).
+    """
+    commands = failures = since_save = 0
+    last_save = time.monotonic()
+    for line_no, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        # reset per line: a parse that fails must not leave the previous command's id behind
+        request = None
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("command must be a JSON object")
+            request.setdefault("id", line_no)
+            response = run_command(registry, request)
+        except ValueError as e:
+            response = {"id": line_no, "ok": False, "error": f"Invalid command: {e}"}
+        except Exception as e:
+            # e.g. wrongly typed arguments; one bad command must not end the batch or its autosaves
+            command_id = request.get("id", line_no) if isinstance(request, dict) else line_no
+            response = {"id": command_id, "ok": False, "error": f"{type(e).__name__}: {e}"}
+        out.write(json.dumps(response, separators=(",", ":")) + "\n")
+        commands += 1
+        failures += not response["ok"]
+        since_save += 1
+        if (autosave_every and since_save >= autosave_every) or (
+                autosave_seconds and time.monotonic() - last_save >= autosave_seconds):
+            save(registry)
+            since_save, last_save = 0, time.monotonic()
+    return commands, failures
+
+def batch_commands(registry: Registry, args: argparse.Namespace) -> int:
+    source = sys.stdin if args.file == "-" else open(args.file, "r", encoding="utf-8")
+    out = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    start = time.perf_counter()
+    try:
+        commands, failures = run_commands(registry, source, out, args.autosave_every, args.autosave_seconds)
+    finally:
+        for f in (source, out):
+            if f not in (sys.stdin, sys.stdout):
+                f.close()
+    elapsed = time.perf_counter() - start
+    print(f"{commands} commands, {failures} failed, {commands / elapsed if elapsed else 0:.0f} commands/s",
+          file=sys.stderr)
+    return failures
+
+def main(argv=None):
+    args = parse_args(argv)
     registry = Registry()
-    registry.load_from_file()
+    # replay anything done since the last save, then keep journaling every change
+    registry.recover()
+    if args.command == "batch":
+        # the journal is flushed on every change but synced once a second; autosaves fold it into a snapshot
+        registry.attach_journal(Journal(journal_file, fsync_every=0, fsync_interval=1.0))
+        failures = batch_commands(registry, args)
+        if registry._journal.entries_since_checkpoint:
+            registry.compact_journal()
+        registry.detach_journal().close()
+        if failures:
+            raise SystemExit(1)
+        return
+    registry.attach_journal(Journal(journal_file, fsync_every=1), compact_every=1000)
+
+    if args.command == "import":
+        import_students(registry, args)
+        registry.compact_journal()
+        registry.detach_journal().close()
+        return
+    if args.command == "reports":
+        write_reports(registry, args)
+        registry.detach_journal().close()
+        return
+    if args.command == "export":
+        export_rows(registry, args)
+        registry.detach_journal().close()
+        return
 
     while True:
         print("=========Student Course Management System=========\nCommandline interface \nMenu:")
@@ -22,7 +205,8 @@ def main():
         elif choice == "3":
             course_management_portal(registry)
         elif choice == "4":
-            registry.save_to_file()
+            registry.compact_journal()
+            registry.detach_journal().close()
             print("Data saved. Goodbye! and see you next time.\nexit........")
             break
         else:
@@ -162,9 +346,7 @@ def instructor_menu(registry, instructor):
         elif choice == "3":
             cid = input("Enter course ID to generate report: ").strip()
             if cid.isdigit() and int(cid) in instructor.courses:
-                course = registry.get_course(int(cid))
-                report = CourseReport(registry, int(cid))
-                report.generate()
+                print(ReportEngine(registry, cache=report_cache).render(int(cid)), end="")
             else:
                 print("Invalid course ID or you are not assigned to this course.")
                 
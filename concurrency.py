@@ -0,0 +1,154 @@
+"""
+Locking for a Registry shared between threads (``Registry(thread_safe=True)``).
+
+The registry-wide ``RWLock`` is held shared by lookups and by enrollment and
+grading, which additionally serialize per course; creating entities, loading,
+saving and registry-wide analytics hold it exclusively. The decorators below
+are no-ops on a registry that was not created thread safe.
+"""
+import functools
+import inspect
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict
+
+
+class RWLock:
+    """
+    Any number of readers or one writer. A waiting writer blocks new readers so
+    writers are not starved. Both locks nest, and the writing thread may take
+    the read lock too; upgrading a read lock to a write lock is an error.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = None
+        self._write_depth = 0
+        self._writers_waiting = 0
+        self._local = threading.local()  # per thread: read depth, counted as a reader?
+
+    def acquire_read(self) -> None:
+        local = self._local
+        depth = getattr(local, "depth", 0)
+        if not depth:
+            # the writer reads under its own write lock
+            local.counted = self._writer != threading.get_ident()
+            if local.counted:
+                with self._cond:
+                    while self._writer is not None or self._writers_waiting:
+                        self._cond.wait()
+                    self._readers += 1
+        local.depth = depth + 1
+
+    def release_read(self) -> None:
+        local = self._local
+        local.depth -= 1
+        if not local.depth and local.counted:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    def acquire_write(self) -> None:
+        me = threading.get_ident()
+        if self._writer == me:
+            self._write_depth += 1
+            return
+        if getattr(self._local, "depth", 0):
+            raise RuntimeError("Cannot take the write lock while holding the read lock")
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writer is not None or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writer = me
+            self._write_depth = 1
+
+    def release_write(self) -> None:
+        self._write_depth -= 1
+        if not self._write_depth:
+            with self._cond:
+                self._writer = None
+                self._cond.notify_all()
+
+    @contextmanager
+    def read(self):
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextmanager
+    def write(self):
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
+
+
+class LockTable:
+    """One lock per key, created on first use."""
+
+    def __init__(self):
+        self._locks: Dict[int, threading.RLock] = {}
+
+    def __getitem__(self, key: int) -> threading.RLock:
+        lock = self._locks.get(key)
+        if lock is None:
+            # setdefault is atomic, so racing threads still share one lock
+            lock = self._locks.setdefault(key, threading.RLock())
+        return lock
+
+
+def shared(method: Callable) -> Callable:
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        lock = self._lock
+        if lock is None:
+            return method(self, *args, **kwargs)
+        lock.acquire_read()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            lock.release_read()
+
+    return wrapper
+
+
+def exclusive(method: Callable) -> Callable:
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        lock = self._lock
+        if lock is None:
+            return method(self, *args, **kwargs)
+        lock.acquire_write()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            lock.release_write()
+
+    return wrapper
+
+
+def per_course(method: Callable) -> Callable:
+    """Shared registry lock plus the lock of the method's ``course_id`` argument."""
+    # position of course_id among the arguments after self
+    position = list(inspect.signature(method).parameters).index("course_id") - 1
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        lock = self._lock
+        if lock is None:
+            return method(self, *args, **kwargs)
+        course_id = args[position] if len(args) > position else kwargs["course_id"]
+        lock.acquire_read()
+        try:
+            with self._course_locks[course_id]:
+                return method(self, *args, **kwargs)
+        finally:
+            lock.release_read()
+
+    return wrapper
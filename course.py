@@ -1,45 +1,134 @@
+import math
+import threading
 from dataclasses import dataclass, field
-from typing import List, Dict, Optional
-from utils import nonempty
+from typing import Dict, List, Optional, Sequence, Tuple
+from utils import nonempty, validation_enabled
+from enrollment import IdSet
+from gradestats import GradeStats
+from ranking import GradeRanking
 
-@dataclass
+# one counter for every course, so a reloaded course never reuses a version.
+# Loading a course moves it past the course's saved version (advance_versions),
+# so versions drawn after a restart are above every version loaded
+_version_lock = threading.Lock()
+_last_version = 0
+
+
+def next_version() -> int:
+    global _last_version
+    with _version_lock:
+        _last_version += 1
+        return _last_version
+
+
+def last_version() -> int:
+    """The highest version drawn or loaded so far."""
+    return _last_version
+
+
+def advance_versions(version: int) -> None:
+    """Draw every later version above ``version``."""
+    global _last_version
+    if version > _last_version:
+        with _version_lock:
+            _last_version = max(_last_version, version)
+
+
+@dataclass(slots=True)
 class Course:
     id: int
     title: str
     description: str
     year : int
     instructor_id: Optional[int] = None
-    roster: List[int] = field(default_factory=list)
+    roster: IdSet = field(default_factory=IdSet)
     grades: Dict[int, float] = field(default_factory=dict)
+    # grade views are built on first use, so loading a course stays cheap
+    _stats: Optional[GradeStats] = field(default=None, init=False, repr=False, compare=False)
+    _ranking: Optional[GradeRanking] = field(default=None, init=False, repr=False, compare=False)
+    # increases whenever anything a report shows changes (see touch); saved with the course
+    version: int = field(default_factory=next_version, repr=False, compare=False)
 
     def __post_init__(self):
-        if not nonempty(self.title):
-            raise ValueError("Course title cannot be empty")
-        if not nonempty(self.description):
-            raise ValueError("Course description cannot be empty")
+        if validation_enabled():
+            if not nonempty(self.title):
+                raise ValueError("Course title cannot be empty")
+            if not nonempty(self.description):
+                raise ValueError("Course description cannot be empty")
+        advance_versions(self.version)
+        if not isinstance(self.roster, IdSet):
+            self.roster = IdSet(self.roster)
+        # JSON turns the int keys of grades into strings
+        self.grades = {int(sid): grade for sid, grade in self.grades.items()}
+
+    @property
+    def stats(self) -> GradeStats:
+        if self._stats is None:
+            self._stats = GradeStats(self.grades.values())
+        return self._stats
+
+    @property
+    def ranking(self) -> GradeRanking:
+        if self._ranking is None:
+            self._ranking = GradeRanking(self.grades)
+        return self._ranking
+
+    def touch(self) -> None:
+        self.version = next_version()
 
     def enroll_student(self, student_id: int) -> None:
-        if student_id in self.roster:
+        if not self.roster.add(student_id):
             raise ValueError(f"Student {student_id} is already enrolled in course {self.id}")
-        self.roster.append(student_id)
+        self.touch()
 
     def unenroll_student(self, student_id: int) -> None:
-        if student_id not in self.roster:
+        if not self.roster.discard(student_id):
             raise ValueError(f"Student {student_id} is not enrolled in course {self.id}")
-        self.roster.remove(student_id)
-        self.grades.pop(student_id, None)
+        self.remove_grade(student_id)
+        self.touch()
         
     def set_grade(self, student_id: int, grade: float) -> None:
         if student_id not in self.roster:
             raise ValueError(f"Student {student_id} is not enrolled in course {self.id}")
-        if grade < 0.0 or grade > 100.0:
+        if not math.isfinite(grade) or grade < 0.0 or grade > 100.0:
             raise ValueError("Grade must be between 0 and 100")
+        old = self.grades.get(student_id)
+        if self._stats is not None:
+            self._stats.replace(old, grade)
+        if self._ranking is not None:
+            self._ranking.update(student_id, old, grade)
         self.grades[student_id] = grade
+        self.touch()
+
+    def remove_grade(self, student_id: int) -> Optional[float]:
+        grade = self.grades.pop(student_id, None)
+        if grade is not None:
+            if self._stats is not None:
+                self._stats.remove(grade)
+            if self._ranking is not None:
+                self._ranking.update(student_id, grade, None)
+            self.touch()
+        return grade
         
     def get_average_grade(self) -> float:
-        if not self.grades:
-            return 0.0
-        return sum(self.grades.values()) / len(self.grades)
+        return self.stats.mean
+
+    def grade_histogram(self, buckets: Optional[Sequence[float]] = None) -> List[Tuple[float, float, int]]:
+        return self.stats.histogram(buckets)
+
+    def grade_rank(self, student_id: int) -> Optional[int]:
+        grade = self.grades.get(student_id)
+        return None if grade is None else self.ranking.rank(grade)
+
+    def grade_percentile(self, student_id: int) -> Optional[float]:
+        grade = self.grades.get(student_id)
+        return None if grade is None else self.ranking.percentile(grade)
+
+    def top_grades(self, k: int = 10) -> List[Tuple[int, float]]:
+        return self.ranking.top(k)
+
+    def median_grade(self) -> Optional[float]:
+        return self.ranking.quantile(0.5)
 
     def to_dict(self) -> Dict:
         return {
@@ -48,8 +137,9 @@ class Course:
             "description": self.description,
             "year": self.year,
             "instructor_id": self.instructor_id,
-            "roster": self.roster,
-            "grades": self.grades
+            "roster": self.roster.to_list(),
+            "grades": self.grades,
+            "version": self.version,
         }
         
     def __repr__(self) -> str:
@@ -0,0 +1,196 @@
+from array import array
+from typing import Dict, Iterable, Iterator, List, Union
+
+
+class IdSet:
+    """
+    Insertion-ordered set of integer ids.
+
+    It reads like the list it replaces (iteration, len, ``in``, comparison with
+    a list) but membership, insert and delete are O(1).
+    """
+    __slots__ = ("_ids",)
+
+    def __init__(self, ids: Iterable[int] = ()):
+        self._ids: Dict[int, None] = dict.fromkeys(ids)
+
+    @classmethod
+    def from_array(cls, ids: array) -> "IdSet":
+        """The set of ``ids``, which are already distinct (e.g. packed from another set)."""
+        return cls(ids)
+
+    def add(self, item_id: int) -> bool:
+        if item_id in self._ids:
+            return False
+        self._ids[item_id] = None
+        return True
+
+    def discard(self, item_id: int) -> bool:
+        if item_id not in self._ids:
+            return False
+        del self._ids[item_id]
+        return True
+
+    # list-style methods kept for callers written against the old list fields
+    def append(self, item_id: int) -> None:
+        self.add(item_id)
+
+    def extend(self, item_ids: Iterable[int]) -> None:
+        for item_id in item_ids:
+            self.add(item_id)
+
+    def remove(self, item_id: int) -> None:
+        if not self.discard(item_id):
+            raise ValueError(f"{item_id} not in {self.__class__.__name__}")
+
+    def index(self, item) -> int:
+        return self.to_list().index(item)
+
+    def __getitem__(self, index: Union[int, slice]):
+        # O(n) here; CompactIdSet indexes its array directly
+        return self.to_list()[index]
+
+    def ids(self) -> Iterator[int]:
+        return iter(self._ids)
+
+    def to_list(self) -> List:
+        return list(self)
+
+    def __contains__(self, item_id) -> bool:
+        return item_id in self._ids
+
+    def __iter__(self) -> Iterator:
+        return iter(self._ids)
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, IdSet):
+            return list(self.ids()) == list(other.ids())
+        if isinstance(other, list):
+            return self.to_list() == other
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}({self.to_list()})"
+
+
+class CompactIdSet(IdSet):
+    """
+    IdSet over an ``array('q')``: 8 bytes per id instead of a dict slot, at
+    the price of O(n) membership. Meant for the short per-entity id lists
+    (a student's or an instructor's courses), not for course rosters.
+    """
+    __slots__ = ()
+
+    def __init__(self, ids: Iterable[int] = ()):
+        self._ids = array("q", dict.fromkeys(ids))
+
+    @classmethod
+    def from_array(cls, ids: array) -> "CompactIdSet":
+        # takes the array over as it is: no copy, no per-id conversion
+        id_set = cls.__new__(cls)
+        id_set._ids = ids
+        return id_set
+
+    def add(self, item_id: int) -> bool:
+        if item_id in self._ids:
+            return False
+        self._ids.append(item_id)
+        return True
+
+    def discard(self, item_id: int) -> bool:
+        try:
+            self._ids.remove(item_id)
+        except ValueError:
+            return False
+        return True
+
+    def __getitem__(self, index: Union[int, slice]):
+        items = self._ids[index]
+        return items.tolist() if isinstance(index, slice) else items
+
+
+class EnrollmentSet(CompactIdSet):
+    """
+    A student's course ids. Iterates as ``{"course_id": ...}`` dicts so the
+    public shape of ``Student.enrollments`` and its JSON form are unchanged.
+    """
+    __slots__ = ()
+
+    def __init__(self, enrollments: Iterable[Union[int, Dict]] = ()):
+        super().__init__(e["course_id"] if isinstance(e, dict) else e for e in enrollments)
+
+    def __contains__(self, item) -> bool:
+        if isinstance(item, dict):
+            item = item.get("course_id")
+        return item in self._ids
+
+    def __iter__(self) -> Iterator[Dict]:
+        return ({"course_id": course_id} for course_id in self._ids)
+
+    def __getitem__(self, index: Union[int, slice]):
+        if isinstance(index, slice):
+            return [{"course_id": course_id} for course_id in self._ids[index]]
+        return {"course_id": self._ids[index]}
+
+
+class EnrollmentGraph:
+    """
+    Registry-owned bidirectional course <-> student graph.
+
+    The graph shares its sets with ``Course.roster`` and ``Student.enrollments``
+    so the entities and the graph can never disagree; it adds id-only lookups
+    and bulk link/unlink that skip per-entity validation.
+    """
+
+    def __init__(self):
+        self._rosters: Dict[int, IdSet] = {}
+        self._schedules: Dict[int, EnrollmentSet] = {}
+
+    def add_course(self, course_id: int, roster: IdSet) -> None:
+        self._rosters[course_id] = roster
+
+    def add_student(self, student_id: int, enrollments: EnrollmentSet) -> None:
+        self._schedules[student_id] = enrollments
+
+    def remove_course(self, course_id: int) -> None:
+        for student_id in self._rosters.pop(course_id, ()):
+            schedule = self._schedules.get(student_id)
+            if schedule is not None:
+                schedule.discard(course_id)
+
+    def remove_student(self, student_id: int) -> None:
+        schedule = self._schedules.pop(student_id, None)
+        for course_id in schedule.ids() if schedule is not None else ():
+            roster = self._rosters.get(course_id)
+            if roster is not None:
+                roster.discard(student_id)
+
+    def clear(self) -> None:
+        self._rosters.clear()
+        self._schedules.clear()
+
+    def is_enrolled(self, student_id: int, course_id: int) -> bool:
+        roster = self._rosters.get(course_id)
+        return roster is not None and student_id in roster
+
+    def roster(self, course_id: int) -> List[int]:
+        return list(self._rosters.get(course_id, ()))
+
+    def courses_of(self, student_id: int) -> List[int]:
+        schedule = self._schedules.get(student_id)
+        return [] if schedule is None else list(schedule.ids())
+
+    def link_many(self, course_id: int, student_ids: Iterable[int]) -> None:
+        roster = self._rosters[course_id]
+        for student_id in student_ids:
+            roster.add(student_id)
+            self._schedules[student_id].add(course_id)
+
+    def unlink_many(self, course_id: int, student_ids: Iterable[int]) -> None:
+        roster = self._rosters[course_id]
+        for student_id in student_ids:
+            roster.discard(student_id)
+            self._schedules[student_id].discard(course_id)
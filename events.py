@@ -0,0 +1,314 @@
+"""
+Change-data-capture stream of Registry mutations (``Registry.enable_events``).
+
+Every successful create, update, enrollment, unenrollment and grade change
+publishes a typed event with a sequence number. The events of one call,
+such as ``enroll_many``, are published together. The events of a
+``Registry.transaction`` are published when it commits and are dropped if
+it rolls back, so subscribers only see committed changes.
+
+A subscriber either gets a callback, which receives events in batches of at
+most ``batch_size``, or polls its own queue, which keeps at most
+``max_pending`` events and drops the oldest when a slow consumer falls
+behind (``Subscription.dropped`` counts them). The stream keeps the last
+``buffer_size`` events, so a consumer that reconnects with the last
+sequence number it saw gets only what it missed.
+
+A ``View`` is a subscriber that keeps a derived result up to date one event
+at a time. It is computed from the registry once, when it is added with
+``Registry.add_view``, and again only after the registry is reloaded
+(a ``Reloaded`` event).
+"""
+import threading
+from collections import deque
+from dataclasses import asdict, dataclass, field
+from typing import Callable, ClassVar, Deque, Dict, Iterable, List, Optional, Sequence
+
+from gradestats import SCALE_BITS, scaled
+
+
+@dataclass(slots=True)
+class Event:
+    kind: ClassVar[str] = "event"
+    seq: int = field(default=0, init=False)  # set when published
+
+    def to_dict(self) -> Dict:
+        return {"type": self.kind, **asdict(self)}
+
+
+@dataclass(slots=True)
+class StudentCreated(Event):
+    kind: ClassVar[str] = "student_created"
+    student_id: int
+    year: int
+    student_type: str
+
+
+@dataclass(slots=True)
+class StudentUpdated(Event):
+    kind: ClassVar[str] = "student_updated"
+    student_id: int
+    old: Dict  # the changed fields, before and after
+    new: Dict
+
+
+@dataclass(slots=True)
+class InstructorCreated(Event):
+    kind: ClassVar[str] = "instructor_created"
+    instructor_id: int
+
+
+@dataclass(slots=True)
+class CourseCreated(Event):
+    kind: ClassVar[str] = "course_created"
+    course_id: int
+    instructor_id: Optional[int]
+    year: Optional[int]
+
+
+@dataclass(slots=True)
+class Enrolled(Event):
+    kind: ClassVar[str] = "enrolled"
+    course_id: int
+    student_id: int
+
+
+@dataclass(slots=True)
+class Unenrolled(Event):
+    kind: ClassVar[str] = "unenrolled"
+    course_id: int
+    student_id: int
+    grade: Optional[float] = None  # the grade removed with the enrollment
+
+
+@dataclass(slots=True)
+class GradeSet(Event):
+    kind: ClassVar[str] = "grade_set"
+    course_id: int
+    student_id: int
+    old: Optional[float]
+    grade: float
+
+
+@dataclass(slots=True)
+class Reloaded(Event):
+    """The registry was replaced by a load; derived state must be rebuilt."""
+    kind: ClassVar[str] = "reloaded"
+
+
+class Subscription:
+    def __init__(self, stream: "EventStream", callback: Optional[Callable[[List[Event]], None]],
+                 batch_size: int, max_pending: int):
+        self.stream = stream
+        self.callback = callback
+        self.batch_size = batch_size
+        self.dropped = 0
+        self.error: Optional[Exception] = None  # what made a callback subscriber detach
+        self._pending: Deque[Event] = deque(maxlen=max_pending)
+
+    def _deliver(self, events: Sequence[Event]) -> None:
+        if self.callback is None:
+            overflow = len(self._pending) + len(events) - self._pending.maxlen
+            if overflow > 0:
+                self.dropped += overflow
+            self._pending.extend(events)
+            return
+        for start in range(0, len(events), self.batch_size):
+            try:
+                self.callback(list(events[start:start + self.batch_size]))
+            except Exception as e:
+                # the mutation already happened; a failing subscriber must not undo or fail it
+                self.error = e
+                self.stream.unsubscribe(self)
+                return
+
+    def poll(self, max_events: Optional[int] = None) -> List[Event]:
+        """Take up to ``max_events`` (default: all) queued events, oldest first."""
+        with self.stream._lock:
+            count = len(self._pending) if max_events is None else min(max_events, len(self._pending))
+            return [self._pending.popleft() for _ in range(count)]
+
+    def close(self) -> None:
+        self.stream.unsubscribe(self)
+
+
+class EventStream:
+    def __init__(self, buffer_size: int = 10000):
+        self.seq = 0
+        self._buffer: Deque[Event] = deque(maxlen=buffer_size)
+        self._subscriptions: List[Subscription] = []
+        # publishers of different courses can run concurrently on a thread-safe registry
+        self._lock = threading.RLock()
+
+    def publish(self, events: Sequence[Event]) -> None:
+        """Number ``events`` and hand them to every subscriber as one batch."""
+        with self._lock:
+            for event in events:
+                self.seq += 1
+                event.seq = self.seq
+            self._buffer.extend(events)
+            for subscription in list(self._subscriptions):
+                subscription._deliver(events)
+
+    def subscribe(self, callback: Optional[Callable[[List[Event]], None]] = None, batch_size: int = 1000,
+                  max_pending: int = 10000, since: Optional[int] = None) -> Subscription:
+        """
+        Without a ``callback`` the subscription is polled. With ``since`` the
+        buffered events after that sequence number are delivered first.
+        """
+        if batch_size < 1 or max_pending < 1:
+            raise ValueError("batch_size and max_pending must be positive")
+        with self._lock:
+            subscription = Subscription(self, callback, batch_size, max_pending)
+            if since is not None:
+                subscription._deliver(self.events_since(since))
+            if subscription.error is None:
+                self._subscriptions.append(subscription)
+            return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            if subscription in self._subscriptions:
+                self._subscriptions.remove(subscription)
+
+    def events_since(self, seq: int) -> List[Event]:
+        """The events after ``seq``, if they are still buffered."""
+        with self._lock:
+            oldest = self._buffer[0].seq if self._buffer else self.seq + 1
+            if seq + 1 < oldest:
+                raise ValueError(f"Events after {seq} are no longer buffered (oldest is {oldest})")
+            return [event for event in self._buffer if event.seq > seq]
+
+
+class View:
+    """A result kept current by applying events. Subclasses define ``rebuild`` and ``on_<kind>`` handlers."""
+
+    def __init__(self):
+        self.registry = None
+        self.subscription: Optional[Subscription] = None
+        self.seq = 0  # the last event applied
+
+    def rebuild(self, registry) -> None:
+        raise NotImplementedError
+
+    def apply(self, events: Iterable[Event]) -> None:
+        for event in events:
+            if isinstance(event, Reloaded):
+                self.rebuild(self.registry)
+            else:
+                handler = getattr(self, "on_" + event.kind, None)
+                if handler is not None:
+                    handler(event)
+            self.seq = event.seq
+
+
+class CourseEnrollmentCounts(View):
+    """Students enrolled per course id."""
+
+    def __init__(self):
+        super().__init__()
+        self.counts: Dict[int, int] = {}
+
+    def rebuild(self, registry) -> None:
+        self.counts = {course_id: len(course.roster) for course_id, course in registry.list_courses().items()}
+
+    def on_course_created(self, event: CourseCreated) -> None:
+        self.counts[event.course_id] = 0
+
+    def on_enrolled(self, event: Enrolled) -> None:
+        self.counts[event.course_id] += 1
+
+    def on_unenrolled(self, event: Unenrolled) -> None:
+        self.counts[event.course_id] -= 1
+
+
+class YearEnrollmentCounts(View):
+    """Enrollments per course year (None for courses without one)."""
+
+    def __init__(self):
+        super().__init__()
+        self.counts: Dict[Optional[int], int] = {}
+        self._course_years: Dict[int, Optional[int]] = {}
+
+    def rebuild(self, registry) -> None:
+        self.counts, self._course_years = {}, {}
+        for course_id, course in registry.list_courses().items():
+            self._course_years[course_id] = course.year
+            self.counts[course.year] = self.counts.get(course.year, 0) + len(course.roster)
+
+    def on_course_created(self, event: CourseCreated) -> None:
+        self._course_years[event.course_id] = event.year
+        self.counts.setdefault(event.year, 0)
+
+    def on_enrolled(self, event: Enrolled) -> None:
+        self.counts[self._course_years[event.course_id]] += 1
+
+    def on_unenrolled(self, event: Unenrolled) -> None:
+        self.counts[self._course_years[event.course_id]] -= 1
+
+
+class InstructorDashboard(View):
+    """
+    Per instructor: courses taught, enrolled students, grades given and their
+    mean. The grade sum is kept exact, scaled like ``GradeStats``'s, so the
+    mean of a one-course instructor equals that course's average.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._totals: Dict[int, List[int]] = {}  # instructor -> [courses, enrollments, grades, scaled grade sum]
+        self._instructors: Dict[int, Optional[int]] = {}  # course -> instructor
+
+    def rebuild(self, registry) -> None:
+        self._totals = {instructor_id: [0, 0, 0, 0] for instructor_id in registry.list_instructors()}
+        self._instructors = {}
+        for course_id, course in registry.list_courses().items():
+            self._instructors[course_id] = course.instructor_id
+            totals = self._totals.get(course.instructor_id)
+            if totals is not None:
+                totals[0] += 1
+                totals[1] += len(course.roster)
+                totals[2] += len(course.grades)
+                totals[3] += sum(map(scaled, course.grades.values()))
+
+    def summary(self, instructor_id: int) -> Optional[Dict[str, float]]:
+        totals = self._totals.get(instructor_id)
+        if totals is None:
+            return None
+        courses, enrollments, grades, grade_sum = totals
+        return {"courses": courses, "enrollments": enrollments, "grades": grades,
+                "mean": grade_sum / (grades << SCALE_BITS) if grades else None}
+
+    def _course_totals(self, course_id: int) -> Optional[List[float]]:
+        return self._totals.get(self._instructors.get(course_id))
+
+    def on_instructor_created(self, event: InstructorCreated) -> None:
+        self._totals[event.instructor_id] = [0, 0, 0, 0]
+
+    def on_course_created(self, event: CourseCreated) -> None:
+        self._instructors[event.course_id] = event.instructor_id
+        totals = self._course_totals(event.course_id)
+        if totals is not None:
+            totals[0] += 1
+
+    def on_enrolled(self, event: Enrolled) -> None:
+        totals = self._course_totals(event.course_id)
+        if totals is not None:
+            totals[1] += 1
+
+    def on_unenrolled(self, event: Unenrolled) -> None:
+        totals = self._course_totals(event.course_id)
+        if totals is not None:
+            totals[1] -= 1
+            if event.grade is not None:
+                totals[2] -= 1
+                totals[3] -= scaled(event.grade)
+
+    def on_grade_set(self, event: GradeSet) -> None:
+        totals = self._course_totals(event.course_id)
+        if totals is not None:
+            if event.old is None:
+                totals[2] += 1
+            else:
+                totals[3] -= scaled(event.old)
+            totals[3] += scaled(event.grade)
@@ -0,0 +1,199 @@
+"""
+Streaming export of enrollments and grades for analytics.
+
+Every enrollment becomes one denormalized row of ``COLUMNS``, with an empty
+grade if there is none yet. Rows are produced course by course by
+generators and encoded in chunks of ``chunk_rows``. The output is CSV or
+NDJSON, gzip-compressed when the path ends in ``.gz``. Memory therefore
+depends on the chunk size and the largest course, not on the number of rows.
+
+Incremental exports use ``Course.version``, which grows whenever a course's
+roster, grades or student names change. Each export returns a
+``watermark``. Passing it as ``since`` to the next export writes only the
+courses changed after it, with all of their current rows, so a loader
+replaces those courses (``ExportResult.courses``) wholesale and also
+handles unenrollments.
+
+A watermark is the highest course version at the start of the export.
+Versions are saved with the courses, and loading them moves the version
+counter past them, so a watermark stays valid across restarts and reloads:
+a nightly ``commandline.py export --since`` only writes what changed since
+the last run. A watermark above every version this process has seen came
+from changes that were never saved, or from before the data file had
+versions; it leads to a full export (``ExportResult.full``), as does one in
+the older per-process format. A storage backend does not store versions,
+so a registry with one gives no watermark and refuses ``since``.
+"""
+import csv
+import io
+import json
+import os
+import zlib
+from contextlib import nullcontext, suppress
+from dataclasses import dataclass, field
+from json.encoder import encode_basestring
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+import course as course_module
+
+COLUMNS = ("student_id", "student_name", "student_type", "course_id", "course_title", "course_year",
+           "instructor_id", "instructor_name", "grade")
+FORMATS = {".csv": "csv", ".ndjson": "ndjson", ".jsonl": "ndjson"}
+
+# COLUMNS as one JSON object: the student fields, the course fields (pre-encoded) and the grade
+_NDJSON_ROW = '{"student_id":%d,"student_name":%s,"student_type":%s,%s,"grade":%s}\n'
+
+Row = Tuple
+
+
+@dataclass
+class ExportResult:
+    rows: int = 0
+    courses: List[int] = field(default_factory=list)  # the courses whose rows were written
+    watermark: str = ""
+    full: bool = True
+
+
+def watermark(registry) -> str:
+    """A watermark as new as every course change so far ("" with a storage backend)."""
+    if registry._backend is not None:
+        return ""
+    return str(max((course.version for course in registry.list_courses().values()), default=0))
+
+
+def changed_courses(registry, since: Optional[str] = None) -> Tuple[List, bool]:
+    """The courses changed after ``since`` (all of them without one), and whether that is all courses."""
+    courses = list(registry.list_courses().values())
+    if since is None:
+        return courses, True
+    if registry._backend is not None:
+        raise ValueError("Incremental exports need saved course versions, which a storage backend does not keep")
+    # "<process>:<version>" watermarks came from versions that only meant something in their process
+    version = since.partition(":")[2] if ":" in since else since
+    if not version.isdigit():
+        raise ValueError(f"Invalid export watermark {since!r}")
+    if version != since:
+        return courses, True
+    version = int(version)
+    if version > course_module.last_version():
+        # later changes must still count as after it
+        course_module.advance_versions(version)
+        return courses, True
+    return [course for course in courses if course.version > version], False
+
+
+def iter_rows(registry, courses: Iterable) -> Iterator[Row]:
+    """The rows of ``courses``, in roster order."""
+    students = registry._students
+    for course in courses:
+        # a thread-safe registry may be grading this course meanwhile; copy it under its lock
+        with registry._lock.read() if registry._lock is not None else nullcontext(), \
+                registry._course_locks[course.id] if registry._lock is not None else nullcontext():
+            roster, grades = list(course.roster), dict(course.grades)
+        instructor = registry.get_instructor(course.instructor_id) if course.instructor_id is not None else None
+        course_part = (course.id, course.title, course.year, course.instructor_id,
+                       instructor.name if instructor is not None else None)
+        for student_id in roster:
+            student = students.get(student_id) or registry.get_student(student_id)
+            yield (student_id, student.name, student.student_type) + course_part + (grades.get(student_id),)
+
+
+def _chunks(rows: Iterable[Row], size: int) -> Iterator[List[Row]]:
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def iter_chunks(rows: Iterable[Row], fmt: str = "csv", compress: bool = False, chunk_rows: int = 10000,
+                compresslevel: int = 6) -> Iterator[bytes]:
+    """
+    Encode ``rows`` as ``fmt`` ("csv", with a header line, or "ndjson"),
+    ``chunk_rows`` at a time, gzip-compressed if ``compress``. The bytes
+    can go to a file, a socket or an upload.
+    """
+    if fmt not in ("csv", "ndjson"):
+        raise ValueError(f"Unknown export format {fmt!r}; choose csv or ndjson")
+    if chunk_rows < 1:
+        raise ValueError("chunk_rows must be positive")
+    compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, 16 + zlib.MAX_WBITS) if compress else None
+
+    def encoded() -> Iterator[bytes]:
+        if fmt == "csv":
+            buffer = io.StringIO()
+            writer = csv.writer(buffer, lineterminator="\n")
+            writer.writerow(COLUMNS)
+            for chunk in _chunks(rows, chunk_rows):
+                writer.writerows(chunk)
+                yield buffer.getvalue().encode("utf-8")
+                buffer.seek(0)
+                buffer.truncate()
+            if buffer.tell():
+                yield buffer.getvalue().encode("utf-8")  # a header with no rows
+        else:
+            encode = json.JSONEncoder(separators=(",", ":")).encode
+            course_key, course_json = None, ""
+            for chunk in _chunks(rows, chunk_rows):
+                lines = []
+                for row in chunk:
+                    # consecutive rows share a course; its fields are encoded once
+                    if row[3:8] != course_key:
+                        course_key = row[3:8]
+                        course_json = encode(dict(zip(COLUMNS[3:8], course_key)))[1:-1]
+                    lines.append(_NDJSON_ROW % (row[0], encode_basestring(row[1]), encode_basestring(row[2]),
+                                                course_json, encode(row[8])))
+                yield "".join(lines).encode("utf-8")
+
+    for data in encoded():
+        if compressor is None:
+            yield data
+        else:
+            data = compressor.compress(data)
+            if data:
+                yield data
+    if compressor is not None:
+        yield compressor.flush()
+
+
+def format_of(path: str) -> Tuple[str, bool]:
+    """``(format, compressed)`` from an export path's extension."""
+    compress = path.endswith(".gz")
+    fmt = FORMATS.get(os.path.splitext(path[:-3] if compress else path)[1].lower())
+    if fmt is None:
+        raise ValueError(f"Cannot export to {path}; use a .csv, .ndjson or .jsonl path, optionally with .gz")
+    return fmt, compress
+
+
+def export(registry, path: str, since: Optional[str] = None, chunk_rows: int = 10000,
+           compresslevel: int = 6) -> ExportResult:
+    """
+    Write the rows of every course, or with ``since`` of the courses changed
+    after that watermark, to ``path``. The file is replaced only once it is
+    complete.
+    """
+    fmt, compress = format_of(path)
+    # taken first: a change made during the export is exported again next time rather than missed
+    result = ExportResult(watermark=watermark(registry))
+    courses, result.full = changed_courses(registry, since)
+    result.courses = [course.id for course in courses]
+
+    def counted(rows: Iterator[Row]) -> Iterator[Row]:
+        for row in rows:
+            result.rows += 1
+            yield row
+
+    try:
+        with open(path + ".tmp", "wb") as f:
+            for data in iter_chunks(counted(iter_rows(registry, courses)), fmt, compress, chunk_rows, compresslevel):
+                f.write(data)
+        os.replace(path + ".tmp", path)
+    except BaseException:
+        # a partial export must not be left behind next to the last complete one
+        with suppress(FileNotFoundError):
+            os.remove(path + ".tmp")
+        raise
+    return result
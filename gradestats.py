@@ -0,0 +1,161 @@
+import heapq
+from bisect import bisect_right
+from collections import Counter
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+DEFAULT_BUCKETS: Tuple[float, ...] = tuple(range(0, 101, 10))
+
+# every finite double is an integer multiple of 2**-1074, so sums of grades
+# scaled by 2**1074 are exact Python ints; int / int division rounds correctly
+SCALE_BITS = 1074
+
+
+def scaled(value: float) -> int:
+    """``value * 2**1074`` as an exact int."""
+    numerator, denominator = value.as_integer_ratio()
+    return numerator << (SCALE_BITS - denominator.bit_length() + 1)
+
+
+class GradeStats:
+    """
+    Running aggregates over a multiset of grades.
+
+    Sums are kept as exact scaled integers so overwriting or removing a grade
+    leaves no floating point residue; min and max come from heaps with lazy deletion.
+    The heaps are rebuilt from the live grades once stale entries outnumber
+    them, so they stay O(distinct grades) however often grades are replaced.
+    Every query is O(1), every update O(log n) amortized.
+    """
+
+    def __init__(self, grades: Iterable[float] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        if len(buckets) < 2 or list(buckets) != sorted(buckets):
+            raise ValueError("Histogram buckets must be at least two ascending edges")
+        self.buckets: Tuple[float, ...] = tuple(buckets)
+        self._counts: Counter = Counter()
+        self._count = 0
+        self._sum = 0
+        self._sum_sq = 0
+        self._low: List[float] = []
+        self._high: List[float] = []
+        self._histogram = [0] * (len(self.buckets) - 1)
+        self._mean: Optional[float] = None
+        for grade in grades:
+            self.add(grade)
+
+    def _bucket(self, grade: float, buckets: Sequence[float]) -> Optional[int]:
+        if grade < buckets[0] or grade > buckets[-1]:
+            return None
+        # the last bucket is closed so the top edge (e.g. 100) is counted
+        return min(bisect_right(buckets, grade) - 1, len(buckets) - 2)
+
+    def add(self, grade: float) -> None:
+        self._add(grade, scaled(grade))
+
+    def _add(self, grade: float, exact: int) -> None:
+        self._count += 1
+        self._sum += exact
+        self._sum_sq += exact * exact
+        self._mean = None
+        self._counts[grade] += 1
+        if self._counts[grade] == 1:
+            heapq.heappush(self._low, grade)
+            heapq.heappush(self._high, -grade)
+            if max(len(self._low), len(self._high)) > 2 * len(self._counts) + 8:
+                self._rebuild_heaps()
+        bucket = self._bucket(grade, self.buckets)
+        if bucket is not None:
+            self._histogram[bucket] += 1
+
+    def remove(self, grade: float) -> None:
+        if not self._counts.get(grade):
+            raise ValueError(f"Grade {grade} is not recorded")
+        exact = scaled(grade)
+        self._count -= 1
+        self._sum -= exact
+        self._sum_sq -= exact * exact
+        self._mean = None
+        self._counts[grade] -= 1
+        if self._counts[grade] == 0:
+            del self._counts[grade]
+            while self._low and self._low[0] not in self._counts:
+                heapq.heappop(self._low)
+            while self._high and -self._high[0] not in self._counts:
+                heapq.heappop(self._high)
+        bucket = self._bucket(grade, self.buckets)
+        if bucket is not None:
+            self._histogram[bucket] -= 1
+
+    def _rebuild_heaps(self) -> None:
+        # drop the stale entries lazy deletion left below the tops
+        live = list(self._counts)
+        self._low = live
+        self._high = [-grade for grade in live]
+        heapq.heapify(self._low)
+        heapq.heapify(self._high)
+
+    def replace(self, old: Optional[float], new: float) -> None:
+        # scaled() rejects NaN and infinities before anything is removed
+        exact = scaled(new)
+        if old is not None:
+            self.remove(old)
+        self._add(new, exact)
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+    @property
+    def mean(self) -> float:
+        if not self._count:
+            return 0.0
+        if self._mean is None:
+            self._mean = self._sum / (self._count << SCALE_BITS)
+        return self._mean
+
+    @property
+    def minimum(self) -> Optional[float]:
+        return self._low[0] if self._count else None
+
+    @property
+    def maximum(self) -> Optional[float]:
+        return -self._high[0] if self._count else None
+
+    @property
+    def variance(self) -> float:
+        """Population variance of the recorded grades."""
+        if not self._count:
+            return 0.0
+        n = self._count
+        return (self._sum_sq * n - self._sum * self._sum) / ((n * n) << (2 * SCALE_BITS))
+
+    @property
+    def stddev(self) -> float:
+        return self.variance ** 0.5
+
+    def histogram(self, buckets: Optional[Sequence[float]] = None) -> List[Tuple[float, float, int]]:
+        """
+        Return ``(low, high, count)`` per bucket. The configured buckets are
+        maintained incrementally; other edges are computed from the distinct
+        grades on demand.
+        """
+        if buckets is None or tuple(buckets) == self.buckets:
+            edges, counts = self.buckets, list(self._histogram)
+        else:
+            edges = tuple(buckets)
+            if len(edges) < 2 or list(edges) != sorted(edges):
+                raise ValueError("Histogram buckets must be at least two ascending edges")
+            counts = [0] * (len(edges) - 1)
+            for grade, n in self._counts.items():
+                bucket = self._bucket(grade, edges)
+                if bucket is not None:
+                    counts[bucket] += n
+        return [(edges[i], edges[i + 1], counts[i]) for i in range(len(counts))]
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "mean": self.mean,
+            "min": self.minimum,
+            "max": self.maximum,
+            "variance": self.variance,
+        }
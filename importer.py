@@ -0,0 +1,149 @@
+"""
+Bulk student import from CSV or newline-delimited JSON.
+
+Rows are read and validated in batches with the compiled validators in
+``utils``, optionally in a process pool, and every valid batch is created
+with one ``Registry.create_students`` call. Bad rows do not stop the import;
+they end up in the report with their line number and the reason.
+"""
+import csv
+import json
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import streaming
+from utils import person_errors
+
+FIELDS = ("name", "email", "age", "year", "student_type")
+REQUIRED = ("name", "email", "age", "year")
+_KNOWN = frozenset(FIELDS)
+
+Row = Tuple[int, Dict]  # (line number, raw row)
+
+
+@dataclass
+class ImportReport:
+    rows: int = 0
+    created: List[int] = field(default_factory=list)
+    errors: List[Tuple[int, str]] = field(default_factory=list)  # (line number, reason)
+
+    def write_errors(self, file_path: str) -> None:
+        with open(file_path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(["line", "error"])
+            writer.writerows(self.errors)
+
+
+def read_rows(file_path: str) -> Iterator[Row]:
+    """Rows of a ``.csv`` file (with a header line) or of a ``.ndjson``/``.jsonl`` file."""
+    with open(file_path, "r", newline="", encoding="utf-8") as f:
+        if streaming.is_stream_path(file_path):
+            for line_no, line in enumerate(f, start=1):
+                if line.strip():
+                    try:
+                        row = json.loads(line)
+                    except ValueError as e:
+                        row = {"__error__": f"Invalid JSON: {e}"}
+                    yield line_no, row if isinstance(row, dict) else {"__error__": "Row is not a JSON object"}
+        else:
+            reader = csv.DictReader(f)
+            for row in reader:
+                yield reader.line_num, row
+
+
+def _whole_number(value) -> int:
+    # int() would truncate a JSON 20.7 to 20 and accept true as 1
+    if isinstance(value, bool):
+        raise TypeError("not a number")
+    if isinstance(value, float):
+        if not value.is_integer():
+            raise ValueError(f"{value} is not a whole number")
+        return int(value)
+    if isinstance(value, str):
+        return int(value.strip())
+    if isinstance(value, int):
+        return value
+    raise TypeError("not a number")
+
+
+def clean_row(row: Dict) -> Tuple[Optional[Dict], Optional[str]]:
+    """Coerce one raw row into ``create_student`` arguments, or explain why it cannot be."""
+    if "__error__" in row:
+        return None, row["__error__"]
+    if not _KNOWN.issuperset(row):
+        unknown = [key for key in row if key not in _KNOWN]
+        return None, f"Unknown columns: {', '.join(map(str, unknown))}"
+    missing = [key for key in REQUIRED if row.get(key) in (None, "")]
+    if missing:
+        return None, f"Missing {', '.join(missing)}"
+    try:
+        age, year = _whole_number(row["age"]), _whole_number(row["year"])
+    except (TypeError, ValueError):
+        return None, "Age and year must be whole numbers"
+    name, email = str(row["name"]).strip(), str(row["email"]).strip()
+    errors = person_errors(name, email, age)
+    if errors:
+        return None, "; ".join(errors)
+    record = {"name": name, "email": email, "age": age, "year": year}
+    if row.get("student_type"):
+        record["student_type"] = str(row["student_type"]).strip()
+    return record, None
+
+
+def validate_batch(batch: List[Row]) -> List[Tuple[int, Optional[Dict], Optional[str]]]:
+    """``(line, record, error)`` per row; module-level so a process pool can run it."""
+    return [(line_no, *clean_row(row)) for line_no, row in batch]
+
+
+def _batches(rows: Iterable[Row], batch_size: int) -> Iterator[List[Row]]:
+    batch: List[Row] = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _validated(batches: Iterator[List[Row]], workers: int) -> Iterator[List[Tuple[int, Optional[Dict], Optional[str]]]]:
+    if not workers:
+        for batch in batches:
+            yield validate_batch(batch)
+        return
+    # keep a few batches in flight so a huge file is never read into memory at once
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = []
+        for batch in batches:
+            pending.append(pool.submit(validate_batch, batch))
+            if len(pending) >= 2 * workers:
+                yield pending.pop(0).result()
+        for future in pending:
+            yield future.result()
+
+
+def import_students(registry, rows: Iterable[Row], batch_size: int = 5000, workers: int = 0) -> ImportReport:
+    """
+    Validate and create students from ``(line, row)`` pairs (see ``read_rows``).
+    ``workers`` > 0 validates batches in that many processes.
+    """
+    report = ImportReport()
+    for results in _validated(_batches(rows, batch_size), workers):
+        report.rows += len(results)
+        lines, records = [], []
+        for line_no, record, error in results:
+            if error is None:
+                lines.append(line_no)
+                records.append(record)
+            else:
+                report.errors.append((line_no, error))
+        created, rejected = registry.create_students(records, validated=True)
+        report.created.extend(student.id for student in created)
+        report.errors.extend((lines[index], error) for index, error in rejected)
+    report.errors.sort()
+    return report
+
+
+def import_file(registry, file_path: str, batch_size: int = 5000, workers: int = 0) -> ImportReport:
+    return import_students(registry, read_rows(file_path), batch_size=batch_size, workers=workers)
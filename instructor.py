@@ -1,37 +1,41 @@
 from dataclasses import dataclass, field
-from typing import List, Dict
-from utils import validate_email, validate_name
+from typing import Dict
+from utils import validate_email, validate_name, validation_enabled
+from enrollment import CompactIdSet
 
-@dataclass
+@dataclass(slots=True)
 class Instructor:
     id: int
     name: str
     email: str
-    courses: List[int] = field(default_factory=list)
+    # was a List[int]; CompactIdSet still indexes, slices, appends and compares equal to a list
+    courses: CompactIdSet = field(default_factory=CompactIdSet)
 
     def __post_init__(self):
+        if not isinstance(self.courses, CompactIdSet):
+            self.courses = CompactIdSet(self.courses)
+        if not validation_enabled():
+            return
         if not validate_name(self.name):
             raise ValueError(f"Invalid name: {self.name}, must contain letters and may contain spaces, and apostrophes only ")
         if not validate_email(self.email):
             raise ValueError(f"Invalid email: {self.email}, must be a valid email address")
 
     def assign_course(self, course_id: int) -> None:
-        if course_id in self.courses:
+        if not self.courses.add(course_id):
             raise ValueError(f"Instructor is already assigned to course {course_id}")
-        self.courses.append(course_id)
 
     def unassign_course(self, course_id: int) -> None:
-        if course_id not in self.courses:
+        if not self.courses.discard(course_id):
             raise ValueError(f"Instructor is not assigned to course {course_id}")
-        self.courses.remove(course_id)
     
     def to_dict(self) -> Dict:
         return {
             "id": self.id,
             "name": self.name,
             "email": self.email,
-            "courses": self.courses
+            "courses": self.courses.to_list()
         }
     
     def __repr__(self) -> str:
-        return f"<Instructor id={self.id} name={self.name} email={self.email} courses={self.courses}>"
\ No newline at end of file
+        return f"<Instructor id={self.id} name={self.name} email={self.email} courses={self.courses.to_list()}>"
\ No newline at end of file
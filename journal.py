@@ -0,0 +1,187 @@
+"""
+Append-only mutation journal (write-ahead log) for the Registry.
+
+Each successful mutation is appended as one JSON line
+``{"seq": 7, "op": "set_grade", "args": {...}}``. Recovery loads the last
+snapshot and replays the entries whose ``seq`` is newer than the snapshot;
+compaction writes a new snapshot and truncates the journal. A committed
+``Registry.transaction`` is one line, ``{"seq": 8, "op": "transaction",
+"args": {}, "ops": [{"op": ..., "args": ...}, ...]}``.
+"""
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict, Iterator, List, Optional
+
+CHECKPOINT = "checkpoint"
+TRANSACTION = "transaction"
+# argument types written to the journal as they are
+_PLAIN = (str, int, float, bool, type(None), dict, list)
+
+
+class Journal:
+    def __init__(self, file_path: str, fsync_every: int = 1, fsync_interval: Optional[float] = None):
+        """
+        ``fsync_every`` batches fsync calls: 1 syncs every append, N syncs every
+        N appends and 0 leaves it to the OS. ``fsync_interval`` additionally
+        syncs when that many seconds have passed since the last sync.
+        """
+        self.file_path = file_path
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        # held by the registry around "apply mutation + append" and by compaction
+        self.lock = threading.RLock()
+        self.seq = 0
+        self.entries_since_checkpoint = 0
+        self._pending = 0
+        self._last_sync = time.monotonic()
+        self._file = None
+        self._open()
+
+    def _open(self) -> None:
+        # drop a torn last line left by a crash so new entries start on a clean line
+        good_offset = 0
+        if os.path.exists(self.file_path):
+            with open(self.file_path, "rb") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        break
+                    self.seq = max(self.seq, entry.get("seq", 0))
+                    if entry.get("op") != CHECKPOINT:
+                        self.entries_since_checkpoint += 1
+                    good_offset += len(line)
+            with open(self.file_path, "r+b") as f:
+                f.truncate(good_offset)
+        self._file = open(self.file_path, "a", encoding="utf-8")
+
+    def append(self, op: str, args: Dict, result=None) -> int:
+        with self.lock:
+            self.seq += 1
+            entry = {"seq": self.seq, "op": op, "args": args}
+            if result is not None:
+                entry["result"] = result
+            self._write(json.dumps(entry, separators=(",", ":")), 1)
+            return self.seq
+
+    def append_batch(self, entries: List[str]) -> int:
+        """
+        Append already serialized ``{"op", "args"[, "result"]}`` entries as a
+        single ``transaction`` line, so a crash keeps all of them or none.
+        """
+        with self.lock:
+            self.seq += 1
+            self._write(f'{{"seq":{self.seq},"op":"{TRANSACTION}","args":{{}},"ops":[{",".join(entries)}]}}',
+                        len(entries))
+            return self.seq
+
+    def _write(self, line: str, entries: int) -> None:
+        self._file.write(line + "\n")
+        self._file.flush()
+        self._pending += 1
+        self.entries_since_checkpoint += entries
+        if (self.fsync_every and self._pending >= self.fsync_every) or (
+                self.fsync_interval is not None and time.monotonic() - self._last_sync >= self.fsync_interval):
+            self.sync()
+
+    def sync(self) -> None:
+        with self.lock:
+            journal_file = self._file
+            journal_file.flush()
+            self._pending = 0
+            self._last_sync = time.monotonic()
+        # appends may go on during the fsync; whatever was flushed above is made durable
+        try:
+            os.fsync(journal_file.fileno())
+        except (OSError, ValueError):
+            # a checkpoint closed the file meanwhile, and its snapshot covers these entries
+            if not journal_file.closed:
+                raise
+
+    def checkpoint(self, write_snapshot: Callable[[int], None]) -> None:
+        """
+        Fold the journal into a snapshot: ``write_snapshot(seq)`` must persist
+        the current state tagged with ``seq``; the journal is then truncated to a
+        single checkpoint line so sequence numbers keep increasing.
+        """
+        with self.lock:
+            write_snapshot(self.seq)
+            self._file.close()
+            tmp_path = self.file_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(json.dumps({"seq": self.seq, "op": CHECKPOINT, "args": {}}) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.file_path)
+            self._file = open(self.file_path, "a", encoding="utf-8")
+            self._pending = 0
+            self.entries_since_checkpoint = 0
+
+    def close(self) -> None:
+        with self.lock:
+            if self._file is not None and not self._file.closed:
+                self.sync()
+                self._file.close()
+
+
+def read_journal(file_path: str) -> Iterator[Dict]:
+    """Yield journal entries, stopping quietly at a torn last line."""
+    if not os.path.exists(file_path):
+        return
+    with open(file_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                return
+            if entry.get("op") != CHECKPOINT:
+                yield entry
+
+
+def journaled(method: Callable) -> Callable:
+    """
+    Log a successful Registry mutation to the attached journal, if any.
+
+    The mutation and its append happen under the journal lock so a concurrent
+    compaction never snapshots a change that is not yet in the journal.
+    """
+    parameters = list(inspect.signature(method).parameters.values())[1:]
+    if any(p.kind in (p.POSITIONAL_ONLY, p.VAR_POSITIONAL) for p in parameters):
+        raise TypeError(f"{method.__name__} must take its arguments by name to be journaled")
+    # binding by hand: inspect.Signature.bind is most of the cost of a journaled call
+    positional = [p.name for p in parameters if p.kind is p.POSITIONAL_OR_KEYWORD]
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        journal = self._journal
+        if journal is None:
+            return method(self, *args, **kwargs)
+        transaction = self._transaction
+        if len(args) > len(positional):
+            raise TypeError(f"{method.__name__}() takes {len(positional)} positional arguments but {len(args)} were given")
+        arguments = dict(zip(positional, args))
+        for name, value in kwargs.items():
+            if name in arguments:
+                raise TypeError(f"{method.__name__}() got multiple values for argument {name!r}")
+            arguments[name] = value
+        for name, value in arguments.items():
+            if not isinstance(value, _PLAIN):
+                # materialize iterators once so the call and the log see the same ids
+                arguments[name] = list(value)
+        if transaction is not None and transaction.owner == threading.get_ident():
+            # logged with the rest of the transaction when it commits
+            result = method(self, **arguments)
+            transaction.log(method.__name__, arguments, getattr(result, "id", None))
+            return result
+        with journal.lock:
+            result = method(self, **arguments)
+            journal.append(method.__name__, arguments, getattr(result, "id", None))
+        self._after_journal_append()
+        return result
+
+    wrapper.journaled = True
+    return wrapper
@@ -0,0 +1,80 @@
+"""
+Lazy entity storage for the Registry.
+
+A ``LazyStore`` is the Registry's id -> entity dict for one section after a
+lazy load. It holds the raw record of every entity (the parsed dict from a
+JSON file, or the original line of a newline-delimited file) and builds the
+entity the first time it is looked up. Records that were never built are
+written back as they were read.
+"""
+import threading
+from typing import Any, Callable, Dict, Iterator, MutableMapping
+
+
+def is_raw(value: Any) -> bool:
+    # entities are dataclass instances; raw records are a dict or a JSON line
+    return type(value) is dict or type(value) is str
+
+
+class LazyStore(MutableMapping):
+    def __init__(self, build: Callable[[Any], Any]):
+        self._build = build
+        # one dict for both kinds of value keeps the file's record order
+        self._entries: Dict[int, Any] = {}
+        self._raw_count = 0
+        self._build_lock = threading.Lock()
+
+    def put_raw(self, entity_id: int, raw: Any) -> None:
+        if not is_raw(self._entries.get(entity_id)):
+            self._raw_count += 1
+        self._entries[entity_id] = raw
+
+    def __getitem__(self, entity_id: int) -> Any:
+        value = self._entries[entity_id]
+        if is_raw(value):
+            # two threads reaching the same record must end up with one entity
+            with self._build_lock:
+                value = self._entries[entity_id]
+                if is_raw(value):
+                    value = self._build(value)
+                    self._entries[entity_id] = value
+                    self._raw_count -= 1
+        return value
+
+    def __setitem__(self, entity_id: int, entity: Any) -> None:
+        if is_raw(self._entries.get(entity_id)):
+            self._raw_count -= 1
+        self._entries[entity_id] = entity
+
+    def __delitem__(self, entity_id: int) -> None:
+        if is_raw(self._entries.pop(entity_id)):
+            self._raw_count -= 1
+
+    def __contains__(self, entity_id) -> bool:
+        return entity_id in self._entries
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self._entries)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def is_materialized(self, entity_id: int) -> bool:
+        return entity_id in self._entries and not is_raw(self._entries[entity_id])
+
+    @property
+    def materialized_count(self) -> int:
+        return len(self._entries) - self._raw_count
+
+    def record(self, entity_id: int, serialize: Callable[[Any], Any]) -> Any:
+        """One record as ``records`` would give it."""
+        value = self._entries[entity_id]
+        return value if is_raw(value) else serialize(value)
+
+    def records(self, serialize: Callable[[Any], Any]) -> Iterator[Any]:
+        """
+        Every record in order without building anything: raw records as they
+        were loaded and ``serialize(entity)`` for the materialized ones.
+        """
+        for value in self._entries.values():
+            yield value if is_raw(value) else serialize(value)
@@ -0,0 +1,104 @@
+"""
+Load generator for ``server.py``.
+
+Opens ``--clients`` connections, each sending ``--requests`` requests in
+pipelined groups of ``--pipeline``, and reports requests/second and the
+p50/p99 latency of individual requests.
+
+    python loadgen.py --port 8765 --clients 50 --requests 2000 --pipeline 8 --writes 0.2
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from typing import Dict, List, Tuple
+
+
+async def _call(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, requests: List[Dict]) -> List[Dict]:
+    writer.write(b"".join(json.dumps(r).encode("utf-8") + b"\n" for r in requests))
+    await writer.drain()
+    return [json.loads(await reader.readline()) for _ in requests]
+
+
+async def _setup(host: str, port: int, students: int, courses: int) -> Tuple[int, List[int], List[int]]:
+    """Create the instructor, courses and students the load runs against."""
+    reader, writer = await asyncio.open_connection(host, port)
+    tag = random.randrange(1 << 30)
+    (instructor,) = await _call(reader, writer, [{"op": "create_instructor", "args": {
+        "name": "Load Instructor", "email": f"load{tag}@example.com"}}])
+    instructor_id = instructor["result"]["id"]
+    created = await _call(reader, writer, [
+        {"op": "create_course", "args": {"title": f"Load {i}", "description": "Load test", "instructor_id": instructor_id}}
+        for i in range(courses)])
+    course_ids = [r["result"]["id"] for r in created]
+    (bulk,) = await _call(reader, writer, [{"op": "create_students", "args": {"records": [
+        {"name": "Load Student", "email": f"load{tag}x{i}@example.com", "age": 20, "year": 1} for i in range(students)]}}])
+    student_ids = [s["id"] for s in bulk["result"][0]]
+    for course_id in course_ids:
+        await _call(reader, writer, [{"op": "enroll_many", "args": {"course_id": course_id, "student_ids": student_ids}}])
+    writer.close()
+    return instructor_id, course_ids, student_ids
+
+
+async def _client(host: str, port: int, requests: int, pipeline: int, writes: float,
+                  ids: Tuple[int, List[int], List[int]], seed: int, latencies: List[float]) -> None:
+    instructor_id, course_ids, student_ids = ids
+    rng = random.Random(seed)
+    reader, writer = await asyncio.open_connection(host, port)
+    for start in range(0, requests, pipeline):
+        batch = []
+        for i in range(start, min(start + pipeline, requests)):
+            student_id, course_id = rng.choice(student_ids), rng.choice(course_ids)
+            if rng.random() < writes:
+                batch.append({"id": i, "op": "set_grade", "args": {
+                    "instructor_id": instructor_id, "course_id": course_id, "student_id": student_id,
+                    "grade": rng.randint(0, 100)}})
+            else:
+                batch.append({"id": i, "op": "get_student", "args": {"student_id": student_id}})
+        sent = time.perf_counter()
+        responses = await _call(reader, writer, batch)
+        done = time.perf_counter()
+        for response in responses:
+            if not response["ok"]:
+                raise RuntimeError(response["error"])
+            latencies.append(done - sent)
+    writer.close()
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+async def run(host: str, port: int, clients: int, requests: int, pipeline: int, writes: float,
+              students: int = 200, courses: int = 10) -> Dict[str, float]:
+    ids = await _setup(host, port, students, courses)
+    latencies: List[float] = []
+    start = time.perf_counter()
+    await asyncio.gather(*(_client(host, port, requests, pipeline, writes, ids, n, latencies) for n in range(clients)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "requests_per_s": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+    }
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=2000, help="requests per client")
+    parser.add_argument("--pipeline", type=int, default=8, help="requests sent before reading the responses")
+    parser.add_argument("--writes", type=float, default=0.2, help="share of set_grade requests")
+    args = parser.parse_args(argv)
+    results = asyncio.run(run(args.host, args.port, args.clients, args.requests, args.pipeline, args.writes))
+    for name, value in results.items():
+        print(f"{name:<16} {value:12.2f}")
+
+
+if __name__ == "__main__":
+    main()
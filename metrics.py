@@ -0,0 +1,178 @@
+"""
+Opt-in instrumentation of Registry calls (``Registry.enable_metrics``).
+
+Instrumenting wraps the public methods of one registry instance, not of the
+class, so a registry that never enables metrics runs exactly the code it ran
+before. Only the outermost call of a thread is recorded: the lookups
+``enroll_student_in_course`` makes on its own are part of its latency, not
+separate calls, so the per-method times add up to the time callers spent.
+
+For each method the counters are calls, errors (mostly the ``ValueError`` of
+a missing student or course) and a latency histogram; the persistence
+methods also record the size of the file they wrote or read. ``snapshot``
+returns all of it as a dict, ``to_json`` and ``to_prometheus`` export it.
+"""
+import bisect
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence
+
+# upper bounds in seconds, Prometheus style; slower calls land in +Inf
+DEFAULT_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025,
+                   0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+PERSISTENCE = frozenset({"save_to_file", "load_from_file", "save_stream", "load_stream",
+                         "save_snapshot", "load_snapshot"})
+# methods that manage the instrumentation itself
+_SKIP = frozenset({"enable_metrics", "disable_metrics"})
+
+
+class _Method:
+    __slots__ = ("calls", "errors", "seconds", "buckets", "bytes", "last_bytes")
+
+    def __init__(self, size: int):
+        self.calls = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.buckets = [0] * size  # not cumulative; the last one is +Inf
+        self.bytes = 0
+        self.last_bytes: Optional[int] = None
+
+
+class Metrics:
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._methods: Dict[str, _Method] = {}
+        self._lock = threading.Lock()
+
+    def _method(self, name: str) -> _Method:
+        method = self._methods.get(name)
+        if method is None:
+            method = self._methods.setdefault(name, _Method(len(self.buckets) + 1))
+        return method
+
+    def observe(self, name: str, seconds: float, error: bool = False) -> None:
+        self._record(self._method(name), seconds, error)
+
+    def _record(self, method: _Method, seconds: float, error: bool = False) -> None:
+        slot = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            method.calls += 1
+            method.errors += error
+            method.seconds += seconds
+            method.buckets[slot] += 1
+
+    def observe_bytes(self, name: str, size: int) -> None:
+        method = self._method(name)
+        with self._lock:
+            method.bytes += size
+            method.last_bytes = size
+
+    def reset(self) -> None:
+        with self._lock:
+            for method in self._methods.values():
+                method.__init__(len(self.buckets) + 1)
+
+    def snapshot(self) -> Dict[str, Dict]:
+        """``{method: {calls, errors, seconds, buckets: {le: cumulative count}, [bytes, last_bytes]}}``."""
+        bounds = [repr(b) for b in self.buckets] + ["+Inf"]
+        out = {}
+        with self._lock:
+            for name, method in sorted(self._methods.items()):
+                running, cumulative = 0, {}
+                for bound, count in zip(bounds, method.buckets):
+                    running += count
+                    cumulative[bound] = running
+                entry = {"calls": method.calls, "errors": method.errors, "seconds": method.seconds,
+                         "buckets": cumulative}
+                if method.last_bytes is not None:
+                    entry["bytes"] = method.bytes
+                    entry["last_bytes"] = method.last_bytes
+                out[name] = entry
+        return out
+
+    def to_json(self) -> str:
+        return json.dumps(self.snapshot(), indent=2)
+
+    def to_prometheus(self, prefix: str = "scms_registry") -> str:
+        """The Prometheus text exposition format (version 0.0.4)."""
+        snap = self.snapshot()
+        lines: List[str] = []
+
+        def family(name: str, kind: str, help_text: str) -> None:
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} {kind}")
+
+        family("calls_total", "counter", "Registry method calls.")
+        lines.extend(f'{prefix}_calls_total{{method="{m}"}} {e["calls"]}' for m, e in snap.items())
+        family("errors_total", "counter", "Registry method calls that raised.")
+        lines.extend(f'{prefix}_errors_total{{method="{m}"}} {e["errors"]}' for m, e in snap.items())
+        family("latency_seconds", "histogram", "Registry method latency.")
+        for m, e in snap.items():
+            lines.extend(f'{prefix}_latency_seconds_bucket{{method="{m}",le="{le}"}} {count}'
+                         for le, count in e["buckets"].items())
+            lines.append(f'{prefix}_latency_seconds_sum{{method="{m}"}} {e["seconds"]!r}')
+            lines.append(f'{prefix}_latency_seconds_count{{method="{m}"}} {e["calls"]}')
+        sized = {m: e for m, e in snap.items() if "bytes" in e}
+        if sized:
+            family("file_bytes_total", "counter", "Bytes written or read by persistence methods.")
+            lines.extend(f'{prefix}_file_bytes_total{{method="{m}"}} {e["bytes"]}' for m, e in sized.items())
+            family("file_bytes", "gauge", "Size of the file of the last persistence call.")
+            lines.extend(f'{prefix}_file_bytes{{method="{m}"}} {e["last_bytes"]}' for m, e in sized.items())
+        return "\n".join(lines) + "\n"
+
+
+def _file_path(signature: inspect.Signature, args, kwargs) -> Optional[str]:
+    bound = signature.bind(*args, **kwargs)
+    bound.apply_defaults()
+    return bound.arguments.get("file_path")
+
+
+def instrumented_methods(registry) -> List[str]:
+    return [name for name, member in vars(type(registry)).items()
+            if not name.startswith("_") and name not in _SKIP and inspect.isfunction(member)]
+
+
+def instrument(registry, metrics: Metrics) -> None:
+    """Shadow each public method of ``registry`` with a recording wrapper on the instance."""
+    local = threading.local()
+    for name in instrumented_methods(registry):
+        setattr(registry, name, _wrap(name, getattr(registry, name), metrics, local))
+
+
+def uninstrument(registry) -> None:
+    for name in instrumented_methods(registry):
+        registry.__dict__.pop(name, None)
+
+
+def _wrap(name: str, method: Callable, metrics: Metrics, local: threading.local) -> Callable:
+    signature = inspect.signature(method) if name in PERSISTENCE else None
+    clock = time.perf_counter
+    record = metrics._record
+    counters = metrics._method(name)
+
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        if getattr(local, "active", False):
+            return method(*args, **kwargs)
+        local.active = True
+        start = clock()
+        try:
+            result = method(*args, **kwargs)
+        except Exception:
+            record(counters, clock() - start, True)
+            raise
+        finally:
+            local.active = False
+        record(counters, clock() - start)
+        if signature is not None:
+            file_path = _file_path(signature, args, kwargs)
+            if file_path is not None and os.path.isfile(file_path):
+                metrics.observe_bytes(name, os.path.getsize(file_path))
+        return result
+
+    return wrapper
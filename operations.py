@@ -0,0 +1,60 @@
+"""
+Named Registry operations for front ends that are not the interactive menu.
+
+A request is a dict ``{"id": ..., "op": "set_grade", "args": {...}}`` whose
+``args`` are the keyword arguments of the Registry method of that name. The
+response echoes the id and carries either ``"result"`` (entities turned into
+their ``to_dict`` form) or ``"error"``.
+"""
+from typing import Any, Dict
+
+from registry import JOURNALED_OPERATIONS
+
+READ_OPERATIONS = frozenset({
+    "get_student", "get_instructor", "get_course",
+    "find_students_by_email", "find_students_by_year", "find_students_by_type",
+    "list_students", "list_instructors", "list_courses",
+    "course_roster", "course_grade_summary",
+    "gpa", "gpa_rank", "gpa_percentile", "gpa_leaderboard",
+    "search", "query", "explain",
+})
+WRITE_OPERATIONS = JOURNALED_OPERATIONS
+OPERATIONS = READ_OPERATIONS | WRITE_OPERATIONS
+
+
+def is_mutation(op: str) -> bool:
+    return isinstance(op, str) and op in WRITE_OPERATIONS
+
+
+def to_jsonable(value: Any) -> Any:
+    if hasattr(value, "to_dict"):
+        return value.to_dict()
+    if isinstance(value, dict):
+        return {key: to_jsonable(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_jsonable(item) for item in value]
+    return value
+
+
+def execute(registry, op: str, args: Dict) -> Any:
+    if op not in OPERATIONS:
+        raise ValueError(f"Unknown operation {op!r}")
+    return to_jsonable(getattr(registry, op)(**args))
+
+
+def handle(registry, request: Dict) -> Dict:
+    """Run one request; failures become an error response instead of an exception."""
+    response = {"id": request.get("id")}
+    try:
+        if not isinstance(request.get("args", {}), dict):
+            raise ValueError("args must be an object")
+        response["result"] = execute(registry, request.get("op"), request.get("args", {}))
+        response["ok"] = True
+    except (ValueError, TypeError, KeyError) as e:
+        response["ok"] = False
+        response["error"] = str(e)
+    except Exception as e:
+        # e.g. a null or wrongly typed argument failing inside the registry: still only this request's error
+        response["ok"] = False
+        response["error"] = f"{type(e).__name__}: {e}"
+    return response
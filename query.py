@@ -0,0 +1,505 @@
+"""
+Filtered, sorted and paginated queries over students, courses and grades
+(``Registry.query``).
+
+A predicate is built from fields and combined with ``&``, ``|`` and ``~``::
+
+    (F("student_type") == "graduate") & (F("year") == 2) & (F("course_id") == 7)
+
+Over the wire (the server, batch mode) the same is a dict of equalities,
+``{"year": 2}``, or a list of ``[field, op, value]`` conditions.
+
+The planner looks at the conditions every match has to meet (the top-level
+AND) and answers the cheapest one from an index, checking the whole
+predicate only on the candidates that index returns; without such a
+condition the section is scanned. The indexes are
+
+- students: ``id``, ``email``, ``year``, ``student_type`` and
+  ``courses`` (``F("courses").contains(7)``, from the course roster);
+- courses: ``id``, ``instructor_id`` and ``students`` (from the student's
+  courses);
+- grades: ``course_id``, ``student_id``, or any student index followed to
+  the courses of the students it returns.
+
+Grade rows also see the fields of their student (``name``, ``year``, ...).
+``Plan`` says which access path was chosen and, after a run, how many rows
+it read.
+
+Pages are cursor based. Every ordering ends with the row's id, so it is
+total, and a page's ``next_cursor`` holds the sort key of its last row; the
+next page is the rows after that key. Pages therefore neither repeat nor
+skip rows when rows are added in between, and a page costs the same however
+deep it is.
+"""
+import base64
+import heapq
+import json
+import operator
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+STUDENT_FIELDS = ("id", "name", "email", "age", "year", "student_type")
+FIELDS = {
+    "students": STUDENT_FIELDS + ("courses",),
+    "courses": ("id", "title", "description", "year", "instructor_id", "students"),
+    "grades": ("course_id", "student_id", "grade") + STUDENT_FIELDS[1:],
+}
+# collection fields and the attribute holding them
+_MEMBERSHIP = {("students", "courses"): "enrollments", ("courses", "students"): "roster"}
+# compared without regard to case, like the indexes over them
+_CASELESS = frozenset({"email", "student_type"})
+
+OPERATORS: Dict[str, Callable] = {
+    "==": operator.eq, "!=": operator.ne,
+    "<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge,
+    "in": lambda value, options: value in options,
+    "contains": lambda collection, item: item in collection,
+}
+_RANGE = frozenset({"<", "<=", ">", ">="})
+# the planner's guess at grades per student when a student index drives a grades query
+GRADES_PER_STUDENT = 4
+
+
+def _fold(value):
+    return value.casefold() if isinstance(value, str) else value
+
+
+class Predicate:
+    def __and__(self, other: "Predicate") -> "Predicate":
+        return And(self, other)
+
+    def __or__(self, other: "Predicate") -> "Predicate":
+        return Or(self, other)
+
+    def __invert__(self) -> "Predicate":
+        return Not(self)
+
+    def compile(self, accessor: Callable[[str], Callable]) -> Callable[[object], bool]:
+        """A row -> bool function; ``accessor(name)`` returns the row -> value function of a field."""
+        raise NotImplementedError
+
+    def fields(self) -> Iterable[str]:
+        raise NotImplementedError
+
+
+class Compare(Predicate):
+    def __init__(self, name: str, op: str, value):
+        if op not in OPERATORS:
+            raise ValueError(f"Unknown operator {op!r}; choose one of {', '.join(OPERATORS)}")
+        if op == "in":
+            value = tuple(value)
+        if name in _CASELESS:
+            value = tuple(map(_fold, value)) if op == "in" else _fold(value)
+        self.name, self.op, self.value = name, op, value
+
+    def compile(self, accessor: Callable[[str], Callable]) -> Callable[[object], bool]:
+        get, compare, expected = accessor(self.name), OPERATORS[self.op], self.value
+        fold = _fold if self.name in _CASELESS else None
+
+        def test(row) -> bool:
+            value = get(row)
+            if fold is not None:
+                value = fold(value)
+            try:
+                return compare(value, expected)
+            except TypeError:  # an ordering against None or a mismatched type
+                return False
+
+        return test
+
+    def fields(self) -> Iterable[str]:
+        return (self.name,)
+
+    def __str__(self) -> str:
+        return f"{self.name} {self.op} {self.value!r}"
+
+
+class And(Predicate):
+    def __init__(self, *parts: Predicate):
+        # flattened, so the planner sees every condition of a chain of &s
+        self.parts = tuple(p for part in parts for p in (part.parts if isinstance(part, And) else (part,)))
+
+    def compile(self, accessor: Callable[[str], Callable]) -> Callable[[object], bool]:
+        tests = [part.compile(accessor) for part in self.parts]
+        return lambda row: all(test(row) for test in tests)
+
+    def fields(self) -> Iterable[str]:
+        return (name for part in self.parts for name in part.fields())
+
+    def __str__(self) -> str:
+        return " AND ".join(f"({part})" if isinstance(part, Or) else str(part) for part in self.parts)
+
+
+class Or(Predicate):
+    def __init__(self, *parts: Predicate):
+        self.parts = parts
+
+    def compile(self, accessor: Callable[[str], Callable]) -> Callable[[object], bool]:
+        tests = [part.compile(accessor) for part in self.parts]
+        return lambda row: any(test(row) for test in tests)
+
+    def fields(self) -> Iterable[str]:
+        return (name for part in self.parts for name in part.fields())
+
+    def __str__(self) -> str:
+        return " OR ".join(str(part) for part in self.parts)
+
+
+class Not(Predicate):
+    def __init__(self, part: Predicate):
+        self.part = part
+
+    def compile(self, accessor: Callable[[str], Callable]) -> Callable[[object], bool]:
+        test = self.part.compile(accessor)
+        return lambda row: not test(row)
+
+    def fields(self) -> Iterable[str]:
+        return self.part.fields()
+
+    def __str__(self) -> str:
+        return f"NOT ({self.part})"
+
+
+class F:
+    """A field to build conditions on: ``F("year") >= 2``, ``F("id").isin([1, 2])``."""
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __eq__(self, value) -> Compare:  # type: ignore[override]
+        return Compare(self.name, "==", value)
+
+    def __ne__(self, value) -> Compare:  # type: ignore[override]
+        return Compare(self.name, "!=", value)
+
+    def __lt__(self, value) -> Compare:
+        return Compare(self.name, "<", value)
+
+    def __le__(self, value) -> Compare:
+        return Compare(self.name, "<=", value)
+
+    def __gt__(self, value) -> Compare:
+        return Compare(self.name, ">", value)
+
+    def __ge__(self, value) -> Compare:
+        return Compare(self.name, ">=", value)
+
+    def isin(self, values: Iterable) -> Compare:
+        return Compare(self.name, "in", values)
+
+    def contains(self, item) -> Compare:
+        return Compare(self.name, "contains", item)
+
+    __hash__ = None  # type: ignore[assignment]
+
+
+def predicate(spec) -> Optional[Predicate]:
+    """A Predicate from a Predicate, a dict of equalities (a list value means "in") or ``[field, op, value]`` lists."""
+    if spec is None or isinstance(spec, Predicate):
+        return spec
+    if isinstance(spec, dict):
+        parts = [Compare(name, "in" if isinstance(value, list) else "==", value) for name, value in spec.items()]
+    elif isinstance(spec, list):
+        if any(not isinstance(part, (list, tuple)) or len(part) != 3 for part in spec):
+            raise ValueError("Conditions must be [field, op, value] lists")
+        parts = [Compare(*part) for part in spec]
+    else:
+        raise ValueError(f"Cannot make a query condition from {spec!r}")
+    return parts[0] if len(parts) == 1 else And(*parts)
+
+
+@dataclass(slots=True)
+class GradeRow:
+    course_id: int
+    student_id: int
+    grade: float
+    student: object = field(repr=False, compare=False)
+
+    def to_dict(self) -> Dict:
+        return {"course_id": self.course_id, "student_id": self.student_id, "grade": self.grade,
+                "student_name": getattr(self.student, "name", None)}
+
+
+@dataclass
+class Plan:
+    section: str
+    access: str  # "scan", or "index <field>"
+    condition: Optional[str]  # what the index answered
+    estimated_rows: int
+    where: Optional[str]
+    order_by: Tuple[str, ...]
+    examined: Optional[int] = None  # rows read by the run
+
+    def to_dict(self) -> Dict:
+        return {"section": self.section, "access": self.access, "condition": self.condition,
+                "estimated_rows": self.estimated_rows, "where": self.where,
+                "order_by": list(self.order_by), "examined": self.examined}
+
+    def __str__(self) -> str:
+        text = f"{self.section}: {self.access}"
+        if self.condition:
+            text += f" [{self.condition}]"
+        text += f", ~{self.estimated_rows} rows"
+        if self.where:
+            text += f", filter {self.where}"
+        if self.order_by:
+            text += f", order by {', '.join(self.order_by)}"
+        if self.examined is not None:
+            text += f", read {self.examined}"
+        return text
+
+
+@dataclass
+class Page:
+    rows: List
+    next_cursor: Optional[str]
+    plan: Plan
+
+    def to_dict(self) -> Dict:
+        return {"rows": [row.to_dict() for row in self.rows], "next_cursor": self.next_cursor,
+                "plan": self.plan.to_dict()}
+
+
+class _Desc:
+    """Inverts the order of a sort key component."""
+    __slots__ = ("key",)
+
+    def __init__(self, key):
+        self.key = key
+
+    def __lt__(self, other: "_Desc") -> bool:
+        return other.key < self.key
+
+    def __eq__(self, other) -> bool:
+        return self.key == other.key
+
+
+def _accessor(section: str) -> Callable[[str], Callable]:
+    def accessor(name: str) -> Callable:
+        attribute = _MEMBERSHIP.get((section, name), name)
+        if section == "grades" and name not in ("course_id", "student_id", "grade"):
+            return lambda row: getattr(row.student, name, None)
+        return operator.attrgetter(attribute)
+
+    return accessor
+
+
+def _sort_fields(section: str, order_by: Union[None, str, Sequence[str]]) -> Tuple[str, ...]:
+    if order_by is None:
+        return ()
+    fields = (order_by,) if isinstance(order_by, str) else tuple(order_by)
+    for name in fields:
+        if name.lstrip("-") not in FIELDS[section] or (section, name.lstrip("-")) in _MEMBERSHIP:
+            raise ValueError(f"Cannot sort {section} by {name!r}")
+    return fields
+
+
+def _key_functions(section: str, fields: Tuple[str, ...], accessor: Callable) -> Tuple[Callable, Callable]:
+    """
+    ``row -> (sort key, key values)`` and ``key values -> sort key``. Every
+    key ends with the row's id, and None sorts last in either direction.
+    """
+    getters = [accessor(name.lstrip("-")) for name in fields]
+    getters += [operator.attrgetter("course_id"), operator.attrgetter("student_id")] if section == "grades" \
+        else [operator.attrgetter("id")]
+    descending = [name.startswith("-") for name in fields] + [False] * (len(getters) - len(fields))
+
+    def key_of(values: list) -> tuple:
+        return tuple((value is None, _Desc(value) if desc else value) for value, desc in zip(values, descending))
+
+    def key(row) -> tuple:
+        values = [get(row) for get in getters]
+        return key_of(values), values
+
+    return key, key_of
+
+
+def _encode_cursor(fields: Tuple[str, ...], values: list) -> str:
+    raw = json.dumps({"order_by": list(fields), "after": values}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def _decode_cursor(cursor: str, fields: Tuple[str, ...]) -> list:
+    try:
+        state = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        after, order = state["after"], state["order_by"]
+    except (ValueError, TypeError, KeyError):
+        raise ValueError("Invalid cursor") from None
+    if order != list(fields):
+        raise ValueError("The cursor belongs to a query with a different order")
+    return after
+
+
+class _Access:
+    """One way to read a section's candidate rows."""
+
+    def __init__(self, name: str, condition: Optional[str], estimate: int, rows: Callable[[], Iterable]):
+        self.name, self.condition, self.estimate, self.rows = name, condition, estimate, rows
+
+
+def _values(condition: Compare) -> tuple:
+    return condition.value if condition.op == "in" else (condition.value,)
+
+
+def _students_by_ids(registry, ids: Iterable[int]) -> Iterable:
+    for student_id in ids:
+        student = registry.get_student(student_id)
+        if student is not None:
+            yield student
+
+
+def _student_ids(registry, condition: Compare) -> Optional[Union[set, list]]:
+    """Ids of the students an index says may meet ``condition``, or None if no index answers it."""
+    name, op = condition.name, condition.op
+    if name == "id" and op in ("==", "in"):
+        return list(dict.fromkeys(_values(condition)))
+    if name == "email" and op in ("==", "in"):
+        students = (registry.find_students_by_email(email) for email in _values(condition))
+        return [student.id for student in students if student is not None]
+    if name == "courses" and op == "contains":
+        course = registry.get_course(condition.value)
+        return [] if course is None else list(course.roster)
+    if name not in ("year", "student_type"):
+        return None
+    backend = registry._backend
+    if backend is not None:
+        if op not in ("==", "in"):
+            return None
+        with registry._backend_lock:
+            return [sid for value in _values(condition) for sid in backend.student_ids_where(**{name: value})]
+    index = registry._year_index if name == "year" else registry._type_index
+    if op in ("==", "in"):
+        keys = [value for value in _values(condition) if value in index]
+    elif op in _RANGE:
+        test = condition.compile(lambda name: lambda key: key)
+        keys = [key for key in list(index) if test(key)]
+    else:
+        return None
+    if len(keys) == 1:
+        return index[keys[0]]
+    return set().union(*(index[key] for key in keys))
+
+
+def _grade_rows(registry, course_ids: Iterable[int], student_id: Optional[int] = None) -> Iterable[GradeRow]:
+    for course_id in course_ids:
+        course = registry.get_course(course_id)
+        if course is None:
+            continue
+        if student_id is not None:
+            grade = course.grades.get(student_id)
+            if grade is not None:
+                yield GradeRow(course_id, student_id, grade, registry.get_student(student_id))
+            continue
+        for sid, grade in list(course.grades.items()):
+            yield GradeRow(course_id, sid, grade, registry.get_student(sid))
+
+
+def _grades_of(registry, student_ids: Iterable[int]) -> Iterable[GradeRow]:
+    for student in _students_by_ids(registry, student_ids):
+        yield from _grade_rows(registry, student.enrollments.ids(), student.id)
+
+
+def _access_paths(registry, section: str, conditions: List[Compare]) -> List[_Access]:
+    paths = []
+    for condition in conditions:
+        name, op = condition.name, condition.op
+        if section == "students":
+            ids = _student_ids(registry, condition)
+            if ids is not None:
+                paths.append(_Access(f"index {name}", str(condition), len(ids),
+                                     lambda ids=ids: _students_by_ids(registry, list(ids))))
+        elif section == "courses":
+            if name == "id" and op in ("==", "in"):
+                ids = list(dict.fromkeys(_values(condition)))
+            elif name == "instructor_id" and op in ("==", "in"):
+                instructors = (registry.get_instructor(iid) for iid in _values(condition))
+                ids = [cid for instructor in instructors if instructor is not None for cid in instructor.courses.ids()]
+            elif name == "students" and op == "contains":
+                student = registry.get_student(condition.value)
+                ids = [] if student is None else list(student.enrollments.ids())
+            else:
+                continue
+            courses = (registry.get_course(cid) for cid in ids)
+            paths.append(_Access(f"index {name}", str(condition), len(ids),
+                                 lambda courses=courses: (course for course in courses if course is not None)))
+        elif name == "course_id" and op in ("==", "in"):
+            course_ids = list(dict.fromkeys(_values(condition)))
+            courses = [registry.get_course(cid) for cid in course_ids]
+            estimate = sum(len(course.grades) for course in courses if course is not None)
+            paths.append(_Access("index course_id", str(condition), estimate,
+                                 lambda course_ids=course_ids: _grade_rows(registry, course_ids)))
+        elif name == "student_id" and op in ("==", "in"):
+            ids = list(dict.fromkeys(_values(condition)))
+            students = [registry.get_student(sid) for sid in ids]
+            estimate = sum(len(student.enrollments) for student in students if student is not None)
+            paths.append(_Access("index student_id", str(condition), estimate,
+                                 lambda ids=ids: _grades_of(registry, ids)))
+        elif name in STUDENT_FIELDS:
+            ids = _student_ids(registry, condition)
+            if ids is not None:
+                paths.append(_Access(f"index {name} -> grades", str(condition), GRADES_PER_STUDENT * len(ids),
+                                     lambda ids=ids: _grades_of(registry, list(ids))))
+    return paths
+
+
+def _scan(registry, section: str) -> _Access:
+    if section == "students":
+        students = registry.list_students()
+        return _Access("scan", None, len(students), lambda: list(students.values()))
+    courses = registry.list_courses()
+    if section == "courses":
+        return _Access("scan", None, len(courses), lambda: list(courses.values()))
+    return _Access("scan", None, sum(len(course.grades) for course in courses.values()),
+                   lambda: _grade_rows(registry, list(courses)))
+
+
+def _choose(registry, section: str, where: Optional[Predicate]) -> _Access:
+    if section not in FIELDS:
+        raise ValueError(f"Cannot query {section!r}; choose one of {', '.join(FIELDS)}")
+    if where is not None:
+        for name in where.fields():
+            if name not in FIELDS[section]:
+                raise ValueError(f"{section} have no field {name!r}")
+    parts = where.parts if isinstance(where, And) else (where,) if where is not None else ()
+    conditions = [part for part in parts if isinstance(part, Compare)]
+    paths = _access_paths(registry, section, conditions)
+    return min(paths, key=lambda path: path.estimate) if paths else _scan(registry, section)
+
+
+def plan_query(registry, section: str, where=None, order_by=None) -> Plan:
+    where = predicate(where)
+    fields = _sort_fields(section, order_by)
+    access = _choose(registry, section, where)
+    return Plan(section, access.name, access.condition, access.estimate,
+                None if where is None else str(where), fields)
+
+
+def run_query(registry, section: str, where=None, order_by=None, limit: int = 50, cursor: Optional[str] = None) -> Page:
+    """The first ``limit`` matching rows in ``order_by`` order (after ``cursor``), and the cursor of the next page."""
+    if limit <= 0:
+        raise ValueError("limit must be positive")
+    where = predicate(where)
+    fields = _sort_fields(section, order_by)
+    access = _choose(registry, section, where)
+    accessor = _accessor(section)
+    test = None if where is None else where.compile(accessor)
+    key, key_of = _key_functions(section, fields, accessor)
+    after = None if cursor is None else key_of(_decode_cursor(cursor, fields))
+    examined = 0
+
+    def matches() -> Iterable[Tuple[tuple, list, object]]:
+        nonlocal examined
+        for row in access.rows():
+            examined += 1
+            if test is not None and not test(row):
+                continue
+            row_key, values = key(row)
+            if after is None or after < row_key:
+                yield row_key, values, row
+
+    # one extra row tells whether there is a next page
+    top = heapq.nsmallest(limit + 1, matches(), key=lambda match: match[0])
+    next_cursor = _encode_cursor(fields, top[limit - 1][1]) if len(top) > limit else None
+    page_plan = Plan(section, access.name, access.condition, access.estimate,
+                     None if where is None else str(where), fields, examined)
+    return Page([row for _, _, row in top[:limit]], next_cursor, page_plan)
@@ -0,0 +1,264 @@
+import random
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from gradestats import SCALE_BITS, scaled
+
+_MAX_LEVELS = 24  # plenty for 2**24 keys; taller lists only cost a few extra hops
+
+
+class _Node:
+    __slots__ = ("key", "next", "width")
+
+    def __init__(self, key: Any, levels: int):
+        self.key = key
+        self.next: List[Optional["_Node"]] = [None] * levels
+        self.width: List[int] = [1] * levels
+
+
+class OrderStatisticList:
+    """
+    Sorted list of unique keys backed by an indexable skip list.
+
+    Insert, remove, ``rank`` (how many keys sort before a key) and ``select``
+    (the key at a position) are all O(log n) expected.
+    """
+
+    def __init__(self, keys: Iterable[Any] = (), seed: Optional[int] = None):
+        self._random = random.Random(seed).random
+        self._build(sorted(keys))
+
+    def _build(self, ordered: List[Any]) -> None:
+        """Link already sorted, unique keys in O(n) instead of n inserts."""
+        self._head = _Node(None, _MAX_LEVELS)
+        self._size = len(ordered)
+        last: List[_Node] = [self._head] * _MAX_LEVELS
+        last_position = [0] * _MAX_LEVELS
+        for position, key in enumerate(ordered, start=1):
+            levels = self._level()
+            node = _Node(key, levels)
+            for level in range(levels):
+                last[level].next[level] = node
+                last[level].width[level] = position - last_position[level]
+                last[level], last_position[level] = node, position
+        for level in range(_MAX_LEVELS):
+            last[level].width[level] = self._size + 1 - last_position[level]
+
+    def clear(self) -> None:
+        self._build([])
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _level(self) -> int:
+        level = 1
+        while level < _MAX_LEVELS and self._random() < 0.5:
+            level += 1
+        return level
+
+    def _chain(self, key: Any) -> Tuple[List[_Node], List[int]]:
+        chain: List[_Node] = [self._head] * _MAX_LEVELS
+        steps: List[int] = [0] * _MAX_LEVELS
+        node = self._head
+        for level in range(_MAX_LEVELS - 1, -1, -1):
+            nxt = node.next[level]
+            while nxt is not None and nxt.key < key:
+                steps[level] += node.width[level]
+                node = nxt
+                nxt = node.next[level]
+            chain[level] = node
+        return chain, steps
+
+    def insert(self, key: Any) -> None:
+        chain, steps_at_level = self._chain(key)
+        nxt = chain[0].next[0]
+        if nxt is not None and nxt.key == key:
+            raise ValueError(f"Key {key!r} is already present")
+        levels = self._level()
+        node = _Node(key, levels)
+        steps = 0
+        for level in range(levels):
+            prev = chain[level]
+            node.next[level] = prev.next[level]
+            prev.next[level] = node
+            node.width[level] = prev.width[level] - steps
+            prev.width[level] = steps + 1
+            steps += steps_at_level[level]
+        for level in range(levels, _MAX_LEVELS):
+            chain[level].width[level] += 1
+        self._size += 1
+
+    def remove(self, key: Any) -> None:
+        chain, _ = self._chain(key)
+        node = chain[0].next[0]
+        if node is None or node.key != key:
+            raise KeyError(key)
+        levels = len(node.next)
+        for level in range(levels):
+            prev = chain[level]
+            prev.width[level] += node.width[level] - 1
+            prev.next[level] = node.next[level]
+        for level in range(levels, _MAX_LEVELS):
+            chain[level].width[level] -= 1
+        self._size -= 1
+
+    def rank(self, key: Any) -> int:
+        """Number of keys strictly less than ``key``."""
+        position = 0
+        node = self._head
+        for level in range(_MAX_LEVELS - 1, -1, -1):
+            nxt = node.next[level]
+            while nxt is not None and nxt.key < key:
+                position += node.width[level]
+                node = nxt
+                nxt = node.next[level]
+        return position
+
+    def _node_at(self, index: int) -> _Node:
+        if not 0 <= index < self._size:
+            raise IndexError("OrderStatisticList index out of range")
+        remaining = index + 1
+        node = self._head
+        for level in range(_MAX_LEVELS - 1, -1, -1):
+            while node.next[level] is not None and node.width[level] <= remaining:
+                remaining -= node.width[level]
+                node = node.next[level]
+        return node
+
+    def select(self, index: int) -> Any:
+        return self._node_at(index).key
+
+    def iter_from(self, index: int = 0) -> Iterator[Any]:
+        if index >= self._size:
+            return
+        node: Optional[_Node] = self._node_at(index)
+        while node is not None:
+            yield node.key
+            node = node.next[0]
+
+    def __iter__(self) -> Iterator[Any]:
+        return self.iter_from(0)
+
+
+class GradeRanking:
+    """
+    Per-course grade order, best grade first. Ties share a rank
+    (standard competition ranking: 100, 90, 90, 80 -> 1, 2, 2, 4).
+    """
+
+    def __init__(self, grades: Optional[Dict[int, float]] = None):
+        self._order = OrderStatisticList((-grade, student_id) for student_id, grade in (grades or {}).items())
+
+    def __len__(self) -> int:
+        return len(self._order)
+
+    def update(self, student_id: int, old: Optional[float], new: Optional[float]) -> None:
+        if old is not None:
+            self._order.remove((-old, student_id))
+        if new is not None:
+            self._order.insert((-new, student_id))
+
+    def rank(self, grade: float) -> int:
+        return self._order.rank((-grade, float("-inf"))) + 1
+
+    def percentile(self, grade: float) -> float:
+        """Share of grades strictly below ``grade``, as a percentage."""
+        if not self._order:
+            return 0.0
+        at_or_above = self._order.rank((-grade, float("inf")))
+        return 100.0 * (len(self._order) - at_or_above) / len(self._order)
+
+    def top(self, k: int) -> List[Tuple[int, float]]:
+        result = []
+        for neg_grade, student_id in self._order.iter_from(0):
+            if len(result) >= k:
+                break
+            result.append((student_id, -neg_grade))
+        return result
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Grade at quantile ``q`` (0..1) with linear interpolation; 0.5 is the median."""
+        n = len(self._order)
+        if not n:
+            return None
+        if not 0.0 <= q <= 1.0:
+            raise ValueError("Quantile must be between 0 and 1")
+        # ascending position p maps to descending index n - 1 - p
+        position = q * (n - 1)
+        low = int(position)
+        high = min(low + 1, n - 1)
+        low_grade = -self._order.select(n - 1 - low)[0]
+        high_grade = -self._order.select(n - 1 - high)[0]
+        return low_grade + (high_grade - low_grade) * (position - low)
+
+
+class Leaderboard:
+    """Registry-wide ranking of students by their average grade over all graded courses."""
+
+    def __init__(self):
+        self._order = OrderStatisticList()
+        # exact (scaled) grade total and grade count per student
+        self._totals: Dict[int, Tuple[int, int]] = {}
+        self._keys: Dict[int, Tuple[float, int]] = {}
+
+    def __len__(self) -> int:
+        return len(self._order)
+
+    def clear(self) -> None:
+        self._order.clear()
+        self._totals.clear()
+        self._keys.clear()
+
+    def rebuild(self, courses: Iterable) -> None:
+        """Recompute from scratch, e.g. after a load: one pass plus an O(n) build."""
+        self.clear()
+        totals = self._totals
+        for course in courses:
+            for student_id, grade in course.grades.items():
+                total, count = totals.get(student_id, (0, 0))
+                totals[student_id] = (total + scaled(grade), count + 1)
+        for student_id, (total, count) in totals.items():
+            self._keys[student_id] = (-(total / (count << SCALE_BITS)), student_id)
+        self._order = OrderStatisticList(self._keys.values())
+
+    def record(self, student_id: int, old: Optional[float], new: Optional[float]) -> None:
+        """Apply one grade change for a student: ``old`` and/or ``new`` may be None."""
+        total, count = self._totals.get(student_id, (0, 0))
+        if old is not None:
+            total, count = total - scaled(old), count - 1
+        if new is not None:
+            total, count = total + scaled(new), count + 1
+        key = self._keys.pop(student_id, None)
+        if key is not None:
+            self._order.remove(key)
+        if count:
+            self._totals[student_id] = (total, count)
+            key = (-(total / (count << SCALE_BITS)), student_id)
+            self._keys[student_id] = key
+            self._order.insert(key)
+        else:
+            self._totals.pop(student_id, None)
+
+    def gpa(self, student_id: int) -> Optional[float]:
+        key = self._keys.get(student_id)
+        return None if key is None else -key[0]
+
+    def rank(self, student_id: int) -> Optional[int]:
+        key = self._keys.get(student_id)
+        if key is None:
+            return None
+        return self._order.rank((key[0], float("-inf"))) + 1
+
+    def percentile(self, student_id: int) -> Optional[float]:
+        key = self._keys.get(student_id)
+        if key is None:
+            return None
+        at_or_above = self._order.rank((key[0], float("inf")))
+        return 100.0 * (len(self._order) - at_or_above) / len(self._order)
+
+    def top(self, k: int = 10, offset: int = 0) -> List[Tuple[int, float]]:
+        result = []
+        for neg_gpa, student_id in self._order.iter_from(offset):
+            if len(result) >= k:
+                break
+            result.append((student_id, -neg_gpa))
+        return result
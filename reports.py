@@ -1,32 +1,221 @@
+"""
+Course reports.
+
+``CourseReport`` renders one course. ``ReportEngine`` renders many in one
+pass: student names are collected once and shared by every course, reports
+come back as strings instead of being printed, and large batches can be
+fanned out to a process pool. Given a ``ReportCache``, the engine only
+renders courses whose version changed since they were last rendered.
+"""
+import math
+import os
+import threading
+from collections import OrderedDict
 from abc import ABC, abstractmethod
-from typing import List
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, Iterable, List, Mapping, Optional, Tuple
+
+# (id, title, roster, grades): what a worker process needs to render a course
+CourseRow = Tuple[int, str, List[int], Dict[int, float]]
+
+NO_GRADE = "Marks not available at moment"
+
+
+def course_lines(course_id: int, title: str, roster: Iterable[int], grades: Mapping[int, float],
+                 name_of: Callable[[int], Optional[str]]) -> List[str]:
+    lines = [f"Report for course name: {title} with id {course_id}"]
+    if not roster:
+        lines.append(f"No students enrolled in {title}")
+        return lines
+    for sid in roster:
+        grade = grades.get(sid)
+        grade_str = f"{grade:.1f}" if grade is not None else NO_GRADE
+        lines.append(f"{sid}:{name_of(sid)}:{grade_str}")
+    if grades:
+        lines.append(f"class average: {math.fsum(grades.values()) / len(grades):.2f}")
+    return lines
+
 
 class ReportBase(ABC):
     @abstractmethod
     def generate(self) -> List[str]:
         pass
-    
+
+    def render(self) -> str:
+        return "\n".join(self.generate()) + "\n"
+
+
 class CourseReport(ReportBase):
     def __init__(self, course, students_lookup):
         self.course = course
         self.students_lookup = students_lookup
-        
-    def generate(self):
-        print(f"Report for course name: {self.course.title} with id {self.course.id}")
-        
-        if not self.course.roster:
-            print(f"No students enrolled in {self.course.title}")
-            return
-        
-        for sid in self.course.roster:
-            student = self.students_lookup(sid)
-            grade  = self.course.grades.get(sid)
-            grade_str = f"{grade:.1f}" if grade is not None else "Marks not available at moment"
-            print(f"{student.id}:{student.name}:{grade_str}")
-            
-        avg = self.course.get_average_grade()
-        if avg is not None:
-            print(f"class average: {avg:.2f}")
-            
-        
-        
\ No newline at end of file
+
+    def _name(self, sid: int) -> Optional[str]:
+        student = self.students_lookup(sid)
+        return student.name if student is not None else None
+
+    def generate(self) -> List[str]:
+        course = self.course
+        return course_lines(course.id, course.title, course.roster, course.grades, self._name)
+
+
+class ReportCache:
+    """
+    LRU cache of rendered reports keyed by ``(course_id, course.version)``.
+    A course's version changes whenever its roster, grades or a listed
+    student's name change, so a stale report is never returned; it just ages
+    out. ``hits``, ``misses`` and ``evictions`` are there to size ``capacity``.
+    """
+
+    def __init__(self, capacity: int = 1024):
+        if capacity < 1:
+            raise ValueError("Cache capacity must be at least 1")
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._reports: "OrderedDict[int, Tuple[int, str]]" = OrderedDict()  # course id -> (version, text)
+        self._lock = threading.Lock()
+
+    def get(self, course) -> Optional[str]:
+        with self._lock:
+            entry = self._reports.get(course.id)
+            if entry is None or entry[0] != course.version:
+                self.misses += 1
+                return None
+            self._reports.move_to_end(course.id)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, course_id: int, version: int, text: str) -> None:
+        with self._lock:
+            # an older version of the same course is replaced, not kept around
+            self._reports[course_id] = (version, text)
+            self._reports.move_to_end(course_id)
+            while len(self._reports) > self.capacity:
+                self._reports.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._reports.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {"size": len(self._reports), "capacity": self.capacity,
+                "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+    def __len__(self) -> int:
+        return len(self._reports)
+
+
+# worker-process state, set once per worker by the pool initializer
+_names: Dict[int, str] = {}
+
+
+def _init_worker(names: Dict[int, str]) -> None:
+    global _names
+    _names = names
+
+
+def _render_rows(rows: List[CourseRow]) -> List[Tuple[int, str]]:
+    name_of = _names.get
+    return [(row[0], "\n".join(course_lines(*row, name_of)) + "\n") for row in rows]
+
+
+class ReportEngine:
+    """
+    Renders reports for every course, or a chosen set, against one shared
+    id -> name table. ``workers`` > 0 renders in that many processes, in
+    chunks of ``chunk_size`` courses; below ``min_parallel`` courses the pool
+    is not worth starting and rendering stays in process. With a ``cache``,
+    only courses that changed since they were last rendered are rendered.
+    """
+
+    def __init__(self, registry, workers: int = 0, chunk_size: int = 250, min_parallel: int = 1000,
+                 cache: Optional[ReportCache] = None):
+        self.registry = registry
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.min_parallel = min_parallel
+        self.cache = cache
+
+    def _courses(self, course_ids: Optional[Iterable[int]]) -> List:
+        if course_ids is None:
+            return list(self.registry.list_courses().values())
+        courses = []
+        for course_id in course_ids:
+            course = self.registry.get_course(course_id)
+            if course is None:
+                raise ValueError(f"Course with ID {course_id} does not exist")
+            courses.append(course)
+        return courses
+
+    def _names(self, courses: List, everyone: bool) -> Dict[int, str]:
+        if everyone:
+            return {sid: student.name for sid, student in self.registry.list_students().items()}
+        names = {}
+        for course in courses:
+            for sid in course.roster:
+                if sid not in names:
+                    student = self.registry.get_student(sid)
+                    names[sid] = student.name if student is not None else None
+        return names
+
+    def render(self, course_id: int) -> str:
+        return self.render_all([course_id])[course_id]
+
+    def render_all(self, course_ids: Optional[Iterable[int]] = None) -> Dict[int, str]:
+        """``{course_id: report}`` for ``course_ids``, or for every course when None."""
+        courses = self._courses(course_ids)
+        reports: Dict[int, Optional[str]] = {}
+        stale = courses
+        if self.cache is not None:
+            stale = []
+            for course in courses:
+                reports[course.id] = self.cache.get(course)
+                if reports[course.id] is None:
+                    stale.append(course)
+        if not stale:
+            return reports
+        # walking every student only pays off when most courses need rendering
+        names = self._names(stale, everyone=course_ids is None and 2 * len(stale) > len(courses))
+        # snapshot the fields (and the version they are at) so a worker never needs the registry
+        versions = {c.id: c.version for c in stale}
+        rows = [(c.id, c.title, list(c.roster), dict(c.grades)) for c in stale]
+        if not self.workers or len(rows) < self.min_parallel:
+            name_of = names.get
+            rendered = [(row[0], "\n".join(course_lines(*row, name_of)) + "\n") for row in rows]
+        else:
+            chunks = [rows[i:i + self.chunk_size] for i in range(0, len(rows), self.chunk_size)]
+            with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker, initargs=(names,)) as pool:
+                rendered = [item for chunk in pool.map(_render_rows, chunks) for item in chunk]
+        for course_id, text in rendered:
+            reports[course_id] = text
+            if self.cache is not None:
+                self.cache.put(course_id, versions[course_id], text)
+        return reports
+
+    def render_instructor(self, instructor_id: int) -> Dict[int, str]:
+        instructor = self.registry.get_instructor(instructor_id)
+        if instructor is None:
+            raise ValueError(f"Instructor with ID {instructor_id} does not exist")
+        return self.render_all(list(instructor.courses))
+
+    def write_all(self, directory: str, course_ids: Optional[Iterable[int]] = None) -> List[str]:
+        """Render, then write one ``course_<id>.txt`` per course into ``directory``."""
+        reports = self.render_all(course_ids)
+        os.makedirs(directory, exist_ok=True)
+        paths = []
+        for course_id, text in reports.items():
+            path = os.path.join(directory, f"course_{course_id}.txt")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(text)
+            paths.append(path)
+        return paths
+
+    def write_file(self, file_path: str, course_ids: Optional[Iterable[int]] = None) -> int:
+        """Render, then write every report into the single file ``file_path``; returns the report count."""
+        reports = self.render_all(course_ids)
+        with open(file_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(reports.values()))
+        return len(reports)
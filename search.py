@@ -0,0 +1,192 @@
+"""
+Inverted index for full-text and typeahead search (``Registry.enable_search``).
+
+Text is split into lowercase letter/digit tokens; every token maps to the ids
+of the entities containing it. A query matches entities that contain all of
+its tokens (AND). Each query token matches a term exactly, or, for the last
+token of a typeahead query, as a prefix (expanded to at most
+``max_expansions`` terms, like search engines do); a token that matches
+nothing either way falls back to the terms one edit away from it.
+
+Results are ranked by how well each token matched (exact over prefix, a
+closer prefix over a longer completion, anything over a typo) and then by
+insertion order, and paginated with ``limit``/``offset``. A single-token
+query streams matches best term first and stops once the page is full, so
+typeahead does not depend on how many entities share a common prefix.
+"""
+import bisect
+import re
+import sys
+import threading
+from itertools import islice
+from typing import Dict, Iterator, List, Tuple
+
+# the fields indexed per registry section
+FIELDS = {
+    "students": ("name", "email"),
+    "instructors": ("name", "email"),
+    "courses": ("title", "description"),
+}
+
+EXACT = 3.0
+FUZZY = 0.5  # prefix matches score between 1 and 2, by how much of the term was typed
+MIN_FUZZY_LENGTH = 3
+
+_TOKEN = re.compile(r"[^\W_]+")
+_ALPHABET = "abcdefghijklmnopqrstuvwxyz0123456789"
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN.findall(text.casefold())
+
+
+def edits1(token: str) -> set:
+    """Strings one deletion, transposition, replacement or insertion away from ``token``."""
+    splits = [(token[:i], token[i:]) for i in range(len(token) + 1)]
+    deletes = [a + b[1:] for a, b in splits if b]
+    transposes = [a + b[1] + b[0] + b[2:] for a, b in splits if len(b) > 1]
+    replaces = [a + c + b[1:] for a, b in splits if b for c in _ALPHABET]
+    inserts = [a + c + b for a, b in splits for c in _ALPHABET]
+    return set(deletes + transposes + replaces + inserts)
+
+
+class TextIndex:
+    def __init__(self, max_expansions: int = 50):
+        self.max_expansions = max_expansions
+        self._postings: Dict[str, Dict[int, None]] = {}  # term -> ids, in insertion order
+        self._doc_terms: Dict[int, Tuple[str, ...]] = {}
+        # sorted terms for prefix lookups; new terms are merged in on the next query,
+        # and terms whose posting emptied stay until a rebuild (lookups skip them)
+        self._vocab: List[str] = []
+        self._new_terms: List[str] = []
+        self._vocab_lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._doc_terms)
+
+    def add(self, doc_id: int, *texts: str) -> None:
+        """Index ``texts`` under ``doc_id``, replacing what was indexed for it before."""
+        self.remove(doc_id)
+        terms = tuple(dict.fromkeys(sys.intern(t) for text in texts if text for t in tokenize(text)))
+        self._doc_terms[doc_id] = terms
+        for term in terms:
+            posting = self._postings.get(term)
+            if posting is None:
+                posting = self._postings[term] = {}
+                self._new_terms.append(term)
+            posting[doc_id] = None
+
+    def remove(self, doc_id: int) -> None:
+        for term in self._doc_terms.pop(doc_id, ()):
+            posting = self._postings[term]
+            del posting[doc_id]
+            if not posting:
+                del self._postings[term]
+
+    def clear(self) -> None:
+        self._postings.clear()
+        self._doc_terms.clear()
+        self._vocab, self._new_terms = [], []
+
+    def _sorted_vocab(self) -> List[str]:
+        if self._new_terms:
+            with self._vocab_lock:
+                new, self._new_terms = self._new_terms, []
+                if len(new) < 64:
+                    for term in new:
+                        i = bisect.bisect_left(self._vocab, term)
+                        if i == len(self._vocab) or self._vocab[i] != term:
+                            self._vocab.insert(i, term)
+                else:
+                    self._vocab = sorted(self._postings)
+        return self._vocab
+
+    def _terms(self, token: str, prefix: bool) -> List[Tuple[str, float]]:
+        """The index terms ``token`` matches, best first, with the score of each."""
+        postings = self._postings
+        terms = [(token, EXACT)] if token in postings else []
+        if prefix:
+            vocab = self._sorted_vocab()
+            expansions = []
+            i = bisect.bisect_left(vocab, token)
+            while i < len(vocab) and len(expansions) < self.max_expansions and vocab[i].startswith(token):
+                term = vocab[i]
+                if term != token and term in postings:
+                    expansions.append(term)
+                i += 1
+            expansions.sort(key=len)
+            terms.extend((term, 1.0 + len(token) / len(term)) for term in expansions)
+        if not terms and len(token) >= MIN_FUZZY_LENGTH:
+            terms = [(term, FUZZY) for term in sorted(edits1(token)) if term in postings]
+        return terms
+
+    def _stream(self, terms: List[Tuple[str, float]]) -> Iterator[Tuple[int, float]]:
+        seen = set()
+        for term, score in terms:
+            for doc_id in self._postings[term]:
+                if doc_id not in seen:
+                    seen.add(doc_id)
+                    yield doc_id, score
+
+    def search(self, query: str, limit: int = 10, offset: int = 0, prefix: bool = True) -> List[Tuple[int, float]]:
+        """
+        ``(id, score)`` pairs, best first. With ``prefix`` the last token may be
+        incomplete, as in a search box; a trailing space marks it complete.
+        """
+        tokens = tokenize(query)
+        if not tokens or limit <= 0:
+            return []
+        prefix = prefix and not query[-1:].isspace()
+        matches = [self._terms(token, prefix and i == len(tokens) - 1) for i, token in enumerate(tokens)]
+        if not all(matches):
+            return []
+        if len(matches) == 1:
+            return list(islice(self._stream(matches[0]), offset, offset + limit))
+        postings = self._postings
+        # walk the token with the fewest candidates, probe the others
+        matches.sort(key=lambda terms: sum(len(postings[term]) for term, _ in terms))
+        driver, others = matches[0], matches[1:]
+        scored = []
+        for doc_id, score in self._stream(driver):
+            for terms in others:
+                best = next((s for term, s in terms if doc_id in postings[term]), None)
+                if best is None:
+                    break
+                score += best
+            else:
+                scored.append((doc_id, score))
+        # sort is stable, so equal scores keep insertion order
+        scored.sort(key=lambda match: -match[1])
+        return scored[offset:offset + limit]
+
+
+class SearchIndex:
+    """One ``TextIndex`` per registry section, over that section's ``FIELDS``."""
+
+    def __init__(self, max_expansions: int = 50):
+        self.sections = {section: TextIndex(max_expansions) for section in FIELDS}
+
+    def add(self, section: str, entity_id: int, record) -> None:
+        """Index an entity, or a record dict of one, of ``section``."""
+        get = record.get if isinstance(record, dict) else lambda name: getattr(record, name, None)
+        self.sections[section].add(entity_id, *(get(name) for name in FIELDS[section]))
+
+    def remove(self, section: str, entity_id: int) -> None:
+        self.sections[section].remove(entity_id)
+
+    def clear(self) -> None:
+        for index in self.sections.values():
+            index.clear()
+
+    def detach(self) -> Dict[str, TextIndex]:
+        """Swap in empty indexes and return the current ones, which can be put back in ``sections``."""
+        sections = self.sections
+        self.sections = {section: TextIndex(index.max_expansions) for section, index in sections.items()}
+        return sections
+
+    def search(self, section: str, query: str, limit: int = 10, offset: int = 0,
+               prefix: bool = True) -> List[Tuple[int, float]]:
+        index = self.sections.get(section)
+        if index is None:
+            raise ValueError(f"Cannot search {section!r}; choose one of {', '.join(FIELDS)}")
+        return index.search(query, limit, offset, prefix)
@@ -0,0 +1,199 @@
+"""
+Asyncio JSON-lines server for the Registry.
+
+Clients send one request per line (see ``operations``) and get one response
+line per request, in order. Requests a client pipelines arrive in the same
+read and are answered as one batch with one write.
+
+Requests run straight on the event loop. Saves run in a thread pool
+executor, and every request waits for them behind an asyncio lock: the
+registry is not thread safe, and even reads build caches and indexes on
+first use. Journal fsyncs run in the executor too, and every mutation that
+was appended before an fsync started shares it (group commit) before its
+response is sent. A client whose request line grows past ``max_line``
+bytes gets an error and is disconnected.
+
+    python server.py --port 8765 --data scms_data.json --save-every 60
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import signal
+from typing import List, Optional
+
+import operations
+from journal import Journal
+from registry import Registry, data_file, journal_file
+
+_READ_SIZE = 1 << 16
+MAX_LINE = 1 << 20
+
+
+class RegistryServer:
+    def __init__(self, registry: Registry, data_path: str = data_file, save_every: Optional[float] = None,
+                 max_line: int = MAX_LINE):
+        self.registry = registry
+        self.data_path = data_path
+        self.save_every = save_every
+        self.max_line = max_line
+        # created on the server's loop
+        self._persistence: Optional[asyncio.Lock] = None
+        self._syncing: Optional[asyncio.Lock] = None
+        self._next_sync: Optional[asyncio.Future] = None
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 8765) -> asyncio.AbstractServer:
+        self._persistence = asyncio.Lock()
+        self._syncing = asyncio.Lock()
+        server = await asyncio.start_server(self.handle_client, host, port)
+        if self.save_every:
+            asyncio.ensure_future(self._autosave())
+        return server
+
+    async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        pending = b""
+        try:
+            while True:
+                chunk = await reader.read(_READ_SIZE)
+                if not chunk:
+                    break
+                lines = (pending + chunk).split(b"\n")
+                pending = lines.pop()
+                requests = [line for line in lines if line.strip()]
+                if requests:
+                    writer.write(b"".join(await self.run_batch(requests)))
+                if len(pending) > self.max_line:
+                    writer.write(self._encode({"id": None, "ok": False,
+                                               "error": f"Request line longer than {self.max_line} bytes"}))
+                    await writer.drain()
+                    break
+                if requests:
+                    await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def run_batch(self, lines: List[bytes]) -> List[bytes]:
+        requests = []
+        for line in lines:
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise ValueError("request must be an object")
+            except ValueError as e:
+                request = {"error": f"Invalid request: {e}"}
+            requests.append(request)
+        writes = any(operations.is_mutation(r.get("op")) or r.get("op") == "save" for r in requests)
+        if not writes:
+            if not self._persistence.locked():
+                return [self._encode(self._run(request)) for request in requests]
+            # a save is running in the executor; the registry must not change under it
+            async with self._persistence:
+                return [self._encode(self._run(request)) for request in requests]
+        async with self._persistence:
+            responses = []
+            for request in requests:
+                if request.get("op") == "save":
+                    await self._save()
+                    responses.append({"id": request.get("id"), "ok": True, "result": self.data_path})
+                else:
+                    responses.append(self._run(request))
+        if self.registry._journal is not None:
+            await self._sync_journal()
+        return [self._encode(response) for response in responses]
+
+    async def _sync_journal(self) -> None:
+        """Wait for an fsync that starts after this call; concurrent callers share it."""
+        if self._next_sync is None:
+            self._next_sync = asyncio.ensure_future(self._fsync())
+        await asyncio.shield(self._next_sync)
+
+    async def _fsync(self) -> None:
+        async with self._syncing:
+            # from here on, new appends need the following fsync
+            self._next_sync = None
+            journal = self.registry._journal
+            if journal is not None:
+                await asyncio.get_running_loop().run_in_executor(None, journal.sync)
+
+    def _run(self, request: dict) -> dict:
+        if "error" in request and "op" not in request:
+            return {"id": None, "ok": False, "error": request["error"]}
+        if request.get("op") == "metrics":
+            return self._metrics(request)
+        return operations.handle(self.registry, request)
+
+    def _metrics(self, request: dict) -> dict:
+        recorder = self.registry._metrics
+        if recorder is None:
+            return {"id": request.get("id"), "ok": False, "error": "Metrics are not enabled (start with --metrics)"}
+        prometheus = (request.get("args") or {}).get("format") == "prometheus"
+        return {"id": request.get("id"), "ok": True,
+                "result": recorder.to_prometheus() if prometheus else recorder.snapshot()}
+
+    @staticmethod
+    def _encode(response: dict) -> bytes:
+        return json.dumps(response, separators=(",", ":")).encode("utf-8") + b"\n"
+
+    async def _save(self) -> None:
+        # the caller holds the persistence lock, so no mutation runs meanwhile
+        loop = asyncio.get_running_loop()
+        if self.registry._journal is not None:
+            await loop.run_in_executor(None, self.registry.compact_journal)
+        else:
+            await loop.run_in_executor(None, self.registry.save_to_file, self.data_path)
+
+    async def save(self) -> None:
+        async with self._persistence:
+            await self._save()
+
+    async def _autosave(self) -> None:
+        while True:
+            await asyncio.sleep(self.save_every)
+            await self.save()
+
+
+async def _main(args: argparse.Namespace) -> None:
+    registry = Registry()
+    if args.metrics:
+        registry.enable_metrics()
+    registry.recover(args.data, args.journal)
+    # fsync happens once per batch in the executor, not on every append
+    registry.attach_journal(Journal(args.journal, fsync_every=0), snapshot_path=args.data)
+    service = RegistryServer(registry, args.data, args.save_every)
+    server = await service.serve(args.host, args.port)
+    serving = asyncio.ensure_future(server.serve_forever())
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        with contextlib.suppress(NotImplementedError):
+            asyncio.get_running_loop().add_signal_handler(signum, serving.cancel)
+    print(f"Serving on {args.host}:{args.port}")
+    try:
+        await serving
+    except asyncio.CancelledError:
+        pass
+    finally:
+        server.close()
+        await service.save()
+        registry.detach_journal().close()
+        print("Data saved.")
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Serve the Registry as JSON lines over TCP.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--data", default=data_file, help="snapshot to load and save")
+    parser.add_argument("--journal", default=journal_file)
+    parser.add_argument("--save-every", type=float, default=60.0, help="seconds between autosaves (0 disables)")
+    parser.add_argument("--metrics", action="store_true",
+                        help='record per-operation metrics, read with {"op": "metrics", "args": {"format": "prometheus"}}')
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(_main(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
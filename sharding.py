@@ -0,0 +1,259 @@
+"""
+Sharded on-disk layout: a directory of shard files (paths ending in ``.shards``).
+
+    scms_data.shards/
+        manifest.json         counters, the partitioning and the current file of each shard
+        shard-000-4.ndjson    students, instructors and courses of shard 0, written by save 4
+        shard-001-2.ndjson
+        ...
+
+Each shard file is in the ``streaming`` format. With the "hash" partition
+an entity lives in shard ``id % shards``, which spreads every section
+evenly. With "range" it lives in shard ``(id - 1) // range_size``, so new
+entities land in the last shard and a save after many creations rewrites
+few files.
+
+Shards are written and read by worker processes. Saving forks workers that
+serialize their shards straight from the registry's memory. When loading,
+the workers parse and validate, and send each section back packed: one list
+per field, and every entity's id list (enrollments, courses, roster) in one
+flat array with offsets. That pickles in a fraction of the time per-entity
+dicts do, and this process wraps the arrays as the entities' id sets
+instead of converting ids one by one, so it only assembles and indexes the
+entities. The registry tracks which entities changed since the layout was
+last loaded or saved, so a save rewrites only the shards that hold one of
+them. New shard files get new names and are fsynced before the manifest is
+replaced to name them, and old files are deleted only after that, so a crash
+mid-save leaves the previous save readable.
+
+Every shard is loaded, so the registry's global indexes (the email index
+and the enrollment graph) answer cross-shard lookups as before.
+"""
+import heapq
+import json
+import multiprocessing
+import os
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+import streaming
+from enrollment import CompactIdSet, EnrollmentSet, IdSet
+from lazy import LazyStore
+from utils import fsync_directory, replace_durably, trusted_data
+
+FORMAT = "scms-shards"
+VERSION = 1
+MANIFEST = "manifest.json"
+SHARD_EXTENSION = ".shards"
+PARTITIONS = ("hash", "range")
+
+# section -> (fields sent as columns, the id set field and its type) of a packed section
+_PACKED_FIELDS = {
+    "students": (("id", "name", "email", "age", "year", "student_type"), "enrollments", EnrollmentSet),
+    "instructors": (("id", "name", "email"), "courses", CompactIdSet),
+    "courses": (("id", "title", "description", "year", "instructor_id", "grades", "version"), "roster", IdSet),
+}
+
+Packed = Tuple[Dict[str, List], array, array]  # columns, flat ids, offsets into them
+
+# state a forked save worker inherits: (registry, directory, {shard: (file name, {section: ids})})
+_save_state = None
+
+
+def is_sharded_path(path: str) -> bool:
+    return path.rstrip("/\\").endswith(SHARD_EXTENSION)
+
+
+def shard_of(entity_id: int, manifest: Dict) -> int:
+    if manifest["partition"] == "hash":
+        return entity_id % manifest["shards"]
+    return (entity_id - 1) // manifest["range_size"]
+
+
+def read_manifest(directory: str) -> Optional[Dict]:
+    try:
+        with open(os.path.join(directory, MANIFEST), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return None
+    if manifest.get("format") != FORMAT:
+        raise ValueError(f"{directory} is not a {FORMAT} directory")
+    if manifest.get("version", 0) > VERSION:
+        raise ValueError(f"Unsupported {FORMAT} version {manifest['version']}")
+    return manifest
+
+
+def _write_manifest(directory: str, manifest: Dict) -> None:
+    path = os.path.join(directory, MANIFEST)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    replace_durably(path + ".tmp", path)
+
+
+def _pool(workers: int, jobs: int, fork: bool = False) -> Optional[ProcessPoolExecutor]:
+    if workers <= 1 or jobs <= 1:
+        return None
+    if fork:
+        if "fork" not in multiprocessing.get_all_start_methods():
+            return None
+        return ProcessPoolExecutor(max_workers=min(workers, jobs), mp_context=multiprocessing.get_context("fork"))
+    return ProcessPoolExecutor(max_workers=min(workers, jobs))
+
+
+def _records(store, ids: List[int]) -> Iterable:
+    if isinstance(store, LazyStore):
+        # untouched records of a lazy load are written back as they were read
+        return (store.record(entity_id, lambda entity: entity.to_dict()) for entity_id in ids)
+    return (store[entity_id].to_dict() for entity_id in ids)
+
+
+def _write_shard(shard: int) -> int:
+    registry, directory, plan = _save_state
+    file_name, members = plan[shard]
+    stores = {"students": registry._students, "instructors": registry._intructors, "courses": registry._courses}
+    sections = [(section, len(members[section]), _records(stores[section], members[section]))
+                for section in streaming.SECTIONS]
+    streaming.write_records(os.path.join(directory, file_name), {"shard": shard}, sections)
+    return shard
+
+
+def save(registry, directory: str, shards: int = 8, partition: str = "hash", range_size: int = 100000,
+         workers: Optional[int] = None) -> List[int]:
+    """
+    Save ``registry`` under ``directory`` and return the shards that were
+    rewritten. A layout that matches the registry's last load or save of
+    ``directory`` gets only its changed shards rewritten. Otherwise every
+    shard is written.
+    """
+    if partition not in PARTITIONS:
+        raise ValueError(f"Unknown partition {partition!r}; choose one of {', '.join(PARTITIONS)}")
+    if shards < 1 or range_size < 1:
+        raise ValueError("shards and range_size must be positive")
+    os.makedirs(directory, exist_ok=True)
+    old = read_manifest(directory)
+    manifest = {"format": FORMAT, "version": VERSION, "partition": partition,
+                "shards": shards if partition == "hash" else None,
+                "range_size": range_size if partition == "range" else None}
+    sections = {"students": registry._load_all("students", registry._students),
+                "instructors": registry._load_all("instructors", registry._intructors),
+                "courses": registry._load_all("courses", registry._courses)}
+    members: Dict[int, Dict[str, List[int]]] = {}
+    for section, entities in sections.items():
+        for entity_id in entities:
+            members.setdefault(shard_of(entity_id, manifest), {s: [] for s in streaming.SECTIONS})[section].append(entity_id)
+    incremental = (old is not None and registry._dirty is not None and registry._sharded_path == directory
+                   and all(old.get(key) == manifest[key] for key in ("partition", "shards", "range_size")))
+    if incremental:
+        files = {int(shard): name for shard, name in old["files"].items()}
+        changed = {shard_of(entity_id, manifest) for ids in registry._dirty.values() for entity_id in ids}
+        # a shard that lost every entity is dropped rather than written empty
+        to_write = sorted(shard for shard in changed if shard in members)
+        for shard in changed - set(members):
+            files.pop(shard, None)
+    else:
+        files = {}
+        to_write = sorted(members)
+    generation = (old or {}).get("generation", 0) + 1
+    plan = {shard: (f"shard-{shard:03d}-{generation}.ndjson", members[shard]) for shard in to_write}
+    global _save_state
+    _save_state = (registry, directory, plan)
+    try:
+        pool = _pool((os.cpu_count() or 1) if workers is None else workers, len(plan), fork=True)
+        if pool is None:
+            for shard in plan:
+                _write_shard(shard)
+        else:
+            with pool:
+                list(pool.map(_write_shard, plan))
+    finally:
+        _save_state = None
+    # every shard file was fsynced and renamed durably by write_records, so the manifest never names a torn one
+    files.update((shard, file_name) for shard, (file_name, _) in plan.items())
+    manifest.update({"generation": generation, "files": {str(shard): files[shard] for shard in sorted(files)},
+                     "next_person_id": registry._next_person_id, "next_course_id": registry._next_course_id})
+    if registry._current_journal_seq():
+        manifest["journal_seq"] = registry._current_journal_seq()
+    _write_manifest(directory, manifest)
+    # files the new manifest no longer names, including those of an interrupted save
+    keep = set(files.values()) | {MANIFEST}
+    removed = False
+    for name in os.listdir(directory):
+        if name.startswith("shard-") and name not in keep:
+            os.remove(os.path.join(directory, name))
+            removed = True
+    if removed:
+        fsync_directory(os.path.join(directory, MANIFEST))
+    return to_write
+
+
+def _read_records(path: str) -> Dict[str, List[Dict]]:
+    records: Dict[str, List[Dict]] = {section: [] for section in streaming.SECTIONS}
+    for section, record in streaming.iter_records(path):
+        if section != "header":
+            records[section].append(record)
+    return records
+
+
+def _pack(section: str, entities: List) -> Packed:
+    fields, id_field, _ = _PACKED_FIELDS[section]
+    columns = {name: [getattr(entity, name) for entity in entities] for name in fields}
+    ids, offsets = array("q"), array("q", [0])
+    for entity in entities:
+        ids.extend(getattr(entity, id_field).ids())
+        offsets.append(len(ids))
+    return columns, ids, offsets
+
+
+def _unpack(section: str, packed: Packed) -> Iterator[Dict]:
+    fields, id_field, id_set = _PACKED_FIELDS[section]
+    columns, ids, offsets = packed
+    for i, values in enumerate(zip(*(columns[name] for name in fields))):
+        record = dict(zip(fields, values))
+        record[id_field] = id_set.from_array(ids[offsets[i]:offsets[i + 1]])
+        yield record
+
+
+def _packed_shard(path: str) -> Dict[str, Packed]:
+    """A shard's sections, each entity built once to validate it, packed for the trip back."""
+    # imported here: the registry module imports this one
+    from registry import Registry
+    return {section: _pack(section, [Registry._build_entity(section, record) for record in records])
+            for section, records in _read_records(path).items()}
+
+
+def load(registry, directory: str, manifest: Dict, workers: Optional[int] = None) -> None:
+    """
+    Read every shard that ``manifest`` (see ``read_manifest``) names into
+    ``registry``, which is already reset. Workers parse and validate and
+    send packed sections (see the module docstring) rather than entities,
+    because assembling an entity here without validation is cheaper than
+    unpickling one.
+    """
+    paths = [os.path.join(directory, name) for name in manifest["files"].values()]
+    pool = _pool((os.cpu_count() or 1) if workers is None else workers, len(paths))
+    if pool is None:
+        _add_shards(registry, [_read_records(path) for path in paths])
+        return
+    with pool:
+        packed = list(pool.map(_packed_shard, paths))
+    # the workers validated every entity
+    with trusted_data():
+        _add_shards(registry, [_unpacked(shard) for shard in packed])
+
+
+def _unpacked(shard: Dict[str, Packed]) -> Dict[str, Iterator[Dict]]:
+    return {section: _unpack(section, shard[section]) for section in streaming.SECTIONS}
+
+
+def _add_shards(registry, shards: List[Dict[str, Iterable[Dict]]]) -> None:
+    for section in streaming.SECTIONS:
+        # each shard is in id order; merging keeps the whole section in id order too
+        for record in heapq.merge(*(shard[section] for shard in shards), key=lambda record: record["id"]):
+            registry._load_record(section, record)
+
+
+def dirty_tracker() -> Dict[str, Set[int]]:
+    return {section: set() for section in streaming.SECTIONS}
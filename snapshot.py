@@ -0,0 +1,146 @@
+"""
+Compact binary snapshot read through ``mmap``.
+
+Layout::
+
+    magic | fixed-width record tables ... | string heap | JSON header | u64 header length
+
+Every table is a run of ``struct`` records (see ``TABLES``); strings live in
+the heap and records refer to them by (offset, length). The JSON header at
+the end holds the counters, the table offsets and row counts, and the
+student type names that student records refer to by index.
+"""
+import json
+import mmap
+import os
+import struct
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+from utils import replace_durably
+
+MAGIC = b"SCMSSNP\x01"
+NULL = -(2 ** 63)  # stands in for None in nullable integer columns
+
+TABLES = {
+    # id, name (offset, length), email (offset, length), age, year, student type index
+    "students": struct.Struct("<qQIQIqqB"),
+    # id, name (offset, length), email (offset, length)
+    "instructors": struct.Struct("<qQIQI"),
+    # id, title (offset, length), description (offset, length), year, instructor id
+    "courses": struct.Struct("<qQIQIqq"),
+    # (student id, course id) in each student's enrollment order
+    "student_enrollments": struct.Struct("<qq"),
+    # (course id, student id) in roster order
+    "rosters": struct.Struct("<qq"),
+    # (instructor id, course id) in assignment order
+    "instructor_courses": struct.Struct("<qq"),
+    # course id, student id, grade
+    "grades": struct.Struct("<qqd"),
+    # course id, course version (absent from older snapshots)
+    "course_versions": struct.Struct("<qq"),
+}
+_FOOTER = struct.Struct("<Q")
+_CHUNK = 1 << 16
+
+
+def is_snapshot_path(file_path: str) -> bool:
+    return file_path.endswith(".snap")
+
+
+class SnapshotWriter:
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        self._tmp_path = file_path + ".tmp"
+        self._file = open(self._tmp_path, "wb")
+        self._file.write(MAGIC)
+        self._heap = bytearray()
+        self._strings: Dict[str, Tuple[int, int]] = {}
+        self._tables: Dict[str, Tuple[int, int]] = {}
+
+    def string(self, value: str) -> Tuple[int, int]:
+        ref = self._strings.get(value)
+        if ref is None:
+            data = value.encode("utf-8")
+            ref = (len(self._heap), len(data))
+            self._heap += data
+            # only short, repeated strings (course titles, types) are worth deduplicating
+            if len(data) <= 64:
+                self._strings[value] = ref
+        return ref
+
+    def table(self, name: str, rows: Iterable[Tuple]) -> None:
+        pack = TABLES[name].pack
+        start = self._file.tell()
+        count = 0
+        chunk = []
+        for row in rows:
+            chunk.append(pack(*row))
+            count += 1
+            if len(chunk) >= _CHUNK:
+                self._file.write(b"".join(chunk))
+                chunk.clear()
+        self._file.write(b"".join(chunk))
+        self._tables[name] = (start, count)
+
+    def close(self, header: Dict) -> None:
+        heap_offset = self._file.tell()
+        self._file.write(self._heap)
+        header = dict(header, tables=self._tables, heap=[heap_offset, len(self._heap)])
+        encoded = json.dumps(header).encode("utf-8")
+        self._file.write(encoded)
+        self._file.write(_FOOTER.pack(len(encoded)))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        replace_durably(self._tmp_path, self.file_path)
+
+
+class SnapshotReader:
+    def __init__(self, file_path: str):
+        self._file = open(file_path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._map)
+        if self._view[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f"{file_path} is not a snapshot file")
+        (header_len,) = _FOOTER.unpack_from(self._view, len(self._view) - _FOOTER.size)
+        header_end = len(self._view) - _FOOTER.size
+        self.header: Dict = json.loads(bytes(self._view[header_end - header_len:header_end]))
+        heap_offset, heap_len = self.header["heap"]
+        self._heap = self._view[heap_offset:heap_offset + heap_len]
+
+    def string(self, offset: int, length: int) -> str:
+        return str(self._heap[offset:offset + length], "utf-8")
+
+    def rows(self, name: str) -> Iterator[Tuple]:
+        if name not in self.header["tables"]:
+            return iter(())
+        start, count = self.header["tables"][name]
+        return TABLES[name].iter_unpack(self._view[start:start + count * TABLES[name].size])
+
+    def close(self) -> None:
+        # views into the map must be released before the map can close
+        for attr in ("_heap", "_view"):
+            view = getattr(self, attr, None)
+            if view is not None:
+                view.release()
+        try:
+            self._map.close()
+        except BufferError:
+            # a caller still holds a rows() iterator; the map closes once it is collected
+            pass
+        self._file.close()
+
+    def __enter__(self) -> "SnapshotReader":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def nullable(value: Optional[int]) -> int:
+    return NULL if value is None else value
+
+
+def from_nullable(value: int) -> Optional[int]:
+    return None if value == NULL else value
@@ -0,0 +1,309 @@
+"""
+Storage backends for the Registry.
+
+A backend persists entities record by record (in the same dict shape as the
+entities' ``to_dict``) and hands them back on demand, so a Registry with a
+backend only keeps the entities it has touched in memory.
+"""
+import sqlite3
+import sys
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+
+class StorageBackend(ABC):
+    @abstractmethod
+    def counters(self) -> Tuple[int, int]:
+        """Return ``(next_person_id, next_course_id)``."""
+
+    @abstractmethod
+    def set_counters(self, next_person_id: int, next_course_id: int) -> None:
+        pass
+
+    @abstractmethod
+    def load(self, section: str, entity_id: int) -> Optional[Dict]:
+        """One record of ``section`` ("students", "instructors", "courses") or None."""
+
+    @abstractmethod
+    def iter_records(self, section: str) -> Iterator[Dict]:
+        pass
+
+    @abstractmethod
+    def count(self, section: str) -> int:
+        pass
+
+    @abstractmethod
+    def find_student_id(self, email: str) -> Optional[int]:
+        pass
+
+    @abstractmethod
+    def student_ids_where(self, **criteria) -> List[int]:
+        """Student ids matching ``year=`` and/or ``student_type=``."""
+
+    @abstractmethod
+    def save(self, section: str, record: Dict) -> None:
+        """Insert or replace the scalar fields of a record."""
+
+    @abstractmethod
+    def add_enrollments(self, course_id: int, student_ids: Iterable[int]) -> None:
+        pass
+
+    @abstractmethod
+    def remove_enrollments(self, course_id: int, student_ids: Iterable[int]) -> None:
+        """Also drops the students' grades in the course."""
+
+    @abstractmethod
+    def set_grade(self, course_id: int, student_id: int, grade: float) -> None:
+        pass
+
+    @abstractmethod
+    def roster(self, course_id: int) -> List[int]:
+        pass
+
+    @abstractmethod
+    def grade_summary(self, course_id: int) -> Dict[str, float]:
+        pass
+
+    @abstractmethod
+    def flush(self) -> None:
+        """Make every write so far durable."""
+
+    def close(self) -> None:
+        self.flush()
+
+    @contextmanager
+    def batch(self):
+        """
+        Writes made inside the block take effect together or not at all if it
+        raises. This default gives no such guarantee; backends override it.
+        """
+        yield
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS people (
+    id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL,
+    email TEXT NOT NULL,
+    age INTEGER,
+    year INTEGER,
+    student_type TEXT
+);
+CREATE INDEX IF NOT EXISTS people_email ON people (email COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS people_year ON people (year) WHERE kind = 'student';
+CREATE INDEX IF NOT EXISTS people_type ON people (student_type) WHERE kind = 'student';
+CREATE TABLE IF NOT EXISTS courses (
+    id INTEGER PRIMARY KEY,
+    title TEXT NOT NULL,
+    description TEXT NOT NULL,
+    year INTEGER,
+    instructor_id INTEGER
+);
+CREATE INDEX IF NOT EXISTS courses_instructor ON courses (instructor_id);
+CREATE TABLE IF NOT EXISTS enrollments (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    course_id INTEGER NOT NULL,
+    student_id INTEGER NOT NULL,
+    UNIQUE (course_id, student_id)
+);
+CREATE INDEX IF NOT EXISTS enrollments_student ON enrollments (student_id);
+CREATE TABLE IF NOT EXISTS grades (
+    course_id INTEGER NOT NULL,
+    student_id INTEGER NOT NULL,
+    grade REAL NOT NULL,
+    PRIMARY KEY (course_id, student_id)
+) WITHOUT ROWID;
+"""
+
+_KIND = {"students": "student", "instructors": "instructor"}
+
+
+class SQLiteBackend(StorageBackend):
+    """
+    ``sqlite3`` backend with indexed people, courses, enrollments and grades
+    tables. Writes are grouped into one transaction that is committed every
+    ``batch_size`` writes and on ``flush``.
+    """
+
+    def __init__(self, db_path: str, batch_size: int = 1000):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self._pending = 0
+        self._in_batch = False
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+
+    def _wrote(self, count: int = 1) -> None:
+        self._pending += count
+        # a commit inside a batch would end its savepoint; the batch commits when it is done
+        if self._pending >= self.batch_size and not self._in_batch:
+            self.flush()
+
+    @contextmanager
+    def batch(self):
+        if not self._conn.in_transaction:
+            # opened here so releasing the savepoint does not commit; flush does
+            self._conn.execute("BEGIN")
+        self._conn.execute("SAVEPOINT batch")
+        self._in_batch = True
+        try:
+            yield
+        except BaseException:
+            self._conn.execute("ROLLBACK TO batch")
+            raise
+        finally:
+            self._in_batch = False
+            self._conn.execute("RELEASE batch")
+        if self._pending >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        self._conn.commit()
+        self._pending = 0
+
+    def close(self) -> None:
+        self.flush()
+        self._conn.close()
+
+    def counters(self) -> Tuple[int, int]:
+        stored = dict(self._conn.execute("SELECT key, value FROM meta"))
+        max_person = self._conn.execute("SELECT COALESCE(MAX(id), 0) FROM people").fetchone()[0]
+        max_course = self._conn.execute("SELECT COALESCE(MAX(id), 0) FROM courses").fetchone()[0]
+        return (max(stored.get("next_person_id", 1), max_person + 1),
+                max(stored.get("next_course_id", 1), max_course + 1))
+
+    def set_counters(self, next_person_id: int, next_course_id: int) -> None:
+        self._conn.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                               [("next_person_id", next_person_id), ("next_course_id", next_course_id)])
+        self._wrote()
+
+    def _student(self, row: Tuple) -> Dict:
+        student_id, name, email, age, year, student_type = row
+        enrollments = self._conn.execute(
+            "SELECT course_id FROM enrollments WHERE student_id = ? ORDER BY seq", (student_id,))
+        return {"id": student_id, "name": name, "email": email, "age": age, "year": year,
+                "enrollments": [{"course_id": course_id} for (course_id,) in enrollments],
+                "student_type": student_type}
+
+    def _instructor(self, row: Tuple) -> Dict:
+        instructor_id, name, email = row
+        courses = self._conn.execute("SELECT id FROM courses WHERE instructor_id = ? ORDER BY id", (instructor_id,))
+        return {"id": instructor_id, "name": name, "email": email, "courses": [cid for (cid,) in courses]}
+
+    def _course(self, row: Tuple) -> Dict:
+        course_id, title, description, year, instructor_id = row
+        grades = self._conn.execute("SELECT student_id, grade FROM grades WHERE course_id = ?", (course_id,))
+        return {"id": course_id, "title": title, "description": description, "year": year,
+                "instructor_id": instructor_id, "roster": self.roster(course_id), "grades": dict(grades)}
+
+    _QUERIES = {
+        "students": ("SELECT id, name, email, age, year, student_type FROM people WHERE kind = 'student'", "_student"),
+        "instructors": ("SELECT id, name, email FROM people WHERE kind = 'instructor'", "_instructor"),
+        "courses": ("SELECT id, title, description, year, instructor_id FROM courses WHERE 1", "_course"),
+    }
+
+    def load(self, section: str, entity_id: int) -> Optional[Dict]:
+        query, build = self._QUERIES[section]
+        row = self._conn.execute(query + " AND id = ?", (entity_id,)).fetchone()
+        return None if row is None else getattr(self, build)(row)
+
+    def iter_records(self, section: str) -> Iterator[Dict]:
+        query, build = self._QUERIES[section]
+        # a separate cursor so the per-record sub-queries do not reset it
+        cursor = self._conn.cursor()
+        for row in cursor.execute(query + " ORDER BY id"):
+            yield getattr(self, build)(row)
+
+    def count(self, section: str) -> int:
+        if section == "courses":
+            return self._conn.execute("SELECT COUNT(*) FROM courses").fetchone()[0]
+        return self._conn.execute("SELECT COUNT(*) FROM people WHERE kind = ?", (_KIND[section],)).fetchone()[0]
+
+    def find_student_id(self, email: str) -> Optional[int]:
+        row = self._conn.execute(
+            "SELECT id FROM people WHERE email = ? COLLATE NOCASE AND kind = 'student'", (email,)).fetchone()
+        return None if row is None else row[0]
+
+    def student_ids_where(self, **criteria) -> List[int]:
+        clauses, params = ["kind = 'student'"], []
+        for column in ("year", "student_type"):
+            if column in criteria:
+                clauses.append(f"{column} = ?" if column == "year" else f"{column} = ? COLLATE NOCASE")
+                params.append(criteria.pop(column))
+        if criteria:
+            raise ValueError(f"Cannot filter students by {', '.join(sorted(criteria))}")
+        query = f"SELECT id FROM people WHERE {' AND '.join(clauses)} ORDER BY id"
+        return [student_id for (student_id,) in self._conn.execute(query, params)]
+
+    def save(self, section: str, record: Dict) -> None:
+        if section == "courses":
+            self._conn.execute(
+                "INSERT OR REPLACE INTO courses (id, title, description, year, instructor_id) VALUES (?, ?, ?, ?, ?)",
+                (record["id"], record["title"], record["description"], record["year"], record["instructor_id"]))
+        else:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO people (id, kind, name, email, age, year, student_type) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (record["id"], _KIND[section], record["name"], record["email"],
+                 record.get("age"), record.get("year"), record.get("student_type")))
+        self._wrote()
+
+    def add_enrollments(self, course_id: int, student_ids: Iterable[int]) -> None:
+        rows = [(course_id, student_id) for student_id in student_ids]
+        self._conn.executemany("INSERT OR IGNORE INTO enrollments (course_id, student_id) VALUES (?, ?)", rows)
+        self._wrote(len(rows))
+
+    def remove_enrollments(self, course_id: int, student_ids: Iterable[int]) -> None:
+        rows = [(course_id, student_id) for student_id in student_ids]
+        self._conn.executemany("DELETE FROM enrollments WHERE course_id = ? AND student_id = ?", rows)
+        self._conn.executemany("DELETE FROM grades WHERE course_id = ? AND student_id = ?", rows)
+        self._wrote(len(rows))
+
+    def set_grade(self, course_id: int, student_id: int, grade: float) -> None:
+        self._conn.execute("INSERT OR REPLACE INTO grades (course_id, student_id, grade) VALUES (?, ?, ?)",
+                           (course_id, student_id, grade))
+        self._wrote()
+
+    def roster(self, course_id: int) -> List[int]:
+        rows = self._conn.execute("SELECT student_id FROM enrollments WHERE course_id = ? ORDER BY seq", (course_id,))
+        return [student_id for (student_id,) in rows]
+
+    def grade_summary(self, course_id: int) -> Dict[str, float]:
+        count, mean, low, high = self._conn.execute(
+            "SELECT COUNT(grade), AVG(grade), MIN(grade), MAX(grade) FROM grades WHERE course_id = ?",
+            (course_id,)).fetchone()
+        return {"count": count, "mean": mean or 0.0, "min": low, "max": high}
+
+
+def copy_to_backend(registry, backend: StorageBackend) -> None:
+    """Write every entity, enrollment and grade of an in-memory registry into ``backend``."""
+    for section, entities in (("students", registry.list_students()),
+                              ("instructors", registry.list_instructors()),
+                              ("courses", registry.list_courses())):
+        for entity in entities.values():
+            backend.save(section, entity.to_dict())
+    for course in registry.list_courses().values():
+        backend.add_enrollments(course.id, course.roster)
+        for student_id, grade in course.grades.items():
+            backend.set_grade(course.id, student_id, grade)
+    backend.set_counters(registry._next_person_id, registry._next_course_id)
+    backend.flush()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("usage: python storage.py SOURCE.json|SOURCE.ndjson DESTINATION.db")
+        sys.exit(2)
+    from registry import Registry
+
+    source = Registry()
+    source.load_from_file(sys.argv[1])
+    sqlite_backend = SQLiteBackend(sys.argv[2])
+    copy_to_backend(source, sqlite_backend)
+    sqlite_backend.close()
+    print(f"Copied {sys.argv[1]} -> {sys.argv[2]}")
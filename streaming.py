@@ -0,0 +1,126 @@
+"""
+Streaming on-disk format: newline-delimited JSON.
+
+The first line is a header with the id counters, followed by one section
+marker line per entity type and one line per record::
+
+    {"format": "scms-ndjson", "version": 1, "next_person_id": 3, "next_course_id": 2}
+    {"section": "students", "count": 1}
+    {"id": 2, "name": "john", ...}
+    {"section": "instructors", "count": 1}
+    ...
+
+Reading and writing go through generators, so memory use does not depend on
+the size of the file.
+"""
+import json
+import os
+import sys
+from typing import Dict, Iterable, Iterator, Tuple, Union
+
+from utils import replace_durably
+
+FORMAT = "scms-ndjson"
+VERSION = 1
+SECTIONS = ("students", "instructors", "courses")
+STREAM_EXTENSIONS = (".ndjson", ".jsonl")
+
+
+def is_stream_path(file_path: str) -> bool:
+    return file_path.endswith(STREAM_EXTENSIONS)
+
+
+def _dumps(record: Dict) -> str:
+    return json.dumps(record, separators=(",", ":")) + "\n"
+
+
+def iter_lines(header: Dict, sections: Iterable[Tuple[str, int, Iterable[Union[Dict, str]]]]) -> Iterator[str]:
+    """Records may also be already serialized lines, which are written as they are."""
+    yield _dumps({"format": FORMAT, "version": VERSION, **header})
+    for section, count, records in sections:
+        yield _dumps({"section": section, "count": count})
+        for record in records:
+            if isinstance(record, str):
+                yield record if record.endswith("\n") else record + "\n"
+            else:
+                yield _dumps(record)
+
+
+def write_records(file_path: str, header: Dict, sections: Iterable[Tuple[str, int, Iterable[Union[Dict, str]]]]) -> None:
+    """Write atomically: a crash mid-save leaves the previous file in place."""
+    tmp_path = file_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.writelines(iter_lines(header, sections))
+        f.flush()
+        os.fsync(f.fileno())
+    replace_durably(tmp_path, file_path)
+
+
+def read_header(f) -> Dict:
+    header = json.loads(f.readline() or "{}")
+    if header.get("format") != FORMAT:
+        raise ValueError(f"{getattr(f, 'name', 'stream')} is not a {FORMAT} file")
+    if header.get("version", 0) > VERSION:
+        raise ValueError(f"Unsupported {FORMAT} version {header['version']}")
+    return header
+
+
+def iter_records(file_path: str) -> Iterator[Tuple[str, Dict]]:
+    """Yield ``("header", header)`` followed by ``(section, record)`` pairs."""
+    for section, record, _ in iter_raw_records(file_path):
+        yield section, record
+
+
+def iter_raw_records(file_path: str) -> Iterator[Tuple[str, Dict, str]]:
+    """Like ``iter_records`` but also yields each record's original line."""
+    with open(file_path, "r", encoding="utf-8") as f:
+        yield "header", read_header(f), ""
+        section = None
+        for line_no, line in enumerate(f, start=2):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if "section" in record and "id" not in record:
+                section = record["section"]
+                if section not in SECTIONS:
+                    raise ValueError(f"{file_path}:{line_no}: unknown section {section!r}")
+                continue
+            if section is None:
+                raise ValueError(f"{file_path}:{line_no}: record before any section marker")
+            yield section, record, line
+
+
+def convert_json_to_stream(json_path: str, stream_path: str) -> None:
+    """Convert a ``scms_data.json`` style file into the streaming format."""
+    with open(json_path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    header = {
+        "next_person_id": data.get("next_person_id", 1),
+        "next_course_id": data.get("next_course_id", 1),
+    }
+    sections = [(name, len(data.get(name, [])), data.get(name, [])) for name in SECTIONS]
+    write_records(stream_path, header, sections)
+
+
+def convert_stream_to_json(stream_path: str, json_path: str) -> None:
+    data: Dict = {name: [] for name in SECTIONS}
+    for section, record in iter_records(stream_path):
+        if section == "header":
+            data["next_person_id"] = record.get("next_person_id", 1)
+            data["next_course_id"] = record.get("next_course_id", 1)
+        else:
+            data[section].append(record)
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=4)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("usage: python streaming.py SOURCE DESTINATION  (convert between .json and .ndjson)")
+        sys.exit(2)
+    source, destination = sys.argv[1:]
+    if is_stream_path(source):
+        convert_stream_to_json(source, destination)
+    else:
+        convert_json_to_stream(source, destination)
+    print(f"Converted {source} -> {destination}")
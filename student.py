@@ -1,9 +1,12 @@
+import sys
 from dataclasses import dataclass, asdict, field
-from typing import List, Dict
-from utils import validate_name, validate_email, valid_age, valid_year
+from typing import Dict
+from utils import person_errors, validation_enabled
+from enrollment import EnrollmentSet
 
 
-@dataclass
+# slots: no per-object __dict__, which matters with a million students
+@dataclass(slots=True)
 class person:
     id: int
     name: str
@@ -12,37 +15,46 @@ class person:
     year: int
     
     def __post_init__(self):
-        if not validate_name(self.name):
-            raise ValueError("Invalid name: name  must contain letters spaces and apostrophes only")
-        
-        if not validate_email(self.email):
-            raise ValueError("Invalid email address")
-        
-        if not valid_age(self.age):
-            raise ValueError("Invalid age: age must be between 10 and 30")
+        if not validation_enabled():
+            return
+        errors = person_errors(self.name, self.email, self.age)
+        if errors:
+            raise ValueError(errors[0])
                 
     def to_dict(self) -> Dict:
         return asdict(self)
     
-@dataclass
+@dataclass(slots=True)
 class Student(person):
-    enrollments: List[Dict] = field(default_factory=list)
+    enrollments: EnrollmentSet = field(default_factory=EnrollmentSet)
     student_type: str = "student"
+
+    def __post_init__(self):
+        # slots=True builds a new class, which zero-argument super() cannot see
+        person.__post_init__(self)
+        if not isinstance(self.enrollments, EnrollmentSet):
+            self.enrollments = EnrollmentSet(self.enrollments)
+        # one shared string per type instead of one per student read from a file
+        self.student_type = sys.intern(self.student_type)
     
     def enroll(self, course_id: int) -> None:
-        if course_id in self.enrollments:
+        if not self.enrollments.add(course_id):
             raise ValueError(f"Student is already enrolled in course {course_id}")
-        self.enrollments.append({"course_id": course_id})
     
     def unenroll(self, course_id: int) -> None:
-        enrollment_to_remove = None
-        for enrollment in self.enrollments:
-            if enrollment.get("course_id") == course_id:
-                enrollment_to_remove = enrollment
-                break
-        if enrollment_to_remove is None:
+        if not self.enrollments.discard(course_id):
             raise ValueError(f"Student is not enrolled in course {course_id}")
-        self.enrollments.remove(enrollment_to_remove)
+
+    def to_dict(self) -> Dict:
+        return {
+            "id": self.id,
+            "name": self.name,
+            "email": self.email,
+            "age": self.age,
+            "year": self.year,
+            "enrollments": self.enrollments.to_list(),
+            "student_type": self.student_type
+        }
     
     def __repr__(self) -> str:
         return f"<{self.__class__.__name__} student id={self.id} name={self.name} email={self.email} age={self.age} year={self.year} enrollments={self.enrollments}>"
@@ -50,10 +62,10 @@ class Student(person):
     def __eq__(self, other) -> bool:
         return isinstance(other, Student) and self.id == other.id and self.email == other.email and self.name == other.name
     
-@dataclass
+@dataclass(slots=True)
 class UndergraduateStudent(Student):
     student_type: str = "undergraduate"
     
-@dataclass
+@dataclass(slots=True)
 class GraduateStudent(Student):
     student_type: str = "graduate"    
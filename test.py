@@ -1,9 +1,36 @@
+import argparse
+import contextlib
 import unittest
+import unittest.mock
 import os
+import random
+import statistics
+import tempfile
+import threading
+import asyncio
+import json
+import csv
+import sqlite3
+import gzip
 from registry import Registry
 from student import UndergraduateStudent, GraduateStudent
 from instructor import Instructor
 from course import Course
+import course as course_module
+import columnar
+from columnar import GradeColumns
+import streaming
+import sharding
+from journal import Journal, read_journal
+from storage import SQLiteBackend, copy_to_backend
+import importer
+import export
+from server import RegistryServer
+from reports import CourseReport, ReportCache, ReportEngine
+from query import F
+from events import CourseEnrollmentCounts, Enrolled, InstructorDashboard, YearEnrollmentCounts
+import io
+import commandline
 
 class TestRegistry(unittest.TestCase):
 
@@ -74,6 +101,64 @@ class TestRegistry(unittest.TestCase):
         with self.assertRaises(ValueError):
             self.reg.unenroll_student_from_course(self.student1.id, self.course1.id)
 
+    def test_enroll_many_and_unenroll_many(self):
+        """Test bulk enrollment is all-or-nothing and keeps both sides in sync."""
+        s2 = self.reg.create_student("Mary", "mary@example.com", age=19, year=1)
+        s3 = self.reg.create_student("Paul", "paul@example.com", age=19, year=1)
+        self.reg.enroll_student_in_course(s2.id, self.course1.id)
+        with self.assertRaises(ValueError):
+            self.reg.enroll_many(self.course1.id, [self.student1.id, s2.id, s3.id])
+        self.assertEqual(self.course1.roster, [s2.id])
+
+        self.reg.enroll_many(self.course1.id, [self.student1.id, s3.id])
+        self.assertEqual(self.course1.roster, [s2.id, self.student1.id, s3.id])
+        self.assertIn(self.course1.id, s3.enrollments)
+        self.reg.set_grade(self.inst1.id, self.course1.id, s3.id, 70)
+
+        self.reg.unenroll_many(self.course1.id, [s2.id, s3.id])
+        self.assertEqual(self.course1.roster, [self.student1.id])
+        self.assertNotIn(self.course1.id, s3.enrollments)
+        self.assertNotIn(s3.id, self.course1.grades)
+        with self.assertRaises(ValueError):
+            self.reg.unenroll_many(self.course1.id, [s2.id])
+
+    def test_to_dict_shape(self):
+        """Test the JSON shape of rosters and enrollments is unchanged."""
+        self.reg.enroll_student_in_course(self.student1.id, self.course1.id)
+        self.assertEqual(self.student1.to_dict()["enrollments"], [{"course_id": self.course1.id}])
+        self.assertEqual(self.course1.to_dict()["roster"], [self.student1.id])
+        with self.assertRaises(ValueError):
+            self.student1.enroll(self.course1.id)
+        self.assertEqual(self.inst1.to_dict()["courses"], [self.course1.id])
+
+    def test_compact_entities(self):
+        """Test entities carry no __dict__ and share their student_type strings."""
+        for entity in (self.student1, self.inst1, self.course1):
+            self.assertFalse(hasattr(entity, "__dict__"))
+        other = self.reg.create_student("Ann", "ann@example.com", age=20, year=1, student_type="".join(["under", "graduate"]))
+        self.assertIs(other.student_type, self.student1.student_type)
+        self.assertEqual(self.inst1.courses, [self.course1.id])
+        with self.assertRaises(ValueError):
+            self.inst1.assign_course(self.course1.id)
+
+    def test_compact_id_lists_read_like_lists(self):
+        """Test Instructor.courses and Student.enrollments keep the list API of the fields they replaced."""
+        course2 = self.reg.create_course("Databases", "Intro to SQL", self.inst1.id, year=2)
+        courses = self.inst1.courses
+        self.assertEqual((courses[0], courses[-1], courses[:1], len(courses)), (self.course1.id, course2.id, [self.course1.id], 2))
+        self.assertEqual(courses.index(course2.id), 1)
+        courses.append(99)
+        courses.extend([99, 100])
+        self.assertEqual(courses, [self.course1.id, course2.id, 99, 100])
+        courses.remove(99)
+        self.assertEqual(list(courses), [self.course1.id, course2.id, 100])
+        with self.assertRaises(IndexError):
+            courses[3]
+        self.reg.enroll_many(course2.id, [self.student1.id])
+        self.assertEqual(self.student1.enrollments[0], {"course_id": course2.id})
+        self.assertEqual(self.student1.enrollments[:], [{"course_id": course2.id}])
+        self.assertEqual(self.course1.roster[:], [])
+
     def test_grades(self):
         """Test setting and getting grades."""
         self.reg.enroll_student_in_course(self.student1.id, self.course1.id)
@@ -83,6 +168,169 @@ class TestRegistry(unittest.TestCase):
         self.assertEqual(course.grades[self.student1.id], 95.5)
         self.assertAlmostEqual(course.get_average_grade(), 95.5)
 
+    def test_grade_statistics(self):
+        """Test running grade statistics stay exact across overwrites and removals."""
+        s2 = self.reg.create_student("Mary", "mary@example.com", age=19, year=1)
+        self.reg.enroll_many(self.course1.id, [self.student1.id, s2.id])
+        self.reg.set_grade(self.inst1.id, self.course1.id, self.student1.id, 0.1)
+        self.reg.set_grade(self.inst1.id, self.course1.id, s2.id, 0.2)
+        self.reg.set_grade(self.inst1.id, self.course1.id, s2.id, 100)
+
+        stats = self.course1.stats
+        self.assertEqual((stats.count, stats.minimum, stats.maximum), (2, 0.1, 100))
+        self.assertAlmostEqual(self.course1.get_average_grade(), 50.05)
+        self.assertAlmostEqual(stats.variance, 49.95 ** 2)
+        self.assertEqual(self.course1.grade_histogram()[-1], (90, 100, 1))
+        self.assertEqual(self.course1.grade_histogram([0, 50, 100]), [(0, 50, 1), (50, 100, 1)])
+
+        self.reg.unenroll_student_from_course(s2.id, self.course1.id)
+        self.assertEqual((stats.count, stats.minimum, stats.maximum), (1, 0.1, 0.1))
+        self.assertEqual(self.course1.get_average_grade(), 0.1)
+        self.assertEqual(stats.variance, 0.0)
+
+    def test_repeated_regrading_keeps_stats_bounded(self):
+        """Test regrading the same students over and over does not grow the min/max heaps."""
+        students = [self.student1] + [self.reg.create_student(name, f"{name.lower()}@example.com", age=19, year=1)
+                                      for name in ("Mary", "Omar")]
+        self.reg.enroll_many(self.course1.id, [s.id for s in students])
+        stats = self.course1.stats  # built now, so every regrade below updates it incrementally
+        for round_no in range(3000):
+            for offset, student in enumerate(students):
+                self.reg.set_grade(self.inst1.id, self.course1.id, student.id, (round_no + offset) % 7 * 10)
+        self.assertIs(self.course1.stats, stats)
+        self.assertLessEqual(max(len(stats._low), len(stats._high)), 2 * 3 + 8)
+        grades = list(self.course1.grades.values())
+        self.assertEqual((stats.count, stats.minimum, stats.maximum), (3, min(grades), max(grades)))
+
+    def test_non_finite_grades_are_rejected(self):
+        """Test NaN and infinite grades are refused without touching the stored grade or the stats."""
+        self.reg.enroll_student_in_course(self.student1.id, self.course1.id)
+        self.reg.set_grade(self.inst1.id, self.course1.id, self.student1.id, 80)
+        stats = self.course1.stats
+        for grade in (float("nan"), float("inf"), float("-inf")):
+            with self.assertRaises(ValueError):
+                self.reg.set_grade(self.inst1.id, self.course1.id, self.student1.id, grade)
+        self.assertEqual(self.course1.grades, {self.student1.id: 80})
+        self.assertEqual((stats.count, stats.mean, stats.minimum, stats.maximum), (1, 80, 80, 80))
+        with self.assertRaises(ValueError):
+            stats.replace(80, float("nan"))
+        self.assertEqual((stats.count, stats.mean), (1, 80))
+
+    def test_course_grade_ranking(self):
+        """Test rank, percentile, top-k and median against a sorted reference."""
+        rng = random.Random(7)
+        students = [self.reg.create_student(f"Student {chr(65 + i % 26)}", f"s{i}@example.com", age=18, year=1)
+                    for i in range(60)]
+        self.reg.enroll_many(self.course1.id, [s.id for s in students])
+        grades = {}
+        for _ in range(200):
+            sid = rng.choice(students).id
+            grades[sid] = float(rng.randint(0, 20) * 5)
+            self.reg.set_grade(self.inst1.id, self.course1.id, sid, grades[sid])
+        dropped = sid
+        self.reg.unenroll_student_from_course(dropped, self.course1.id)
+        del grades[dropped]
+
+        ordered = sorted(grades.values(), reverse=True)
+        for sid, grade in grades.items():
+            self.assertEqual(self.course1.grade_rank(sid), ordered.index(grade) + 1)
+            below = sum(1 for g in ordered if g < grade)
+            self.assertAlmostEqual(self.course1.grade_percentile(sid), 100.0 * below / len(ordered))
+        self.assertEqual([g for _, g in self.course1.top_grades(5)], ordered[:5])
+        self.assertAlmostEqual(self.course1.median_grade(), statistics.median(ordered))
+        self.assertIsNone(self.course1.grade_rank(dropped))
+
+    def test_gpa_leaderboard(self):
+        """Test the registry-wide GPA leaderboard across several courses."""
+        course2 = self.reg.create_course("Databases", "Intro to SQL", self.inst1.id, year=1)
+        s2 = self.reg.create_student("Mary", "mary@example.com", age=19, year=1)
+        for course in (self.course1, course2):
+            self.reg.enroll_many(course.id, [self.student1.id, s2.id])
+        self.reg.set_grade(self.inst1.id, self.course1.id, self.student1.id, 90)
+        self.reg.set_grade(self.inst1.id, course2.id, self.student1.id, 70)
+        self.reg.set_grade(self.inst1.id, self.course1.id, s2.id, 85)
+
+        self.assertEqual(self.reg.gpa(self.student1.id), 80.0)
+        self.assertEqual([(s.id, gpa) for s, gpa in self.reg.gpa_leaderboard()], [(s2.id, 85.0), (self.student1.id, 80.0)])
+        self.assertEqual(self.reg.gpa_rank(self.student1.id), 2)
+
+        self.reg.unenroll_student_from_course(self.student1.id, course2.id)
+        self.assertEqual(self.reg.gpa(self.student1.id), 90.0)
+        self.assertEqual(self.reg.gpa_rank(self.student1.id), 1)
+
+    def test_columnar_grade_aggregates(self):
+        """Test the columnar grade store stays in sync and matches a dict walk."""
+        course2 = self.reg.create_course("Databases", "Intro to SQL", self.inst1.id, year=2)
+        s2 = self.reg.create_student("Mary", "mary@example.com", age=19, year=1)
+        self.reg.enable_columnar_grades()
+        for course in (self.course1, course2):
+            self.reg.enroll_many(course.id, [self.student1.id, s2.id])
+        self.reg.set_grade(self.inst1.id, self.course1.id, self.student1.id, 90)
+        self.reg.set_grade(self.inst1.id, self.course1.id, s2.id, 60)
+        self.reg.set_grade(self.inst1.id, course2.id, s2.id, 40)
+        self.reg.set_grade(self.inst1.id, self.course1.id, s2.id, 80)
+        self.reg.unenroll_student_from_course(self.student1.id, self.course1.id)
+
+        by_student = self.reg.grade_aggregates("student")
+        self.assertEqual(set(by_student), {s2.id})
+        self.assertEqual(by_student[s2.id], {"count": 2, "mean": 60.0, "min": 40, "max": 80})
+        self.assertEqual(self.reg.grade_aggregates("year")[2]["mean"], 40.0)
+        self.assertEqual(self.reg.grade_aggregates("instructor")[self.inst1.id]["count"], 2)
+        with self.assertRaises(ValueError):
+            self.reg.grade_aggregates("age")
+
+    def test_columnar_groups_follow_random_changes(self):
+        """Test the per-group totals of the stdlib path match a fresh pass after random sets, overwrites and removals."""
+        rng = random.Random(7)
+        columns = GradeColumns.from_courses([])
+        grades = {}
+        for _ in range(2000):
+            cell = (rng.randrange(5), rng.randrange(20))
+            if cell in grades and rng.random() < 0.4:
+                columns.remove(*cell)
+                del grades[cell]
+            else:
+                grades[cell] = rng.choice((0.5, 40.0, 72.5, 99.0, rng.uniform(0, 100)))
+                columns.set(*cell, grades[cell])
+            if rng.random() < 0.05:
+                columns.by_student()
+                columns.by_course()
+        with unittest.mock.patch.object(columnar, "np", None):
+            by_student, by_course = columns.by_student(), columns.by_course()
+            by_parity = columns.by_course_attribute({course_id: course_id % 2 or None for course_id in range(5)})
+        for result, key_of in ((by_student, lambda cell: cell[1]), (by_course, lambda cell: cell[0]),
+                               (by_parity, lambda cell: cell[0] % 2 or None)):
+            expected = {}
+            for cell, grade in grades.items():
+                if key_of(cell) is not None:
+                    expected.setdefault(key_of(cell), []).append(grade)
+            self.assertEqual(set(result), set(expected))
+            for key, values in expected.items():
+                self.assertEqual((result[key]["count"], result[key]["min"], result[key]["max"]),
+                                 (len(values), min(values), max(values)))
+                self.assertAlmostEqual(result[key]["mean"], statistics.fmean(values))
+
+    @unittest.skipUnless(columnar.np is not None, "numpy is not installed")
+    def test_columnar_numpy_matches_stdlib(self):
+        """Test the vectorized aggregations give the stdlib results, including courses without an attribute."""
+        rng = random.Random(3)
+        columns = GradeColumns()
+        for course_id in range(8):
+            for student_id in rng.sample(range(30), 10):
+                columns.set(course_id, student_id, rng.uniform(0, 100))
+        columns.remove(0, next(s for s in range(30) if (0, s) in columns._rows))
+        years = {course_id: course_id % 3 or None for course_id in range(6)}  # courses 6 and 7 have no entry
+        queries = (columns.by_course, columns.by_student, lambda: columns.by_course_attribute(years))
+        vectorized = [query() for query in queries]
+        with unittest.mock.patch.object(columnar, "np", None):
+            pure = [query() for query in queries]
+        for fast, slow in zip(vectorized, pure):
+            self.assertEqual(set(fast), set(slow))
+            for key in slow:
+                self.assertEqual({k: v for k, v in fast[key].items() if k != "mean"},
+                                 {k: v for k, v in slow[key].items() if k != "mean"})
+                self.assertAlmostEqual(fast[key]["mean"], slow[key]["mean"])
+
     def test_grade_permissions(self):
         """Test that only the assigned instructor can set a grade."""
         other_inst = self.reg.create_instructor("Dr Impostor", "impostor@example.com")
@@ -106,9 +354,32 @@ class TestRegistry(unittest.TestCase):
         not_found_student = self.reg.find_students_by_email("noone@example.com")
         self.assertIsNone(not_found_student)
 
+    def test_duplicate_email_rejected(self):
+        """Test that a second student with the same (case-folded) email is rejected."""
+        with self.assertRaises(ValueError):
+            self.reg.create_student("Johnny", "JOHN@example.com", age=18, year=1)
+
+    def test_year_and_type_indexes(self):
+        """Test the year and student_type indexes, including after an update."""
+        grad = self.reg.create_student("Ann", "ann@example.com", age=24, year=3, student_type="graduate")
+        self.assertEqual({s.id for s in self.reg.find_students_by_year(3)}, {self.student1.id, grad.id})
+        self.assertEqual([s.id for s in self.reg.find_students_by_type("Graduate")], [grad.id])
+
+        self.reg.update_student(grad.id, year=4, email="ann.b@example.com")
+        self.assertEqual([s.id for s in self.reg.find_students_by_year(3)], [self.student1.id])
+        self.assertEqual([s.id for s in self.reg.find_students_by_year(4)], [grad.id])
+        self.assertIsNone(self.reg.find_students_by_email("ann@example.com"))
+        self.assertEqual(self.reg.find_students_by_email("ANN.B@example.com").id, grad.id)
+        with self.assertRaises(ValueError):
+            self.reg.update_student(grad.id, email="john@example.com")
+
     def test_persistence(self):
         """Test saving to and loading from a file."""
-        test_file = "test_data.json"
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        test_file = os.path.join(tmp.name, "test_data.json")
+        self.reg.enroll_student_in_course(self.student1.id, self.course1.id)
+        self.reg.set_grade(self.inst1.id, self.course1.id, self.student1.id, 88.0)
         self.reg.save_to_file(test_file)
         
         new_reg = Registry()
@@ -117,10 +388,1083 @@ class TestRegistry(unittest.TestCase):
         self.assertEqual(len(self.reg.list_students()), len(new_reg.list_students()))
         self.assertEqual(len(self.reg.list_courses()), len(new_reg.list_courses()))
         self.assertEqual(self.reg._next_person_id, new_reg._next_person_id)
+        self.assertEqual(self.reg.get_course(self.course1.id).grades, new_reg.get_course(self.course1.id).grades)
+        loaded = new_reg.find_students_by_email("JOHN@example.com")
+        self.assertIsInstance(loaded, UndergraduateStudent)
+        self.assertEqual([s.id for s in new_reg.find_students_by_type("undergraduate")], [loaded.id])
+
+
+class TestStreamingPersistence(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.reg = Registry()
+        inst = self.reg.create_instructor("Dr Test", "dr.test@example.com")
+        self.student = self.reg.create_student("john", "john@example.com", age=15, year=3, student_type="graduate")
+        self.course = self.reg.create_course("Python 101", "Intro to Python", inst.id, year=1)
+        self.reg.enroll_student_in_course(self.student.id, self.course.id)
+        self.reg.set_grade(inst.id, self.course.id, self.student.id, 77.5)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.tmp.name, name)
+
+    def assertSameRegistry(self, reg):
+        self.assertEqual(reg._next_person_id, self.reg._next_person_id)
+        self.assertEqual(reg._next_course_id, self.reg._next_course_id)
+        for name in ("list_students", "list_instructors", "list_courses"):
+            self.assertEqual([e.to_dict() for e in getattr(reg, name)().values()],
+                             [e.to_dict() for e in getattr(self.reg, name)().values()])
+
+    def test_stream_round_trip(self):
+        """Test saving and loading the newline-delimited format."""
+        self.reg.save_to_file(self.path("data.ndjson"))
+        with open(self.path("data.ndjson")) as f:
+            self.assertEqual(len(f.readlines()), 1 + 3 + 3)
+        loaded = Registry()
+        loaded.load_from_file(self.path("data.ndjson"))
+        self.assertSameRegistry(loaded)
+        self.assertEqual(loaded.get_course(self.course.id).get_average_grade(), 77.5)
+
+    def test_convert_from_json(self):
+        """Test converting the JSON layout to the streaming one and back."""
+        self.reg.save_to_file(self.path("data.json"))
+        streaming.convert_json_to_stream(self.path("data.json"), self.path("data.ndjson"))
+        streaming.convert_stream_to_json(self.path("data.ndjson"), self.path("back.json"))
+        for name in ("data.ndjson", "back.json"):
+            loaded = Registry()
+            loaded.load_from_file(self.path(name))
+            self.assertSameRegistry(loaded)
+
+    def test_binary_snapshot_round_trip(self):
+        """Test the mmap snapshot round trip and that only a trusted load skips validation."""
+        self.reg.save_to_file(self.path("data.snap"))
+        loaded = Registry()
+        loaded.load_from_file(self.path("data.snap"))
+        self.assertSameRegistry(loaded)
+        self.assertIsInstance(loaded.get_student(self.student.id), GraduateStudent)
+
+        self.student.name = "not valid 123"
+        self.reg.save_snapshot(self.path("bad.snap"))
+        Registry().load_snapshot(self.path("bad.snap"), trusted=True)
+        with self.assertRaises(ValueError):
+            Registry().load_snapshot(self.path("bad.snap"), trusted=False)
+
+    def test_lazy_load(self):
+        """Test that a lazy load builds entities on first access and saves untouched lines verbatim."""
+        other = self.reg.create_student("Jane", "jane@example.com", age=20, year=2)
+        for name in ("data.ndjson", "data.json"):
+            self.reg.save_to_file(self.path(name))
+            loaded = Registry()
+            loaded.load_from_file(self.path(name), lazy=True)
+            self.assertEqual(loaded._students.materialized_count, 0)
+            self.assertEqual(loaded.find_students_by_email("JANE@example.com").id, other.id)
+            self.assertFalse(loaded._students.is_materialized(self.student.id))
+            self.assertEqual(loaded.course_roster(self.course.id), [self.student.id])
+            self.assertSameRegistry(loaded)
+
+        loaded = Registry()
+        loaded.load_from_file(self.path("data.ndjson"), lazy=True)
+        loaded.unenroll_student_from_course(self.student.id, self.course.id)
+        loaded.save_to_file(self.path("out.ndjson"))
+        self.assertFalse(loaded._students.is_materialized(other.id))
+        reloaded = Registry()
+        reloaded.load_from_file(self.path("out.ndjson"))
+        self.assertEqual(reloaded.get_student(self.student.id).enrollments, [])
+        self.assertEqual(reloaded.get_course(self.course.id).grades, {})
+
+    def test_rejects_other_files(self):
+        """Test that a file without the header is rejected."""
+        with open(self.path("bad.ndjson"), "w") as f:
+            f.write('{"id": 1}\n')
+        with self.assertRaises(ValueError):
+            Registry().load_from_file(self.path("bad.ndjson"))
+        with open(self.path("bad.snap"), "wb") as f:
+            f.write(b"not a snapshot at all")
+        with self.assertRaises(ValueError):
+            Registry().load_from_file(self.path("bad.snap"))
+
+    def test_failed_load_leaves_registry_untouched(self):
+        """Test that a wrong-format file or a bad record mid-file leaves the loaded data, indexes and ids as they were."""
+        with open(self.path("other.ndjson"), "w") as f:
+            f.write('{"id": 1}\n')
+        self.reg.save_to_file(self.path("data.json"))
+        with open(self.path("data.json")) as f:
+            data = json.load(f)
+        data["students"].append(dict(data["students"][0], id=99, email="not an email"))
+        with open(self.path("bad.json"), "w") as f:
+            json.dump(data, f)
+        before = [e.to_dict() for e in self.reg.list_students().values()]
+        for name in ("other.ndjson", "bad.json"):
+            with self.assertRaises(ValueError):
+                self.reg.load_from_file(self.path(name))
+            self.assertEqual([e.to_dict() for e in self.reg.list_students().values()], before)
+            self.assertIs(self.reg.find_students_by_email("john@example.com"), self.student)
+            self.assertEqual(self.reg.course_roster(self.course.id), [self.student.id])
+            self.assertEqual(self.reg._next_person_id, 3)
+            self.assertEqual(self.reg.gpa(self.student.id), 77.5)
+
+
+
+class TestSharding(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.directory = os.path.join(self.tmp.name, "data.shards")
+        self.reg = Registry()
+        self.inst = self.reg.create_instructor("Dr Test", "dr.test@example.com")
+        self.students = [self.reg.create_student(f"Student {chr(65 + i)}", f"s{i}@example.com", age=20, year=1 + i % 4)
+                         for i in range(10)]
+        self.course = self.reg.create_course("Python 101", "Intro to Python", self.inst.id, year=1)
+        self.reg.enroll_many(self.course.id, [s.id for s in self.students])
+        self.reg.set_grade(self.inst.id, self.course.id, self.students[0].id, 88.0)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def assertSameRegistry(self, reg):
+        self.assertEqual((reg._next_person_id, reg._next_course_id), (self.reg._next_person_id, self.reg._next_course_id))
+        for name in ("list_students", "list_instructors", "list_courses"):
+            self.assertEqual([e.to_dict() for e in getattr(reg, name)().values()],
+                             [e.to_dict() for e in getattr(self.reg, name)().values()])
+
+    def test_round_trip_serial_and_parallel(self):
+        """Test both partitions load back the same registry, with and without worker processes."""
+        grad = self.reg.create_student("Grace", "grace@example.com", age=30, year=2, student_type="graduate")
+        self.reg.enroll_student_in_course(grad.id, self.course.id)
+        for partition, workers in (("hash", 0), ("range", 2)):
+            self.reg.save_sharded(self.directory, shards=4, partition=partition, range_size=4, workers=workers)
+            loaded = Registry()
+            loaded.load_sharded(self.directory, workers=workers)
+            self.assertSameRegistry(loaded)
+            self.assertEqual(loaded.find_students_by_email("S3@example.com").id, self.students[3].id)
+            self.assertIsInstance(loaded.get_student(grad.id), GraduateStudent)
+            self.assertEqual(loaded.course_roster(self.course.id), self.reg.course_roster(self.course.id))
+        loaded = Registry()
+        loaded.load_from_file(self.directory)
+        self.assertSameRegistry(loaded)
+
+    def test_parallel_load_validates_records(self):
+        """Test that records checked in worker processes still reject a bad shard."""
+        self.reg.save_sharded(self.directory, shards=2, workers=0)
+        for name in sharding.read_manifest(self.directory)["files"].values():
+            path = os.path.join(self.directory, name)
+            with open(path) as f:
+                text = f.read()
+            with open(path, "w") as f:
+                f.write(text.replace('"s1@example.com"', '"not an email"'))
+        with self.assertRaises(ValueError):
+            Registry().load_sharded(self.directory, workers=2)
+
+    def test_directory_without_manifest_leaves_registry_untouched(self):
+        """Test that loading a .shards directory with no manifest fails before anything is reset."""
+        os.makedirs(self.directory)
+        with self.assertRaises(ValueError):
+            self.reg.load_from_file(self.directory)
+        self.assertEqual(len(self.reg.list_students()), 10)
+        self.assertEqual(self.reg.course_roster(self.course.id), [s.id for s in self.students])
+
+    def test_only_changed_shards_are_rewritten(self):
+        """Test a save after a load rewrites just the shards holding changed entities."""
+        self.reg.save_sharded(self.directory, shards=4, workers=0)
+        reg = Registry()
+        reg.load_sharded(self.directory, workers=0)
+        self.assertEqual(reg.save_sharded(self.directory, shards=4, workers=0), [])
+        student = self.students[5]
+        reg.update_student(student.id, name="Renamed")
+        # the rename also bumps the saved version of the student's course
+        self.assertEqual(reg.save_sharded(self.directory, shards=4, workers=0),
+                         sorted({student.id % 4, self.course.id % 4}))
+        reg.set_grade(self.inst.id, self.course.id, student.id, 70.0)
+        self.assertEqual(reg.save_sharded(self.directory, shards=4, workers=0), [self.course.id % 4])
+        self.assertEqual(len([n for n in os.listdir(self.directory) if n.startswith("shard-")]), 4)
+        loaded = Registry()
+        loaded.load_sharded(self.directory)
+        self.assertEqual(loaded.get_student(student.id).name, "Renamed")
+        self.assertEqual(loaded.get_course(self.course.id).grades[student.id], 70.0)
+
+
+class TestBulkImport(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.reg = Registry()
+        self.reg.create_student("john", "john@example.com", age=15, year=3)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_import_reports_bad_rows(self):
+        """Test that bad rows are reported by line and good rows get consecutive ids."""
+        csv_path = os.path.join(self.tmp.name, "students.csv")
+        with open(csv_path, "w") as f:
+            f.write("name,email,age,year,student_type\n"
+                    "Ann,ann@example.com,20,1,graduate\n"
+                    "B0b,bob@example.com,20,1,\n"
+                    "Cy,JOHN@example.com,20,1,\n"
+                    "Dee,dee@example.com,old,1,\n"
+                    "Eve,eve@example.com,21,2,undergraduate\n"
+                    "Eve Again,EVE@example.com,21,2,\n")
+        for workers in (0, 2):
+            reg = Registry()
+            reg.create_student("john", "john@example.com", age=15, year=3)
+            report = importer.import_file(reg, csv_path, batch_size=2, workers=workers)
+            self.assertEqual(report.rows, 6)
+            self.assertEqual(report.created, [2, 3])
+            self.assertEqual([line for line, _ in report.errors], [3, 4, 5, 7])
+            self.assertIn("already exists", report.errors[1][1])
+            self.assertIsInstance(reg.get_student(2), GraduateStudent)
+            self.assertEqual(reg._next_person_id, 4)
+
+    def test_fractional_ages_are_bad_rows(self):
+        """Test ages and years that are not whole numbers are reported instead of truncated."""
+        ndjson_path = os.path.join(self.tmp.name, "students.ndjson")
+        with open(ndjson_path, "w") as f:
+            rows = ((20.7, 1), (20, 1.5), (True, 1), ("20.7", 1), (21.0, 2), (" 22 ", "3"))
+            for n, (age, year) in enumerate(rows):
+                f.write(json.dumps({"name": "Ann", "email": f"ann{n}@example.com", "age": age, "year": year}) + "\n")
+        csv_path = os.path.join(self.tmp.name, "students.csv")
+        with open(csv_path, "w") as f:
+            f.write("name,email,age,year\nAnn,ann@example.com,20.7,1\n")
+        report = importer.import_file(Registry(), ndjson_path)
+        self.assertEqual([line for line, _ in report.errors], [1, 2, 3, 4])
+        self.assertEqual({error for _, error in report.errors}, {"Age and year must be whole numbers"})
+        self.assertEqual(len(report.created), 2)
+        self.assertEqual(importer.import_file(Registry(), csv_path).errors, [(2, "Age and year must be whole numbers")])
+
+    def test_create_students_validates_without_importer(self):
+        """Test the registry call on its own still validates every record."""
+        created, errors = self.reg.create_students([
+            {"name": "Ann", "email": "ann@example.com", "age": 20, "year": 1},
+            {"name": "Ann", "email": "not an email", "age": 20, "year": 1},
+        ])
+        self.assertEqual([s.email for s in created], ["ann@example.com"])
+        self.assertEqual(errors, [(1, "Invalid email address")])
+
+
+class TestReports(unittest.TestCase):
+
+    def setUp(self):
+        self.reg = Registry()
+        inst = self.reg.create_instructor("Dr Test", "dr.test@example.com")
+        other = self.reg.create_instructor("Dr Other", "dr.other@example.com")
+        self.ann = self.reg.create_student("Ann", "ann@example.com", age=20, year=1)
+        self.bob = self.reg.create_student("Bob", "bob@example.com", age=21, year=2)
+        self.course = self.reg.create_course("Python 101", "Intro to Python", inst.id, year=1)
+        self.empty = self.reg.create_course("Empty", "Nobody here", other.id, year=1)
+        self.reg.enroll_many(self.course.id, [self.ann.id, self.bob.id])
+        self.reg.set_grade(inst.id, self.course.id, self.ann.id, 90)
+        self.inst = inst
+
+    def test_course_report_returns_lines(self):
+        """Test a report is returned, not printed, and ungraded students are marked."""
+        lines = CourseReport(self.course, self.reg.get_student).generate()
+        self.assertEqual(lines, [
+            f"Report for course name: Python 101 with id {self.course.id}",
+            f"{self.ann.id}:Ann:90.0",
+            f"{self.bob.id}:Bob:Marks not available at moment",
+            "class average: 90.00",
+        ])
+        self.assertEqual(CourseReport(self.empty, self.reg.get_student).render(),
+                         f"Report for course name: Empty with id {self.empty.id}\nNo students enrolled in Empty\n")
+
+    def test_engine_matches_course_reports(self):
+        """Test every engine path renders what CourseReport renders."""
+        expected = {c.id: CourseReport(c, self.reg.get_student).render() for c in self.reg.list_courses().values()}
+        self.assertEqual(ReportEngine(self.reg).render_all(), expected)
+        self.assertEqual(ReportEngine(self.reg, workers=2, chunk_size=1, min_parallel=0).render_all(), expected)
+        self.assertEqual(ReportEngine(self.reg).render_instructor(self.inst.id), {self.course.id: expected[self.course.id]})
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = ReportEngine(self.reg).write_all(tmp)
+            self.assertEqual(len(paths), 2)
+            with open(os.path.join(tmp, f"course_{self.course.id}.txt")) as f:
+                self.assertEqual(f.read(), expected[self.course.id])
+            self.assertEqual(ReportEngine(self.reg).write_file(os.path.join(tmp, "all.txt")), 2)
+        with self.assertRaises(ValueError):
+            ReportEngine(self.reg).render(999)
+
+    def test_course_version_tracks_report_changes(self):
+        """Test every change a report shows moves the course version."""
+        versions = [self.course.version]
+        self.reg.set_grade(self.inst.id, self.course.id, self.bob.id, 70)
+        versions.append(self.course.version)
+        self.reg.unenroll_student_from_course(self.bob.id, self.course.id)
+        versions.append(self.course.version)
+        self.reg.enroll_many(self.course.id, [self.bob.id])
+        versions.append(self.course.version)
+        self.reg.update_student(self.ann.id, name="Annie")
+        versions.append(self.course.version)
+        self.assertEqual(versions, sorted(set(versions)))
+        empty_version = self.empty.version
+        self.reg.update_student(self.ann.id, age=30)
+        self.assertEqual(self.course.version, versions[-1])
+        self.assertEqual(self.empty.version, empty_version)
+
+    def test_report_cache(self):
+        """Test unchanged courses are served from the cache and the LRU bound holds."""
+        cache = ReportCache(capacity=1)
+        engine = ReportEngine(self.reg, cache=cache)
+        first = engine.render(self.course.id)
+        self.assertEqual(engine.render(self.course.id), first)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.reg.update_student(self.ann.id, name="Annie")
+        self.assertIn(":Annie:", engine.render(self.course.id))
+        self.assertEqual((cache.hits, cache.misses, cache.evictions), (1, 2, 0))
+        engine.render(self.empty.id)
+        self.assertEqual(cache.evictions, 1)
+        self.assertEqual(cache.stats()["size"], 1)
+        self.assertEqual(engine.render_all(), ReportEngine(self.reg).render_all())
+
+class TestMetrics(unittest.TestCase):
+
+    def test_records_outermost_calls_errors_and_sizes(self):
+        """Test calls, errors and file sizes are recorded, nested calls are not, and disabling unwraps."""
+        reg = Registry()
+        recorder = reg.enable_metrics()
+        inst = reg.create_instructor("Dr Test", "dr.test@example.com")
+        course = reg.create_course("Python 101", "Intro to Python", inst.id, year=1)
+        student = reg.create_student("Ann", "ann@example.com", age=20, year=1)
+        reg.enroll_student_in_course(student.id, course.id)
+        with self.assertRaises(ValueError):
+            reg.enroll_student_in_course(999, course.id)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "data.json")
+            reg.save_to_file(path)
+            size = os.path.getsize(path)
+        snap = recorder.snapshot()
+        enroll = snap["enroll_student_in_course"]
+        self.assertEqual((enroll["calls"], enroll["errors"]), (2, 1))
+        self.assertEqual(enroll["buckets"]["+Inf"], 2)
+        # enrolling looked the student and course up, but only the outer call counts
+        self.assertEqual(snap["get_student"]["calls"], 0)
+        self.assertEqual(snap["save_to_file"]["last_bytes"], size)
+        text = recorder.to_prometheus()
+        self.assertIn('scms_registry_errors_total{method="enroll_student_in_course"} 1', text)
+        self.assertIn('scms_registry_latency_seconds_bucket{method="save_to_file",le="+Inf"} 1', text)
+        self.assertEqual(json.loads(recorder.to_json())["create_course"]["calls"], 1)
+        self.assertIs(reg.disable_metrics(), recorder)
+        self.assertNotIn("get_student", vars(reg))
+
+class TestSearch(unittest.TestCase):
+
+    def setUp(self):
+        self.reg = Registry()
+        inst = self.reg.create_instructor("Dr Test", "dr.test@example.com")
+        self.ann = self.reg.create_student("Ann Lee", "ann.lee@example.com", age=20, year=1)
+        self.anna = self.reg.create_student("Anna Smith", "anna@example.com", age=21, year=2)
+        self.bob = self.reg.create_student("Bob Lee", "bob@example.com", age=22, year=3)
+        self.course = self.reg.create_course("Python Programming", "Intro to Python", inst.id, year=1)
+
+    def ids(self, query, **kwargs):
+        return [entity.id for entity, _ in self.reg.search(query, **kwargs)]
+
+    def test_prefix_and_query_and_ranking(self):
+        """Test exact matches rank above completions, every word must match, and pages slice the ranking."""
+        self.assertEqual(self.ids("ann"), [self.ann.id, self.anna.id])
+        self.assertEqual(self.ids("ann", prefix=False), [self.ann.id])
+        self.assertEqual(self.ids("lee"), [self.ann.id, self.bob.id])
+        self.assertEqual(self.ids("lee an"), [self.ann.id])
+        self.assertEqual(self.ids("lee", limit=1, offset=1), [self.bob.id])
+        self.assertEqual(self.ids("pyth", kind="courses"), [self.course.id])
+        with self.assertRaises(ValueError):
+            self.reg.search("ann", kind="grades")
+
+    def test_typos_and_updates(self):
+        """Test a misspelt word falls back to one-edit matches and renames and new entities are indexed."""
+        self.assertEqual(self.ids("smtih"), [self.anna.id])
+        self.reg.update_student(self.bob.id, name="Bob Stone")
+        self.assertEqual(self.ids("lee"), [self.ann.id])
+        self.assertEqual(self.ids("stone"), [self.bob.id])
+        carl = self.reg.create_student("Carl Lee", "carl@example.com", age=19, year=1)
+        self.assertEqual(self.ids("lee"), [self.ann.id, carl.id])
+
+class TestQuery(unittest.TestCase):
+
+    def setUp(self):
+        self.reg = Registry()
+        self.inst = self.reg.create_instructor("Dr Test", "dr.test@example.com")
+        self.courses = [self.reg.create_course(f"Course {c}", "Synthetic", self.inst.id, year=1).id for c in "AB"]
+        rng = random.Random(7)
+        self.students = []
+        for i in range(40):
+            student = self.reg.create_student(f"Student {chr(65 + i % 26)}", f"s{i}@example.com", age=20,
+                                              year=1 + i % 4, student_type=("undergraduate", "graduate")[i % 2])
+            self.students.append(student)
+            if i % 3:
+                self.reg.enroll_student_in_course(student.id, self.courses[0])
+                self.reg.set_grade(self.inst.id, self.courses[0], student.id, rng.randint(0, 20) * 5)
+
+    def test_planner_picks_the_most_selective_index(self):
+        """Test the smallest index answers the query, the rest is filtered, and unusable conditions scan."""
+        where = (F("student_type") == "graduate") & (F("year") == 2) & F("courses").contains(self.courses[0])
+        page = self.reg.query("students", where)
+        self.assertEqual(page.plan.access, "index year")
+        expected = [s.id for s in self.students if s.year == 2 and s.student_type == "graduate"
+                    and self.courses[0] in s.enrollments]
+        self.assertEqual([s.id for s in page.rows], expected)
+        self.assertEqual(page.plan.examined, 10)
+        self.assertEqual(self.reg.explain("students", {"email": "S3@EXAMPLE.COM"}).access, "index email")
+        self.assertEqual(self.reg.explain("students", (F("year") == 2) | (F("year") == 3)).access, "scan")
+        self.assertEqual(self.reg.explain("courses", [["students", "contains", 2]]).access, "index students")
+        with self.assertRaises(ValueError):
+            self.reg.query("students", F("grade") > 50)
+
+    def test_cursor_pages_cover_every_row_once_in_order(self):
+        """Test following next_cursor returns every match once, sorted, including ties and new rows."""
+        where = (F("course_id") == self.courses[0]) & (F("year") <= 3)
+        expected = sorted((row for row in self.reg.query("grades", where, limit=1000).rows),
+                          key=lambda row: (-row.grade, row.student_id))
+        seen, cursor = [], None
+        while True:
+            page = self.reg.query("grades", where, order_by="-grade", limit=7, cursor=cursor)
+            self.assertEqual(page.plan.access, "index course_id")
+            seen.extend(page.rows)
+            cursor = page.next_cursor
+            if cursor is None:
+                break
+        self.assertEqual([(r.student_id, r.grade) for r in seen], [(r.student_id, r.grade) for r in expected])
+        with self.assertRaises(ValueError):
+            self.reg.query("grades", where, order_by="grade", cursor=self.reg.query("grades", where, order_by="-grade",
+                                                                                       limit=1).next_cursor)
+
+class TestTransactions(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.journal_path = os.path.join(self.tmp.name, "data.journal")
+        self.reg = Registry()
+        self.reg.attach_journal(Journal(self.journal_path, fsync_every=0), os.path.join(self.tmp.name, "data.json"))
+        self.inst = self.reg.create_instructor("Dr Test", "dr.test@example.com")
+        self.course = self.reg.create_course("Python 101", "Intro", self.inst.id, year=1)
+        self.ann = self.reg.create_student("Ann", "ann@example.com", age=20, year=1)
+        self.reg.enroll_student_in_course(self.ann.id, self.course.id)
+        self.reg.set_grade(self.inst.id, self.course.id, self.ann.id, 80)
+
+    def tearDown(self):
+        self.reg.detach_journal().close()
+        self.tmp.cleanup()
+
+    def test_rollback_undoes_every_change(self):
+        """Test a failing block leaves rosters, grades, indexes, ids and the journal as they were."""
+        before = (self.reg.course_roster(self.course.id), dict(self.course.grades), self.course.get_average_grade(),
+                  self.reg.gpa(self.ann.id), self.reg._next_person_id)
+        seq = self.reg._journal.seq
+        with self.assertRaises(ValueError):
+            with self.reg.transaction():
+                bob = self.reg.create_student("Bob", "bob@example.com", age=21, year=2)
+                self.reg.enroll_many(self.course.id, [bob.id])
+                self.reg.set_grade(self.inst.id, self.course.id, bob.id, 40)
+                self.reg.set_grade(self.inst.id, self.course.id, self.ann.id, 95)
+                self.reg.update_student(self.ann.id, name="Anne", email="anne@example.com")
+                self.reg.unenroll_student_from_course(self.ann.id, self.course.id)
+                self.reg.enroll_student_in_course(999, self.course.id)
+        after = (self.reg.course_roster(self.course.id), dict(self.course.grades), self.course.get_average_grade(),
+                 self.reg.gpa(self.ann.id), self.reg._next_person_id)
+        self.assertEqual(after, before)
+        self.assertIsNone(self.reg.find_students_by_email("bob@example.com"))
+        self.assertIs(self.reg.find_students_by_email("ann@example.com"), self.ann)
+        self.assertEqual(self.ann.name, "Ann")
+        self.assertEqual(self.reg._journal.seq, seq)
+
+    def test_commit_is_one_journal_entry_and_savepoints_roll_back_alone(self):
+        """Test a committed block is one replayable journal line and a failed nested block undoes only itself."""
+        with self.reg.transaction():
+            bob = self.reg.create_student("Bob", "bob@example.com", age=21, year=2)
+            self.reg.enroll_student_in_course(bob.id, self.course.id)
+            with self.assertRaises(ValueError):
+                with self.reg.transaction():
+                    self.reg.set_grade(self.inst.id, self.course.id, bob.id, 70)
+                    self.reg.set_grade(self.inst.id, self.course.id, bob.id, 170)
+            self.assertNotIn(bob.id, self.course.grades)
+            self.reg.set_grade(self.inst.id, self.course.id, bob.id, 60)
+        entries = list(read_journal(self.journal_path))
+        self.assertEqual(entries[-1]["op"], "transaction")
+        self.assertEqual([op["op"] for op in entries[-1]["ops"]],
+                         ["create_student", "enroll_student_in_course", "set_grade"])
+        recovered = Registry()
+        self.assertEqual(recovered.recover(os.path.join(self.tmp.name, "missing.json"), self.journal_path), 8)
+        self.assertEqual(recovered.get_course(self.course.id).grades, {self.ann.id: 80, bob.id: 60})
+
+class TestEvents(unittest.TestCase):
+
+    def setUp(self):
+        self.reg = Registry()
+        self.inst = self.reg.create_instructor("Dr Test", "dr.test@example.com")
+        self.course = self.reg.create_course("Python 101", "Intro", self.inst.id, year=1)
+        self.ann = self.reg.create_student("Ann", "ann@example.com", age=20, year=1)
+        self.reg.enroll_student_in_course(self.ann.id, self.course.id)
+        self.reg.set_grade(self.inst.id, self.course.id, self.ann.id, 80)
+
+    def test_views_follow_changes_without_recompute(self):
+        """Test views start from the current state and then track creates, enrollments, grades and rollbacks."""
+        per_course = self.reg.add_view(CourseEnrollmentCounts())
+        per_year = self.reg.add_view(YearEnrollmentCounts())
+        dashboard = self.reg.add_view(InstructorDashboard())
+        later = self.reg.create_course("Databases", "Intro to SQL", self.inst.id, year=2)
+        bob = self.reg.create_student("Bob", "bob@example.com", age=21, year=2)
+        self.reg.enroll_many(later.id, [self.ann.id, bob.id])
+        self.reg.set_grade(self.inst.id, later.id, bob.id, 60)
+        with self.assertRaises(ValueError):
+            with self.reg.transaction():
+                self.reg.unenroll_student_from_course(bob.id, later.id)
+                self.reg.enroll_student_in_course(999, later.id)
+        self.reg.unenroll_student_from_course(self.ann.id, self.course.id)
+        self.assertEqual(per_course.counts, {self.course.id: 0, later.id: 2})
+        self.assertEqual(per_year.counts, {1: 0, 2: 2})
+        self.assertEqual(dashboard.summary(self.inst.id), {"courses": 2, "enrollments": 2, "grades": 1, "mean": 60})
+        fresh = CourseEnrollmentCounts()
+        fresh.rebuild(self.reg)
+        self.assertEqual(fresh.counts, per_course.counts)
+        self.assertEqual(per_course.seq, self.reg._events.seq)
+
+    def test_dashboard_mean_matches_course_average(self):
+        """Test the dashboard mean stays exactly the course average through fractional grades and regrades."""
+        dashboard = self.reg.add_view(InstructorDashboard())
+        students = [self.reg.create_student(name, f"{name.lower()}@example.com", age=20, year=1)
+                    for name in ("Bob", "Cid", "Dee", "Eve")]
+        self.reg.enroll_many(self.course.id, [s.id for s in students])
+        rng = random.Random(3)
+        for _ in range(200):
+            student = rng.choice(students)
+            self.reg.set_grade(self.inst.id, self.course.id, student.id, rng.choice((0.1, 0.2, 0.3, 33.3, 66.7, 99.9)))
+            self.assertEqual(dashboard.summary(self.inst.id)["mean"], self.course.get_average_grade())
+        self.reg.unenroll_student_from_course(students[0].id, self.course.id)
+        self.assertEqual(dashboard.summary(self.inst.id)["mean"], self.course.get_average_grade())
+
+    def test_subscriptions_are_numbered_batched_and_bounded(self):
+        """Test callbacks get batches, polled queues drop their oldest events and late subscribers catch up."""
+        stream = self.reg.enable_events(buffer_size=3)
+        batches = []
+        stream.subscribe(batches.append, batch_size=2)
+        polled = stream.subscribe(max_pending=2)
+        students = [self.reg.create_student(f"Student {name}", f"{name}@example.com", age=20, year=1)
+                    for name in ("b", "c", "d")]
+        self.reg.enroll_many(self.course.id, [s.id for s in students])
+        self.assertEqual([[e.seq for e in batch] for batch in batches], [[1], [2], [3], [4, 5], [6]])
+        self.assertEqual([e.student_id for e in polled.poll()], [students[1].id, students[2].id])
+        self.assertEqual(polled.dropped, 4)
+        late = stream.subscribe(since=4)
+        self.assertEqual([(type(e), e.seq) for e in late.poll()], [(Enrolled, 5), (Enrolled, 6)])
+        with self.assertRaises(ValueError):
+            stream.subscribe(since=1)
+
+class TestExport(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.reg = Registry()
+        self.inst = self.reg.create_instructor("Dr Test", "dr.test@example.com")
+        self.python = self.reg.create_course('Python, "101"', "Intro to Python", self.inst.id, year=1)
+        self.sql = self.reg.create_course("Databases", "Intro to SQL", self.inst.id, year=2)
+        self.ann = self.reg.create_student("Ann", "ann@example.com", age=20, year=1)
+        self.bob = self.reg.create_student("Bob", "bob@example.com", age=21, year=2, student_type="graduate")
+        self.reg.enroll_many(self.python.id, [self.ann.id, self.bob.id])
+        self.reg.enroll_student_in_course(self.ann.id, self.sql.id)
+        self.reg.set_grade(self.inst.id, self.python.id, self.ann.id, 88.5)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_formats_hold_the_same_rows(self):
+        """Test CSV and gzip NDJSON exports hold one denormalized row per enrollment."""
+        csv_path = os.path.join(self.tmp.name, "grades.csv")
+        ndjson_path = os.path.join(self.tmp.name, "grades.ndjson.gz")
+        self.assertEqual(export.export(self.reg, csv_path, chunk_rows=2).rows, 3)
+        export.export(self.reg, ndjson_path, chunk_rows=2)
+        with open(csv_path, newline="") as f:
+            from_csv = list(csv.DictReader(f))
+        with gzip.open(ndjson_path, "rt") as f:
+            from_ndjson = [json.loads(line) for line in f]
+        self.assertEqual(from_ndjson[0], {"student_id": self.ann.id, "student_name": "Ann", "student_type": "student",
+                                          "course_id": self.python.id, "course_title": 'Python, "101"', "course_year": 1,
+                                          "instructor_id": self.inst.id, "instructor_name": "Dr Test", "grade": 88.5})
+        self.assertEqual([row["grade"] for row in from_ndjson], [88.5, None, None])
+        self.assertEqual([{k: str(v if v is not None else "") for k, v in row.items()} for row in from_ndjson], from_csv)
+
+    def test_incremental_export_since_watermark(self):
+        """Test only courses changed after the watermark are exported, in full, and a foreign watermark exports all."""
+        path = os.path.join(self.tmp.name, "grades.csv.gz")
+        first = export.export(self.reg, path)
+        self.assertTrue(first.full)
+        nothing = export.export(self.reg, path, since=first.watermark)
+        self.assertEqual((nothing.rows, nothing.courses, nothing.full), (0, [], False))
+        self.reg.unenroll_student_from_course(self.bob.id, self.python.id)
+        changed = export.export(self.reg, path, since=nothing.watermark)
+        self.assertEqual((changed.rows, changed.courses), (1, [self.python.id]))
+        with gzip.open(path, "rt", newline="") as f:
+            self.assertEqual([row["student_id"] for row in csv.DictReader(f)], [str(self.ann.id)])
+        self.assertTrue(export.export(self.reg, path, since="another-process:5").full)
+        with self.assertRaises(ValueError):
+            export.export(self.reg, path, since="not a watermark")
+
+    def test_watermark_survives_reload(self):
+        """Test a watermark still selects only the changed courses after the data is saved and loaded again."""
+        data_path = os.path.join(self.tmp.name, "data.json")
+        path = os.path.join(self.tmp.name, "grades.csv")
+        first = export.export(self.reg, path)
+        self.reg.set_grade(self.inst.id, self.sql.id, self.ann.id, 70)
+        self.reg.save_to_file(data_path)
+        for data_file in (data_path, os.path.join(self.tmp.name, "data.snap")):
+            if data_file != data_path:
+                self.reg.save_to_file(data_file)
+            with contextlib.redirect_stdout(io.StringIO()):
+                reloaded = Registry()
+                reloaded.load_from_file(data_file)
+            with self.subTest(data_file=data_file):
+                changed = export.export(reloaded, path, since=first.watermark)
+                self.assertEqual((changed.courses, changed.full), ([self.sql.id], False))
+        args = argparse.Namespace(path=path, chunk_rows=10, since=first.watermark)
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            commandline.export_rows(reloaded, args)
+        self.assertIn("Exported 1 changed rows of 1 courses", out.getvalue())
+        self.assertRegex(out.getvalue(), r"Watermark: \d+")
+
+    def test_versions_after_restart_stay_above_saved_watermark(self):
+        """Test a fresh process draws versions above the loaded ones, and a watermark ahead of the data exports all."""
+        data_path = os.path.join(self.tmp.name, "data.json")
+        path = os.path.join(self.tmp.name, "grades.csv")
+        self.reg.save_to_file(data_path)
+        first = export.export(self.reg, path)
+        for lazy in (False, True):
+            # a new process starts counting versions from scratch
+            with self.subTest(lazy=lazy), unittest.mock.patch.object(course_module, "_last_version", 0):
+                with contextlib.redirect_stdout(io.StringIO()):
+                    reloaded = Registry()
+                    reloaded.load_from_file(data_path, lazy=lazy)
+                reloaded.set_grade(self.inst.id, self.sql.id, self.ann.id, 70)
+                changed = export.export(reloaded, path, since=first.watermark)
+                self.assertEqual((changed.courses, changed.full), ([self.sql.id], False))
+                ahead = str(int(first.watermark) + 100)
+                self.assertTrue(export.export(reloaded, path, since=ahead).full)
+                reloaded.set_grade(self.inst.id, self.python.id, self.ann.id, 60)
+                self.assertEqual(export.export(reloaded, path, since=ahead).courses, [self.python.id])
+        backed = Registry(backend=SQLiteBackend(os.path.join(self.tmp.name, "data.db")))
+        self.assertEqual(export.export(backed, path).watermark, "")
+        with self.assertRaises(ValueError):
+            export.export(backed, path, since=first.watermark)
+        backed._backend.close()
+
+    def test_failed_export_removes_partial_file(self):
+        """Test an export that fails midway keeps the previous file and leaves no temporary file."""
+        path = os.path.join(self.tmp.name, "grades.csv")
+        export.export(self.reg, path)
+        with open(path) as f:
+            previous = f.read()
+        with unittest.mock.patch.object(export, "iter_rows", side_effect=OSError("disk full")):
+            with self.assertRaises(OSError):
+                export.export(self.reg, path)
+        with open(path) as f:
+            self.assertEqual(f.read(), previous)
+        self.assertFalse(os.path.exists(path + ".tmp"))
+
+class TestBatchCommands(unittest.TestCase):
+
+    def test_commands_report_per_line_and_autosave(self):
+        """Test batch commands run in order, failures do not stop the batch, and autosave snapshots."""
+        with tempfile.TemporaryDirectory() as tmp:
+            reg = Registry()
+            snapshot_path = os.path.join(tmp, "data.json")
+            reg.attach_journal(Journal(os.path.join(tmp, "data.journal"), fsync_every=0), snapshot_path=snapshot_path)
+            commands = [
+                {"op": "register_instructor", "args": {"name": "Dr Test", "email": "dr.test@example.com"}},
+                {"op": "create_course", "args": {"title": "Python 101", "description": "Intro", "instructor_id": 1}},
+                {"id": "ann", "op": "register", "args": {"name": "Ann", "email": "ann@example.com", "age": 20, "year": 1}},
+                {"op": "enroll", "args": {"student_id": 2, "course_id": 1}},
+                {"op": "enroll", "args": {"student_id": 99, "course_id": 1}},
+                {"op": "grade", "args": {"instructor_id": 1, "course_id": 1, "student_id": 2, "grade": 88}},
+                {"op": "report", "args": {"course_id": 1}},
+            ]
+            lines = [json.dumps(c) for c in commands] + ["", "not json"]
+            out = io.StringIO()
+            self.assertEqual(commandline.run_commands(reg, lines, out, autosave_every=4), (8, 2))
+            results = [json.loads(line) for line in out.getvalue().splitlines()]
+            self.assertEqual([r["id"] for r in results], [1, 2, "ann", 4, 5, 6, 7, 9])
+            self.assertEqual([r["ok"] for r in results], [True, True, True, True, False, True, True, False])
+            self.assertIn("2:Ann:88.0", results[6]["result"])
+            # the autosave after four commands holds the first enrollment
+            with open(snapshot_path) as f:
+                self.assertEqual(json.load(f)["courses"][0]["roster"], [2])
+            reg.detach_journal().close()
+
+    def test_mistyped_command_mid_batch(self):
+        """Test a command with wrongly typed arguments fails alone and the rest of the batch still runs."""
+        reg = Registry()
+        commands = [
+            {"op": "register", "args": {"name": "Ann", "email": "ann@example.com", "age": 20, "year": 1}},
+            {"op": "register", "args": {"name": "Bob", "email": "bob@example.com", "age": 20, "year": 1,
+                                        "student_type": None}},
+            {"op": "report", "args": ["course_id", 1]},
+            {"op": "register", "args": {"name": "Cid", "email": "cid@example.com", "age": 20, "year": 1}},
+        ]
+        out = io.StringIO()
+        self.assertEqual(commandline.run_commands(reg, [json.dumps(c) for c in commands], out), (4, 2))
+        self.assertEqual([json.loads(line)["ok"] for line in out.getvalue().splitlines()], [True, False, False, True])
+        self.assertEqual(len(reg.list_students()), 2)
+        # too deeply nested for the parser: RecursionError, not ValueError, before any request exists
+        out = io.StringIO()
+        lines = [json.dumps(commands[0]), "[" * 100000 + "]" * 100000]
+        self.assertEqual(commandline.run_commands(Registry(), lines, out), (2, 1))
+        self.assertEqual([json.loads(line)["id"] for line in out.getvalue().splitlines()], [1, 2])
+
+class TestThreadSafety(unittest.TestCase):
+
+    def run_threads(self, target, count):
+        threads = [threading.Thread(target=target, args=(n,)) for n in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def consistency_errors(self, reg):
+        errors = []
+        for course in reg.list_courses().values():
+            errors += [(course.id, sid) for sid in course.roster if course.id not in reg.get_student(sid).enrollments]
+            errors += [(course.id, sid) for sid in course.grades if sid not in course.roster]
+        for student in reg.list_students().values():
+            errors += [(cid, student.id) for cid in student.enrollments.ids() if student.id not in reg.get_course(cid).roster]
+        return errors
+
+    def test_concurrent_creates_get_unique_ids(self):
+        """Test that ids stay unique and dense when many threads create students."""
+        reg = Registry(thread_safe=True)
+
+        def create(n):
+            for i in range(50):
+                reg.create_student("Student", f"t{n}x{i}@example.com", age=20, year=1)
+
+        self.run_threads(create, 8)
+        self.assertEqual(sorted(reg.list_students()), list(range(1, 401)))
+        self.assertEqual(reg._next_person_id, 401)
+
+    def test_stress_enrollment_and_grading(self):
+        """Test that rosters, enrollments and GPAs agree after concurrent enrolling and grading."""
+        reg = Registry(thread_safe=True)
+        inst = reg.create_instructor("Dr Test", "dr.test@example.com")
+        courses = [reg.create_course(f"Course {i}", "Stress", inst.id, year=1).id for i in range(4)]
+        students = [reg.create_student("Student", f"s{i}@example.com", age=20, year=1).id for i in range(30)]
+        snapshots = []
+
+        def work(n):
+            rng = random.Random(n)
+            for step in range(400):
+                sid, cid = rng.choice(students), rng.choice(courses)
+                try:
+                    op = rng.random()
+                    if op < 0.4:
+                        reg.enroll_student_in_course(sid, cid)
+                    elif op < 0.7:
+                        reg.unenroll_student_from_course(sid, cid)
+                    elif op < 0.9:
+                        reg.set_grade(inst.id, cid, sid, rng.randint(0, 100))
+                    else:
+                        reg.gpa_leaderboard(3)
+                except ValueError:
+                    pass
+                if n == 0 and step % 100 == 0:
+                    with reg._lock.write():
+                        snapshots.append(self.consistency_errors(reg))
+
+        self.run_threads(work, 8)
+        self.assertEqual(snapshots, [[]] * len(snapshots))
+        self.assertEqual(self.consistency_errors(reg), [])
+        for sid in students:
+            grades = [c.grades[sid] for c in reg.list_courses().values() if sid in c.grades]
+            expected = sum(grades) / len(grades) if grades else None
+            self.assertAlmostEqual(reg.gpa(sid), expected)
+
+    def test_open_transaction_is_invisible_to_other_threads(self):
+        """Test that another thread's lookups wait for a transaction and never see its rolled back changes."""
+        reg = Registry(thread_safe=True)
+        inst = reg.create_instructor("Dr Test", "dr.test@example.com")
+        course = reg.create_course("Python 101", "Intro", inst.id, year=1)
+        seen = []
+
+        def look(student_id):
+            seen.append((reg.get_student(student_id), reg.get_course(course.id).roster.to_list()))
+
+        with self.assertRaises(ValueError):
+            with reg.transaction():
+                bob = reg.create_student("Bob", "bob@example.com", age=21, year=2)
+                reg.enroll_student_in_course(bob.id, course.id)
+                reader = threading.Thread(target=look, args=(bob.id,))
+                reader.start()
+                reader.join(0.2)
+                self.assertTrue(reader.is_alive())
+                raise ValueError("abort")
+        reader.join()
+        self.assertEqual(seen, [(None, [])])
+
+
+class TestServer(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.reg = Registry()
+        self.service = RegistryServer(self.reg, os.path.join(self.tmp.name, "data.json"))
+        self.server = await self.service.serve("127.0.0.1", 0)
+        port = self.server.sockets[0].getsockname()[1]
+        self.reader, self.writer = await asyncio.open_connection("127.0.0.1", port)
+
+    async def asyncTearDown(self):
+        self.writer.close()
+        self.server.close()
+        await self.server.wait_closed()
+        self.tmp.cleanup()
+
+    async def call(self, *requests):
+        self.writer.write(b"".join(json.dumps(r).encode() + b"\n" if isinstance(r, dict) else r for r in requests))
+        await self.writer.drain()
+        return [json.loads(await self.reader.readline()) for _ in requests]
+
+    async def test_pipelined_requests(self):
+        """Test that a pipelined batch is answered in order, with errors per request."""
+        responses = await self.call(
+            {"id": 1, "op": "create_instructor", "args": {"name": "Dr Test", "email": "dr.test@example.com"}},
+            {"id": 2, "op": "create_student", "args": {"name": "john", "email": "john@example.com", "age": 15, "year": 3}},
+            {"id": 3, "op": "create_course", "args": {"title": "Python 101", "description": "Intro", "instructor_id": 1}},
+            {"id": 4, "op": "enroll_student_in_course", "args": {"student_id": 2, "course_id": 1}},
+            {"id": 5, "op": "enroll_student_in_course", "args": {"student_id": 2, "course_id": 1}},
+            {"id": 6, "op": "course_roster", "args": {"course_id": 1}},
+            {"id": 7, "op": "_reset", "args": {}},
+            b"not json\n",
+            {"id": 8, "op": "save"},
+        )
+        self.assertEqual([r["id"] for r in responses], [1, 2, 3, 4, 5, 6, 7, None, 8])
+        self.assertEqual([r["ok"] for r in responses], [True, True, True, True, False, True, False, False, True])
+        self.assertEqual(responses[1]["result"]["id"], 2)
+        self.assertEqual(responses[5]["result"], [2])
+        loaded = Registry()
+        loaded.load_from_file(self.service.data_path)
+        self.assertEqual(loaded.course_roster(1), [2])
+
+    async def test_null_and_mistyped_arguments_are_request_errors(self):
+        """Test that arguments of the wrong type fail their own request and leave the connection serving."""
+        student = {"name": "Ann", "email": "ann@example.com", "age": 20, "year": 1}
+        responses = await self.call(
+            {"id": 1, "op": "create_student", "args": dict(student, student_type=None)},
+            {"id": 2, "op": "create_student", "args": dict(student, email=None)},
+            {"id": 3, "op": "search", "args": {"query": None}},
+            {"id": 4, "op": "find_students_by_email", "args": {"email": 5}},
+            {"id": 5, "op": ["not", "a", "name"]},
+            {"id": 6, "op": "create_student", "args": student},
+        )
+        self.assertEqual([r["ok"] for r in responses], [False, False, False, False, False, True])
+        self.assertEqual(len(self.reg.list_students()), 1)
+
+    async def test_reads_wait_for_a_running_save(self):
+        """Test that a read arriving during a save is answered only after the save, as the registry is not thread safe."""
+        release = threading.Event()
+        saving = threading.Event()
+
+        def slow_save(path):
+            saving.set()
+            release.wait(5)
+
+        with unittest.mock.patch.object(self.reg, "save_to_file", side_effect=slow_save):
+            save = asyncio.ensure_future(self.service.save())
+            await asyncio.get_running_loop().run_in_executor(None, saving.wait, 5)
+            self.writer.write(b'{"id": 1, "op": "list_students"}\n')
+            answer = asyncio.ensure_future(self.reader.readline())
+            done, _ = await asyncio.wait({answer}, timeout=0.2)
+            self.assertFalse(done)
+            release.set()
+            await save
+            self.assertEqual(json.loads(await answer)["id"], 1)
+
+    async def test_overlong_request_line_closes_the_connection(self):
+        """Test that a client sending a line longer than max_line gets an error and is disconnected."""
+        self.service.max_line = 100
+        self.writer.write(b'{"id": 1, "op": "list_students"}\n' + b"x" * 300)
+        responses = [json.loads(await asyncio.wait_for(self.reader.readline(), 5)) for _ in range(2)]
+        self.assertEqual([(r["id"], r["ok"]) for r in responses], [(1, True), (None, False)])
+        self.assertIn("longer than 100 bytes", responses[1]["error"])
+        self.assertEqual(await asyncio.wait_for(self.reader.read(), 5), b"")
+
+
+class TestJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.snapshot = os.path.join(self.tmp.name, "data.ndjson")
+        self.journal_path = os.path.join(self.tmp.name, "data.journal")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def populate(self, reg):
+        inst = reg.create_instructor("Dr Test", "dr.test@example.com")
+        student = reg.create_student("john", "john@example.com", age=15, year=3, student_type="graduate")
+        other = reg.create_student("Mary", "mary@example.com", age=19, year=1)
+        course = reg.create_course("Python 101", "Intro to Python", inst.id, year=1)
+        reg.enroll_many(course.id, iter([student.id, other.id]))
+        reg.set_grade(inst.id, course.id, student.id, 66.0)
+        reg.unenroll_student_from_course(other.id, course.id)
+        return inst, student, course
+
+    def recovered(self):
+        reg = Registry()
+        reg.recover(self.snapshot, self.journal_path)
+        return reg
+
+    def test_replay_without_snapshot(self):
+        """Test that work survives a crash that happened before any save."""
+        reg = Registry()
+        reg.attach_journal(Journal(self.journal_path), self.snapshot)
+        _, student, course = self.populate(reg)
+        # no save: simulate a crash by just dropping the registry
+        loaded = self.recovered()
+        self.assertEqual(loaded.get_course(course.id).roster, [student.id])
+        self.assertEqual(loaded.get_course(course.id).grades, {student.id: 66.0})
+        self.assertEqual(loaded._next_person_id, reg._next_person_id)
+
+    def test_torn_last_line_is_ignored(self):
+        """Test that a partially written entry is dropped on recovery and on reopen."""
+        reg = Registry()
+        reg.attach_journal(Journal(self.journal_path), self.snapshot)
+        self.populate(reg)
+        reg.detach_journal().close()
+        with open(self.journal_path, "a") as f:
+            f.write('{"seq": 99, "op": "set_gr')
+        journal = Journal(self.journal_path)
+        self.assertEqual(journal.seq, 7)
+        journal.close()
+        self.assertEqual(len(self.recovered().list_students()), 2)
+
+    def test_compaction_then_more_changes(self):
+        """Test replay on top of a snapshot written by background compaction."""
+        reg = Registry()
+        reg.attach_journal(Journal(self.journal_path, fsync_every=10), self.snapshot, compact_every=3)
+        inst, student, course = self.populate(reg)
+        if reg._compaction is not None:
+            reg._compaction.join()
+        reg.set_grade(inst.id, course.id, student.id, 99.0)
+        reg.create_student("Late Comer", "late@example.com", age=20, year=2)
+        reg._journal.sync()
+        if reg._compaction is not None:
+            reg._compaction.join()
+
+        with open(self.journal_path) as f:
+            self.assertLess(len(f.readlines()), 7)
+        loaded = self.recovered()
+        self.assertEqual(loaded.get_course(course.id).grades, {student.id: 99.0})
+        self.assertIsNotNone(loaded.find_students_by_email("late@example.com"))
+        self.assertEqual(loaded._next_person_id, reg._next_person_id)
+
+    def test_failed_snapshot_write_keeps_snapshot_and_journal(self):
+        """Test a compaction that dies mid-write leaves the last snapshot whole and the journal untruncated."""
+        self.snapshot = os.path.join(self.tmp.name, "data.json")
+        reg = Registry()
+        reg.attach_journal(Journal(self.journal_path), self.snapshot)
+        inst, student, course = self.populate(reg)
+        reg.compact_journal()
+        reg.set_grade(inst.id, course.id, student.id, 80.0)
+        real_dump = json.dump
+
+        def torn_dump(data, f, **kwargs):
+            f.write('{"students": [')
+            raise OSError("disk full")
+
+        json.dump = torn_dump
+        try:
+            with self.assertRaises(OSError):
+                reg.compact_journal()
+        finally:
+            json.dump = real_dump
+        reg.detach_journal().close()
+        self.assertEqual(self.recovered().get_course(course.id).grades, {student.id: 80.0})
+
+
+
+class TestSQLiteBackend(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp.name, "scms.db")
+        self.reg = Registry(backend=SQLiteBackend(self.db_path, batch_size=3))
+        self.inst = self.reg.create_instructor("Dr Test", "dr.test@example.com")
+        self.student = self.reg.create_student("john", "john@example.com", age=15, year=3, student_type="graduate")
+        self.other = self.reg.create_student("Mary", "mary@example.com", age=19, year=1)
+        self.course = self.reg.create_course("Python 101", "Intro to Python", self.inst.id, year=1)
+        self.reg.enroll_many(self.course.id, [self.student.id, self.other.id])
+        self.reg.set_grade(self.inst.id, self.course.id, self.student.id, 80.0)
+        self.reg.set_grade(self.inst.id, self.course.id, self.other.id, 60.0)
+        self.reg.unenroll_student_from_course(self.other.id, self.course.id)
+        self.reg.flush()
+
+    def tearDown(self):
+        self.reg._backend.close()
+        self.tmp.cleanup()
+
+    def test_entities_load_on_demand(self):
+        """Test that a fresh registry only materializes what it is asked for."""
+        reg = Registry(backend=SQLiteBackend(self.db_path))
+        self.assertEqual(len(reg._students), 0)
+        self.assertEqual(reg.find_students_by_email("JOHN@example.com").student_type, "graduate")
+        self.assertEqual(list(reg._students), [self.student.id])
+        self.assertEqual(reg.course_roster(self.course.id), [self.student.id])
+        self.assertEqual(reg.course_grade_summary(self.course.id)["mean"], 80.0)
+        self.assertEqual(len(reg._courses), 0)
+        self.assertEqual(reg.get_course(self.course.id).grades, {self.student.id: 80.0})
+        self.assertEqual(reg.get_instructor(self.inst.id).courses, [self.course.id])
+        self.assertEqual([s.id for s in reg.find_students_by_year(1)], [self.other.id])
+        self.assertEqual((reg._next_person_id, reg._next_course_id), (self.reg._next_person_id, self.reg._next_course_id))
+        with self.assertRaises(ValueError):
+            reg.create_student("John Again", "john@EXAMPLE.com", age=16, year=1)
+        self.assertEqual(len(reg.list_students()), 2)
+        reg._backend.close()
+
+    def test_copy_from_memory_matches(self):
+        """Test migrating an in-memory registry and reading it back."""
+        source = Registry()
+        inst = source.create_instructor("Dr Copy", "copy@example.com")
+        student = source.create_student("Ann", "ann@example.com", age=20, year=2)
+        course = source.create_course("Databases", "Intro to SQL", inst.id, year=2)
+        source.enroll_student_in_course(student.id, course.id)
+        source.set_grade(inst.id, course.id, student.id, 91.0)
+        copy_path = os.path.join(self.tmp.name, "copy.db")
+        backend = SQLiteBackend(copy_path)
+        copy_to_backend(source, backend)
+        reg = Registry(backend=backend)
+        for name in ("list_students", "list_instructors", "list_courses"):
+            # the backend does not store course versions; its courses get new ones when read
+            self.assertEqual([{k: v for k, v in e.to_dict().items() if k != "version"} for e in getattr(reg, name)().values()],
+                             [{k: v for k, v in e.to_dict().items() if k != "version"} for e in getattr(source, name)().values()])
+        backend.close()
+
+    def test_transaction_students_do_not_hide_stored_ones(self):
+        """Test listing inside and after a transaction still reads the students only the database has."""
+        reg = Registry(backend=SQLiteBackend(self.db_path))
+        with reg.transaction():
+            created = [reg.create_student(name, f"{name.lower()}@example.com", age=20, year=1)
+                       for name in ("Ann", "Bob", "Cy")]
+            self.assertEqual(len(reg.list_students()), 5)
+        self.assertEqual(sorted(reg.list_students()), sorted([self.student.id, self.other.id] + [s.id for s in created]))
+        reg._backend.close()
+
+    def test_failed_backend_write_keeps_journal_and_database_unchanged(self):
+        """Test a backend error while committing leaves the journal, the database and the registry as before."""
+        journal_path = os.path.join(self.tmp.name, "data.journal")
+        self.reg.attach_journal(Journal(journal_path, fsync_every=0), os.path.join(self.tmp.name, "data.json"))
 
-        # os.remove(test_file) # Clean up test file if does not cause issues by uncommenting this line
+        def locked(*args):
+            raise sqlite3.OperationalError("database is locked")
+        self.reg._backend.add_enrollments = locked
+        with self.assertRaises(sqlite3.OperationalError):
+            with self.reg.transaction():
+                bob = self.reg.create_student("Bob", "bob@example.com", age=21, year=2)
+                self.reg.enroll_student_in_course(bob.id, self.course.id)
+        self.reg.detach_journal().close()
+        self.assertEqual(list(read_journal(journal_path)), [])
+        self.assertIsNone(self.reg.find_students_by_email("bob@example.com"))
+        self.assertEqual(self.reg.course_roster(self.course.id), [self.student.id])
+        self.reg.flush()
+        reg = Registry(backend=SQLiteBackend(self.db_path))
+        self.assertEqual(len(reg.list_students()), 2)
+        reg._backend.close()
 
 if __name__ == "__main__":
     test_result = unittest.main(exit=False)
     if test_result.result.wasSuccessful():
-        print("Deal done 👏👏💪\ntest done successful and there is no error")
\ No newline at end of file
+        print("Deal done 👏👏💪\ntest done successful and there is no error")
@@ -0,0 +1,89 @@
+"""
+All-or-nothing groups of Registry mutations (``Registry.transaction``).
+
+Inside ``with registry.transaction():`` mutations change the registry
+straight away, as they always do, and each one also logs how to undo
+itself. When the block raises, the undo log runs backwards. A rollback
+therefore costs O(changes), not a reload of the data file.
+
+Journal entries, storage backend writes and change events (see ``events``)
+are held back until the block succeeds. The journal then gets them as one ``transaction`` line, with one
+write and one fsync. After a crash, recovery replays either all of the
+block or none of it. The backend writes are applied first, as one backend
+batch, so a backend error fails the commit before the journal line is written.
+
+A transaction holds the journal lock and, on a thread-safe registry, the
+registry write lock. Every registry lookup takes the read lock, so other
+threads wait for the commit or rollback instead of seeing a half-made change.
+Entity objects a thread fetched before the transaction began are not covered.
+A nested ``transaction()`` is a savepoint: if its block raises,
+only the changes made since the savepoint are undone.
+"""
+import json
+import threading
+from contextlib import nullcontext
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+
+class Transaction:
+    def __init__(self, registry):
+        self.registry = registry
+        self.owner = threading.get_ident()
+        self._undo: List[Tuple[Callable, tuple]] = []
+        self._entries: List[str] = []  # journal entries, already serialized
+        self._writes: List[Tuple[str, tuple]] = []  # deferred backend calls
+        self._events: List = []  # change events, published on commit
+        self._start = self.savepoint()
+
+    def record(self, undo: Callable, *args) -> None:
+        self._undo.append((undo, args))
+
+    def log(self, op: str, arguments: Dict, result=None) -> None:
+        # serialized now, so later changes to a caller's list cannot alter the entry
+        entry = {"op": op, "args": arguments}
+        if result is not None:
+            entry["result"] = result
+        self._entries.append(json.dumps(entry, separators=(",", ":")))
+
+    def defer(self, operation: str, args: tuple) -> None:
+        self._writes.append((operation, args))
+
+    def emit(self, events: Sequence) -> None:
+        self._events.extend(events)
+
+    def savepoint(self) -> Tuple[int, ...]:
+        registry = self.registry
+        return (len(self._undo), len(self._entries), len(self._writes), len(self._events),
+                registry._next_person_id, registry._next_course_id)
+
+    def rollback(self, savepoint: Optional[Tuple[int, ...]] = None) -> None:
+        """Undo everything since ``savepoint``, or since the transaction began."""
+        undo_mark, entries_mark, writes_mark, events_mark, next_person_id, next_course_id = savepoint or self._start
+        while len(self._undo) > undo_mark:
+            undo, args = self._undo.pop()
+            undo(*args)
+        del self._entries[entries_mark:]
+        del self._writes[writes_mark:]
+        del self._events[events_mark:]
+        self.registry._next_person_id = next_person_id
+        self.registry._next_course_id = next_course_id
+
+    def commit(self) -> None:
+        """
+        Apply the deferred backend writes, then append the journal entry. If
+        either raises, the backend batch is rolled back and the journal is
+        not written, so the caller's rollback leaves all three in agreement.
+        """
+        registry = self.registry
+        backend = registry._backend if self._writes else None
+        with registry._backend_lock, backend.batch() if backend is not None else nullcontext():
+            for operation, args in self._writes:
+                getattr(backend, operation)(*args)
+            if self._entries:
+                registry._journal.append_batch(self._entries)
+        if self._events and registry._events is not None:
+            registry._events.publish(self._events)
+        self._undo.clear()
+        self._entries.clear()
+        self._writes.clear()
+        self._events = []
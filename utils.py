@@ -1,18 +1,76 @@
+import os
 import re
+import threading
+from contextlib import contextmanager
+
+_validation = threading.local()
+
+# compiled once at import; the validators below run for every person created
+EMAIL_PATTERN = re.compile(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$')
+NAME_PATTERN = re.compile(r'^[a-zA-Z\s]+$')
+
+
+@contextmanager
+def trusted_data():
+    """
+    Skip field validation for entities built inside this block, for data that
+    was already validated when it was written (e.g. a trusted snapshot).
+    """
+    depth = getattr(_validation, "skip", 0)
+    _validation.skip = depth + 1
+    try:
+        yield
+    finally:
+        _validation.skip = depth
+
+
+def validation_enabled():
+    return not getattr(_validation, "skip", 0)
+
+
+def replace_durably(tmp_path, file_path):
+    """
+    Move ``tmp_path``, already written and fsynced, over ``file_path`` and
+    fsync the directory, so after a crash one of the two files is there, whole.
+    """
+    os.replace(tmp_path, file_path)
+    fsync_directory(file_path)
+
+
+def fsync_directory(path):
+    """Make renames and deletions of ``path`` (a file in the directory) durable."""
+    if os.name == "nt":
+        return  # directories cannot be opened, and NTFS journals renames
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
 
 def validate_email(email):
     """
     Validate the given email address using a regular expression.
     """
-    email_regex = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-    return re.match(email_regex, email) is not None
+    return EMAIL_PATTERN.match(email) is not None
 
 def validate_name(name):
     """
     Validate the given name to ensure it contains only alphabetic characters and spaces.
     """
-    name_regex = r'^[a-zA-Z\s]+$'
-    return re.match(name_regex, name) is not None
+    return NAME_PATTERN.match(name) is not None
+
+def person_errors(name, email, age):
+    """
+    Every problem with a person's fields, in the order ``person`` checks them.
+    """
+    errors = []
+    if not validate_name(name):
+        errors.append("Invalid name: name  must contain letters spaces and apostrophes only")
+    if not validate_email(email):
+        errors.append("Invalid email address")
+    if not valid_age(age):
+        errors.append("Invalid age: age must be between 10 and 30")
+    return errors
 
 def nonempty(value):
     """